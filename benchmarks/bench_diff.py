@@ -0,0 +1,58 @@
+# PYTHONPATH=src python benchmarks/bench_diff.py [--lengths 500 2000 ...] [--repeat N]
+"""
+Alignment diff speed as a function of transcript length.
+
+Times difflib.SequenceMatcher(autojunk=False) against the integer-encoded
+engine in utils_diff on the (g_tok_prime, g_tok) pair that
+build_alignment diffs, and checks both give identical opcodes.  Inputs are
+Switchboard-like: Zipfian tokens, ~10% of them disfluent (tagged), and a
+generated text that drops most disfluencies and a few fluent tokens.
+"""
+import argparse
+import random
+import time
+
+from zscore.utils_diff import ENGINES, sequence_matcher
+
+
+def synthetic_pair(n_tokens, rng, vocab_size=2000, disfluent_rate=0.1):
+    vocab = [f"w{i}" for i in range(vocab_size)]
+    weights = [1 / (rank + 1) for rank in range(vocab_size)]
+    tokens = rng.choices(vocab, weights, k=n_tokens)
+    tags = ["EDITED" if rng.random() < disfluent_rate else "NONE" for _ in tokens]
+    g_tok_prime = [w if t == "NONE" else f"{w}§{t}" for w, t in zip(tokens, tags)]
+    g_tok = [w for w, t in zip(tokens, tags) if (t == "NONE" or rng.random() < 0.2) and rng.random() < 0.97]
+    return g_tok_prime, g_tok
+
+
+def bench(engine, a, b, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        opcodes = sequence_matcher(a, b, engine=engine).get_opcodes()
+        best = min(best, time.perf_counter() - start)
+    return best, opcodes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[250, 500, 1000, 2000, 5000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'tokens':>8} " + " ".join(f"{e:>10}" for e in ENGINES) + "   speedup")
+    for n_tokens in args.lengths:
+        a, b = synthetic_pair(n_tokens, rng)
+        times, results = [], []
+        for engine in ENGINES:
+            seconds, opcodes = bench(engine, a, b, args.repeat)
+            times.append(seconds)
+            results.append(opcodes)
+        assert all(r == results[0] for r in results), f"engines disagree at {n_tokens} tokens"
+        print(f"{n_tokens:>8} " + " ".join(f"{t * 1000:>8.1f}ms" for t in times) + f"   {times[0] / times[-1]:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
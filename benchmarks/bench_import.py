@@ -0,0 +1,64 @@
+# PYTHONPATH=src python benchmarks/bench_import.py [--repeat N] [--top K]
+"""
+Import time of the zscore entry points, in fresh interpreters.
+
+For each module, reports the best wall time of `python -c "import ..."`
+over --repeat runs, which heavy dependencies the import pulled in, and
+the slowest imports according to `python -X importtime`.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+MODULES = ("zscore.cli", "zscore.zscore", "zscore.utils_evaluate", "zscore.utils_references")
+HEAVY = ("pandas", "nltk", "icecream", "pyarrow")
+
+
+def run(code, *flags):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, ["src", os.environ.get("PYTHONPATH")])))
+    return subprocess.run([sys.executable, *flags, "-c", code], env=env, capture_output=True, text=True, check=True)
+
+
+def best_wall_time(module, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(f"import {module}")
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def loaded_heavy(module):
+    out = run(f"import sys, {module}; print(' '.join(m for m in {HEAVY!r} if m in sys.modules))").stdout
+    return out.split()
+
+
+def slowest_imports(module, top):
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    rows = []
+    for line in run(f"import {module}", "-X", "importtime").stderr.splitlines()[1:]:
+        _, self_us, cumulative_us, name = [x.strip() for x in line.replace("import time:", "|").split("|")]
+        rows.append((int(cumulative_us), name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = best_wall_time("sys", args.repeat)
+    print(f"{'interpreter':>24}: {baseline * 1e3:7.1f} ms")
+    for module in MODULES:
+        seconds = best_wall_time(module, args.repeat)
+        heavy = ", ".join(loaded_heavy(module)) or "-"
+        print(f"{module:>24}: {seconds * 1e3:7.1f} ms  (+{(seconds - baseline) * 1e3:.1f} ms)  heavy: {heavy}")
+        for cumulative_us, name in slowest_imports(module, args.top):
+            print(f"{'':>28}{cumulative_us / 1e3:7.1f} ms  {name.strip()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# PYTHONPATH=src python benchmarks/bench_suite.py [--output FILE.json] [--compare OLD.json]
+"""
+End-to-end benchmark suite on synthetic Switchboard-like data.
+
+For each point of two scaling curves,
+  tokens : tokens per conversation (--tokens) at --base-rows rows
+  rows   : rows in the input CSV (--rows) at --base-tokens tokens per conversation
+it generates a corpus and outputs (see synthetic_corpus.py) and times
+  read_file       tb.read_file on every conversation
+  extract_tokens  extract_tokens(return_tags=True) on every tree
+  align           align for every row
+  metrics         e_prf and z_eip on every alignment
+  evaluate_file   evaluate_file on the CSV with a fresh ReferenceCache
+taking the best of --repeat runs.  Results go to --output as JSON, with
+enough metadata (commit, versions, arguments) to compare runs; --compare
+prints the speed ratio of every matching measurement against an older
+results file.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from synthetic_corpus import DEFAULTS, reference, write_corpus, write_outputs
+from zscore import __version__, tb
+from zscore.utils_evaluate import align, e_prf, z_eip
+from zscore.utils_process_trees import extract_tokens
+from zscore.utils_references import ReferenceCache
+from zscore.zscore import evaluate_file
+
+STAGES = ("read_file", "extract_tokens", "align", "metrics", "evaluate_file")
+
+
+def best_of(repeat, fn):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run_point(base, n_files, tokens, n_rows, repeat, rates, seed):
+    """Time every stage on one synthetic corpus; returns {stage: (seconds, items, unit)}."""
+    ids = write_corpus(base, n_files, tokens, seed=seed, **rates)
+    paths = [os.path.join(base, file_id[2], file_id) for file_id in ids]
+    csv_path = os.path.join(base, "outputs.csv")
+    rows = write_outputs(csv_path, base, ids, n_rows, seed=seed)
+    references = {file_id: reference(path) for file_id, path in zip(ids, paths)}
+    n_tokens = sum(len(tokens) for tokens, _ in references.values())
+
+    timings = {}
+    seconds, trees = best_of(repeat, lambda: [tree for path in paths for tree in tb.read_file(path)])
+    timings["read_file"] = (seconds, len(trees), "trees")
+    seconds, _ = best_of(repeat, lambda: [extract_tokens(tree, return_tags=True) for tree in trees])
+    timings["extract_tokens"] = (seconds, n_tokens, "tokens")
+    seconds, alignments = best_of(repeat, lambda: [align(*references[file_id], text) for file_id, text in rows])
+    timings["align"] = (seconds, len(rows), "rows")
+    seconds, _ = best_of(repeat, lambda: [(e_prf(a), z_eip(a)) for a in alignments])
+    timings["metrics"] = (seconds, len(rows), "rows")
+
+    def end_to_end():
+        with contextlib.redirect_stdout(io.StringIO()):
+            evaluate_file(csv_path, cache=ReferenceCache(base_dir=base))
+    seconds, _ = best_of(repeat, end_to_end)
+    timings["evaluate_file"] = (seconds, len(rows), "rows")
+    return timings
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measurement_key(result):
+    return result["curve"], result["stage"], result["tokens_per_conversation"], result["rows"]
+
+
+def compare(old_path, results):
+    with open(old_path, encoding="utf-8") as f:
+        old = {measurement_key(r): r for r in json.load(f)["results"]}
+    print(f"\nspeedup vs {old_path} (>1 is faster)")
+    for result in results:
+        before = old.get(measurement_key(result))
+        if before is not None:
+            curve, stage, tokens, rows = measurement_key(result)
+            print(f"{curve:>7} {stage:>15} tokens={tokens:<6} rows={rows:<6} "
+                  f"{before['seconds'] / result['seconds']:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, nargs="+", default=[500, 2000, 8000])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--base-tokens", type=int, default=2000)
+    parser.add_argument("--base-rows", type=int, default=200)
+    parser.add_argument("--files", type=int, default=10, help="conversations per corpus")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    for name, value in DEFAULTS.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=type(value), default=value)
+    parser.add_argument("--output", default=None, help="results JSON (default: bench_<commit>.json)")
+    parser.add_argument("--compare", default=None, metavar="OLD_JSON")
+    args = parser.parse_args()
+
+    rates = {name: getattr(args, name) for name in DEFAULTS}
+    points = [("tokens", tokens, args.base_rows) for tokens in args.tokens]
+    points += [("rows", args.base_tokens, rows) for rows in args.rows]
+
+    results = []
+    print(f"{'curve':>7} {'stage':>15} {'tokens':>7} {'rows':>6} {'seconds':>9} {'rate':>14}")
+    for curve, tokens, n_rows in points:
+        with tempfile.TemporaryDirectory() as base:
+            timings = run_point(base, args.files, tokens, n_rows, args.repeat, rates, args.seed)
+        for stage in STAGES:
+            seconds, items, unit = timings[stage]
+            results.append({
+                "curve": curve, "stage": stage, "tokens_per_conversation": tokens, "rows": n_rows,
+                "seconds": seconds, "items": items, "unit": unit, "per_second": items / seconds,
+            })
+            print(f"{curve:>7} {stage:>15} {tokens:>7} {n_rows:>6} {seconds:>9.4f} {items / seconds:>9.0f} {unit}/s")
+
+    commit = git_commit()
+    output = args.output or f"bench_{(commit or 'unknown')[:10]}.json"
+    meta = {
+        "commit": commit,
+        "zscore": __version__,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "args": vars(args),
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"Saved results to {output}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# PYTHONPATH=src:. python benchmarks/bench_tb.py [--mrg-dir DIR] [--repeat N]
+"""
+Throughput of the treebank reader over the whole Switchboard mrg tree.
+
+Compares the original recursive reader (kept in tests/test_tb.py) with
+the single-pass stack reader of tb.string_trees and checks that both
+produce identical trees.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from tests.test_tb import recursive_string_trees
+from zscore import tb
+from zscore.utils_dirs import TREEBANK_MRG_DIR
+
+ENGINES = {
+    "recursive": recursive_string_trees,
+    "stack": tb.string_trees,
+}
+
+
+def load_files(mrg_dir):
+    contents = []
+    for path in sorted(Path(mrg_dir).rglob("sw*.mrg")):
+        with open(path, "r", encoding="utf-8") as f:
+            s = f.read()
+        contents.append(s[tb.header_end(s):])
+    return contents
+
+
+def bench(engine, contents, repeat):
+    best = float("inf")
+    n_trees = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n_trees = sum(len(engine(s)) for s in contents)
+        best = min(best, time.perf_counter() - start)
+    return best, n_trees
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mrg-dir", default=str(TREEBANK_MRG_DIR))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    contents = load_files(args.mrg_dir)
+    if not contents:
+        sys.exit(f"No sw*.mrg files found under {args.mrg_dir}")
+    n_bytes = sum(len(s.encode("utf-8")) for s in contents)
+
+    for s in contents:
+        if recursive_string_trees(s) != tb.string_trees(s):
+            sys.exit("Engines disagree; aborting benchmark")
+
+    print(f"{len(contents)} files, {n_bytes / 1e6:.1f} MB")
+    for name, engine in ENGINES.items():
+        seconds, n_trees = bench(engine, contents, args.repeat)
+        print(f"{name:>10}: {seconds:6.2f}s  {n_bytes / 1e6 / seconds:7.2f} MB/s  {n_trees / seconds:9.0f} trees/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# PYTHONPATH=src python benchmarks/bench_tb_compact.py [--mrg-dir DIR]
+"""
+Memory and speed of tb_compact forests against tb's nested lists.
+
+Loads every sw*.mrg file both ways, reports the traced bytes per node of
+each, and times disfluency-tag extraction (extract_file_tokens on the
+lists, tb_compact.extract_tokens on the forest), checking they agree.
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from zscore import tb, tb_compact
+from zscore.utils_dirs import TREEBANK_MRG_DIR
+from zscore.utils_process_trees import extract_file_tokens
+
+
+def traced(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, seconds, size
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mrg-dir", default=str(TREEBANK_MRG_DIR))
+    args = parser.parse_args()
+
+    paths = sorted(Path(args.mrg_dir).rglob("sw*.mrg"))
+    if not paths:
+        sys.exit(f"No sw*.mrg files found under {args.mrg_dir}")
+
+    trees, _, nested_bytes = traced(lambda: [tree for path in paths for tree in tb.read_file(path)])
+    (forest, _), _, compact_bytes = traced(lambda: tb_compact.read_files(paths))
+    n_nodes = len(forest.label)
+    print(f"{len(paths)} files, {len(forest)} trees, {n_nodes} nodes")
+    print(f"    nested: {nested_bytes / 1e6:8.1f} MB  {nested_bytes / n_nodes:6.1f} B/node")
+    print(f"   compact: {compact_bytes / 1e6:8.1f} MB  {compact_bytes / n_nodes:6.1f} B/node"
+          f"  ({forest.nbytes / n_nodes:.1f} B/node in arrays)")
+
+    nested, nested_s = timed(lambda: extract_file_tokens(trees, return_tags=True))
+    compact, compact_s = timed(lambda: tb_compact.extract_tokens(forest, return_tags=True))
+    if (nested.tokens, nested.tags) != (compact.tokens, compact.tags):
+        sys.exit("Representations disagree; aborting benchmark")
+    print(f"extract_tokens: nested {nested_s:.2f}s  compact {compact_s:.2f}s  ({len(compact.tokens)} tokens)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# PYTHONPATH=src:. python benchmarks/bench_tb_transforms.py [--mrg-dir DIR] [--repeat N]
+"""
+Iterative tb traversals and transforms against their recursive versions.
+
+Times each of prune (and prune_trees), map_labels, map_subtrees,
+tree_copy, tree_constituents and the generator walkers over every tree
+of the Switchboard mrg files, after checking that both versions give
+identical results.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from tests import test_tb
+from zscore import tb
+from zscore.utils_dirs import TREEBANK_MRG_DIR
+
+PRUNE_OPTIONS = {"remove_empty": True, "remove_punctuation": True, "collapse_unary": True, "binarise": True,
+                 "relabel": tb.label_category}
+
+CASES = {
+    "prune": (lambda trees: [tb.prune(t, **PRUNE_OPTIONS) for t in trees],
+              lambda trees: [test_tb.recursive_prune(t, **PRUNE_OPTIONS) for t in trees]),
+    "prune_trees": (lambda trees: tb.prune_trees(trees, **PRUNE_OPTIONS),
+                    lambda trees: [test_tb.recursive_prune(t, **PRUNE_OPTIONS) for t in trees]),
+    "map_labels": (lambda trees: [tb.map_labels(t, str.lower) for t in trees],
+                   lambda trees: [test_tb.recursive_map_labels(t, str.lower) for t in trees]),
+    "map_subtrees": (lambda trees: [tb.map_subtrees(t, lambda x: x) for t in trees],
+                     lambda trees: [test_tb.recursive_map_subtrees(t, lambda x: x) for t in trees]),
+    "tree_copy": (lambda trees: [tb.tree_copy(t) for t in trees],
+                  lambda trees: [test_tb.recursive_tree_copy(t) for t in trees]),
+    "tree_constituents": (lambda trees: [tb.tree_constituents(t) for t in trees],
+                          lambda trees: [test_tb.recursive_tree_constituents(t) for t in trees]),
+}
+for _name in ("tree_nodes", "tree_terminals", "tree_preterminalnodes", "tree_phrasalnodes"):
+    CASES[_name] = ((lambda f: lambda trees: [list(f(t)) for t in trees])(getattr(tb, _name)),
+                    (lambda f: lambda trees: [list(f(t)) for t in trees])(getattr(test_tb, f"recursive_{_name}")))
+
+
+def best_of(repeat, fn, trees):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(trees)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mrg-dir", default=str(TREEBANK_MRG_DIR))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    trees = [tree for path in sorted(Path(args.mrg_dir).rglob("sw*.mrg")) for tree in tb.read_file(path)]
+    if not trees:
+        sys.exit(f"No sw*.mrg files found under {args.mrg_dir}")
+    print(f"{len(trees)} trees")
+    for name, (iterative, recursive) in CASES.items():
+        if iterative(trees) != recursive(trees):
+            sys.exit(f"{name}: versions disagree; aborting benchmark")
+        new, old = best_of(args.repeat, iterative, trees), best_of(args.repeat, recursive, trees)
+        print(f"{name:>22}: recursive {old:6.2f}s  iterative {new:6.2f}s  ({old / new:4.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
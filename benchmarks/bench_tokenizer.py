@@ -0,0 +1,78 @@
+# PYTHONPATH=src python benchmarks/bench_tokenizer.py [--mrg-dir DIR] [--max-files N] [--repeat N] [--copies K]
+"""
+Tokens/sec of the generated-text tokenizers used by align.
+
+Tokenizes the fluent and disfluent text of every Switchboard conversation
+(or synthetic text if the treebank is missing), each text --copies times
+to mimic many prompts producing the same output, with
+  nltk  : str.translate + TreebankWordTokenizer + lowercasing (the old align path)
+  fast  : utils_evaluate.TreebankTokenizer without a text memo
+  memo  : the same with a memo of GENERATED_MEMO_SIZE texts (what align uses)
+and checks that all three produce identical tokens.
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+from zscore.utils_dirs import TREEBANK_MRG_DIR
+from zscore.utils_evaluate import GENERATED_MEMO_SIZE, TreebankTokenizer, get_tokenizer
+from zscore.utils_process_trees import get_text_dual_from_file
+
+WORDS = ("uh um i you we they it's don't can't gonna wanna well yeah so like know think "
+         "the a of to and that was is in it really just i'm they're we've well-known").split()
+
+
+def load_texts(mrg_dir, max_files):
+    texts = []
+    for path in sorted(Path(mrg_dir).rglob("sw*.mrg"))[:max_files]:
+        texts.extend(get_text_dual_from_file(str(path)))
+    if texts:
+        return texts
+    rng = random.Random(0)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 60))) + rng.choice(".?,")
+            for _ in range(2000)]
+
+
+def nltk_tokenize(text, strip=str.maketrans("", "", ",.!?")):
+    return [w.lower() for w in get_tokenizer().tokenize(text.translate(strip))]
+
+
+def bench(make_tokenize, texts, repeat):
+    best = float("inf")
+    n_tokens = 0
+    for _ in range(repeat):
+        tokenize = make_tokenize()  # a fresh tokenizer per run, so memos start empty
+        start = time.perf_counter()
+        n_tokens = sum(len(tokenize(text)) for text in texts)
+        best = min(best, time.perf_counter() - start)
+    return best, n_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mrg-dir", default=str(TREEBANK_MRG_DIR))
+    parser.add_argument("--max-files", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--copies", type=int, default=4)
+    args = parser.parse_args()
+
+    texts = load_texts(args.mrg_dir, args.max_files)
+    texts = [text for text in texts for _ in range(args.copies)]
+    tokenizers = {
+        "nltk": lambda: nltk_tokenize,
+        "fast": lambda: TreebankTokenizer(lowercase=True, strip=",.!?").tokenize,
+        "memo": lambda: TreebankTokenizer(lowercase=True, strip=",.!?", memo_size=GENERATED_MEMO_SIZE).tokenize,
+    }
+    fast = tokenizers["fast"]()
+    if any(fast(text) != nltk_tokenize(text) for text in texts):
+        sys.exit("Tokenizers disagree; aborting benchmark")
+
+    print(f"{len(texts)} texts ({len(set(texts))} distinct)")
+    for name, make_tokenize in tokenizers.items():
+        seconds, n_tokens = bench(make_tokenize, texts, args.repeat)
+        print(f"{name:>6}: {seconds:6.2f}s  {n_tokens / seconds:10.0f} tokens/s")
+
+if __name__ == "__main__":
+    main()
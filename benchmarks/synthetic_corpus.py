@@ -0,0 +1,154 @@
+# PYTHONPATH=src python benchmarks/synthetic_corpus.py OUT_DIR [--files N] [--tokens N] [--rows N] [--edited-rate P] ...
+"""
+Synthetic Switchboard-like treebank and model outputs for benchmarks.
+
+Writes OUT_DIR/<digit>/swNNNN.mrg conversations in the Penn Treebank
+Switchboard format (header, speaker CODE trees, EDITED/INTJ/PRN
+constituents with -DFL- markers) and OUT_DIR/outputs.csv with filename
+and generated-text columns, where each output removes disfluencies and
+fluent tokens and adds hallucinated tokens at the given rates.
+"""
+import argparse
+import csv
+import os
+import random
+import re
+
+from zscore import tb
+from zscore.utils_process_trees import extract_tokens
+
+HEADER = "*x*" + " " * 60 + "*x*\n*x*  Synthetic Switchboard-like treebank for benchmarks.  *x*\n\n"
+FILLERS = ("uh", "um", "well", "like", "oh", "yeah")
+ASIDES = (("you", "know"), ("i", "mean"), ("i", "guess"))
+SYLLABLES = ("ba", "ko", "ri", "ta", "me", "lu", "so", "na", "de", "pi", "go", "ve")
+VOCAB = tuple(a + b + c for a in SYLLABLES for b in SYLLABLES for c in ("", "n", "s"))
+WEIGHTS = tuple(1 / (rank + 1) for rank in range(len(VOCAB)))  # Zipfian, like real text
+_WORD_LEAF_RE = re.compile(r"\((?!-DFL-|SYM|\. |, )\S+ [^()\s]+\)")  # preterminals that become tokens
+
+DEFAULTS = {
+    "tree_tokens": 10,     # mean fluent tokens per sentence
+    "edited_rate": 0.15,   # chance a sentence has an EDITED (reparandum) constituent
+    "intj_rate": 0.25,     # chance a sentence starts with an INTJ filler
+    "prn_rate": 0.05,      # chance a sentence has a PRN aside
+}
+
+
+def _words(rng, n):
+    return rng.choices(VOCAB, WEIGHTS, k=n)
+
+
+def _clause(words):
+    subject, verb, *rest = words
+    objects = " ".join(f"(NN {w})" for w in rest)
+    obj = f" (NP {objects})" if rest else ""
+    return f"(NP-SBJ (PRP {subject})) (VP (VBP {verb}){obj})"
+
+
+def synthetic_tree(rng, tree_tokens=10, edited_rate=0.15, intj_rate=0.25, prn_rate=0.05):
+    """One Switchboard-style sentence tree as PTB text."""
+    parts = []
+    if rng.random() < intj_rate:
+        parts.append(f"(INTJ (UH {rng.choice(FILLERS)})) (, ,)")
+    words = _words(rng, max(2, round(rng.expovariate(1 / tree_tokens))))
+    if rng.random() < edited_rate:
+        restart = words[:rng.randint(1, min(3, len(words) - 1))]
+        reparandum = " ".join(f"(NN {w})" for w in restart)
+        parts.append(f"(EDITED (RM (-DFL- \\[)) (NP {reparandum}) (, ,) (IP (-DFL- \\+)))")
+    clause = _clause(words)
+    if rng.random() < prn_rate:
+        a, b = rng.choice(ASIDES)
+        clause += f" (PRN (, ,) (S (NP-SBJ (PRP {a})) (VP (VBP {b}))) (, ,))"
+    parts.append(clause)
+    return "( (S " + " ".join(parts) + " (. .) (-DFL- E_S) ))"
+
+
+def synthetic_conversation(rng, n_tokens, **rates):
+    """A whole .mrg file with about n_tokens leaves, alternating speakers every few sentences."""
+    trees = []
+    total = 0
+    speaker = 0
+    while total < n_tokens:
+        if len(trees) % 5 == 0:
+            speaker += 1
+            trees.append(f"( (CODE (SYM Speaker{'AB'[speaker % 2]}{speaker}) (. .) ))")
+        tree = synthetic_tree(rng, **rates)
+        total += len(_WORD_LEAF_RE.findall(tree))
+        trees.append(tree)
+    return HEADER + "\n".join(trees) + "\n"
+
+
+def file_ids(n_files):
+    return [f"sw{2000 + k:04d}.mrg" for k in range(n_files)]
+
+
+def write_corpus(base, n_files, tokens_per_file, seed=0, **rates):
+    """Write n_files conversations under base in the parsed/mrg/swbd layout; returns their file ids."""
+    rng = random.Random(seed)
+    ids = file_ids(n_files)
+    for file_id in ids:
+        os.makedirs(os.path.join(base, file_id[2]), exist_ok=True)
+        with open(os.path.join(base, file_id[2], file_id), "w", encoding="utf-8") as f:
+            f.write(synthetic_conversation(rng, tokens_per_file, **{**DEFAULTS, **rates}))
+    return ids
+
+
+def synthetic_output(rng, tokens, tags, removal_rate=0.8, fluent_drop_rate=0.02, hallucination_rate=0.01):
+    """A model output for a reference: drops disfluent and fluent tokens, adds hallucinated ones."""
+    words = []
+    for token, tag in zip(tokens, tags):
+        if rng.random() >= (removal_rate if tag != "NONE" else fluent_drop_rate):
+            words.append(token)
+        if rng.random() < hallucination_rate:
+            words.append(rng.choice(VOCAB))
+    return " ".join(words)
+
+
+def reference(path):
+    """(tokens, tags) of a tree file, as ReferenceCache.get returns them."""
+    tokens, tags = [], []
+    for tree in tb.read_file(path):
+        for token, tag in extract_tokens(tree, return_tags=True)[2]:
+            tokens.append(token)
+            tags.append(tag)
+    return tokens, tags
+
+
+def write_outputs(csv_path, base, ids, n_rows, seed=0, **rates):
+    """Write n_rows (filename, generated-text) rows spread over ids; returns the rows."""
+    rng = random.Random(seed)
+    references = {file_id: reference(os.path.join(base, file_id[2], file_id)) for file_id in ids}
+    rows = []
+    for k in range(n_rows):
+        file_id = ids[k % len(ids)]
+        rows.append((file_id, synthetic_output(rng, *references[file_id], **rates)))
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["filename", "generated-text"])
+        writer.writerows(rows)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("out_dir")
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=2000, help="tokens per conversation")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    for name, value in DEFAULTS.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=type(value), default=value)
+    parser.add_argument("--removal-rate", type=float, default=0.8)
+    parser.add_argument("--fluent-drop-rate", type=float, default=0.02)
+    parser.add_argument("--hallucination-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    rates = {name: getattr(args, name) for name in DEFAULTS}
+    ids = write_corpus(args.out_dir, args.files, args.tokens, seed=args.seed, **rates)
+    csv_path = os.path.join(args.out_dir, "outputs.csv")
+    write_outputs(csv_path, args.out_dir, ids, args.rows, seed=args.seed, removal_rate=args.removal_rate,
+                  fluent_drop_rate=args.fluent_drop_rate, hallucination_rate=args.hallucination_rate)
+    print(f"Wrote {len(ids)} conversations and {args.rows} outputs ({csv_path})")
+
+
+if __name__ == "__main__":
+    main()
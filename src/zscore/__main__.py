@@ -0,0 +1,4 @@
+# python -m zscore input.csv [options]
+from zscore.cli import main
+
+main()
@@ -0,0 +1,125 @@
+# zscore input.csv [options]  (or: python -m zscore input.csv [options])
+import argparse
+import json
+
+from zscore.utils_alignments import ALIGNMENT_FORMATS
+from zscore.utils_evaluate import CorpusAggregator, json_nulls
+from zscore.utils_profile import PROFILE_MODES, StageTimer
+from zscore.utils_references import DEFAULT_MAX_TOKENS, ReferenceCache, ReferenceStore
+from zscore.utils_results import DEFAULT_MAX_ENTRIES, ResultCache
+from zscore.zscore import (DEFAULT_CHUNK_SIZE, OUTPUT_FORMATS, TEXT_COLUMN, evaluate_file, system_columns,
+                           system_name, systems_summary)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="zscore",
+        description="Score disfluency removal outputs (filename, generated-text CSV) with E-scores and Z-scores.",
+    )
+    parser.add_argument("input", help="CSV with filename and generated-text columns")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="worker processes (default: 1)")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="read, score and write this many rows at a time (default: whole file)")
+    parser.add_argument("--task-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"rows per task sent to a worker (default: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument("--treebank-dir", default=None,
+                        help="Switchboard parsed/mrg/swbd directory (default: data/treebank_3/parsed/mrg/swbd)")
+    parser.add_argument("--reference-store", default=None,
+                        help="memory-mapped store from python -m zscore.utils_references, used instead of parsing .mrg files")
+    parser.add_argument("--cache-tokens", type=int, default=DEFAULT_MAX_TOKENS,
+                        help="reference tokens kept in each process's cache")
+    parser.add_argument("--result-cache", default=None, metavar="PATH",
+                        help="SQLite file of per-row results reused across runs; only new rows are aligned")
+    parser.add_argument("--result-cache-entries", type=int, default=DEFAULT_MAX_ENTRIES,
+                        help="rows kept in the result cache before the least recently used are evicted")
+    parser.add_argument("-o", "--output", default=None,
+                        help="output path (default: eval__<input> next to the input)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv",
+                        help="output format (default: csv)")
+    parser.add_argument("--counts", action="store_true",
+                        help="also write the raw per-row counts")
+    parser.add_argument("--spans", action="store_true",
+                        help="also write the share of EDITED/INTJ/PRN spans removed completely, partially and not at all")
+    parser.add_argument("--alignments", default=None, metavar="DIR",
+                        help="save every row's per-token alignment in DIR, to re-score later with python -m "
+                             "zscore.utils_alignments DIR")
+    parser.add_argument("--alignments-format", choices=ALIGNMENT_FORMATS, default="arrow",
+                        help="arrow: memory-mapped, zero-copy re-scoring; parquet: smaller files (default: arrow)")
+    parser.add_argument("--systems", nargs="+", default=None, metavar="COLUMN",
+                        help="score several generated-text columns in one pass, one metrics block per system")
+    parser.add_argument("--all-systems", action="store_true",
+                        help=f"score every {TEXT_COLUMN}-* column (see --systems)")
+    parser.add_argument("--summary", action="store_true",
+                        help="print corpus-level micro/macro scores as JSON instead of writing per-row output")
+    parser.add_argument("--timings", default=None, metavar="PATH",
+                        help="write per-stage wall time, calls and token volumes as JSON")
+    parser.add_argument("--progress", type=float, default=None, metavar="SECONDS",
+                        help="print rows/sec and ETA to stderr at most every SECONDS")
+    parser.add_argument("--profile", default=None, metavar="PATH",
+                        help="profile the run into PATH (see --profile-mode)")
+    parser.add_argument("--profile-mode", choices=PROFILE_MODES, default="cprofile",
+                        help="cprofile: pstats file; stacks: sampled collapsed stacks for flame graphs")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.reference_store:
+        cache = ReferenceStore(args.reference_store)
+    else:
+        cache = ReferenceCache(max_tokens=args.cache_tokens, base_dir=args.treebank_dir)
+    result_cache = ResultCache(args.result_cache, args.result_cache_entries) if args.result_cache else None
+    text_columns = args.systems
+    if args.all_systems:
+        import pandas as pd
+        text_columns = system_columns(pd.read_csv(args.input, nrows=0).columns)
+        if not text_columns:
+            raise SystemExit(f"{args.input} has no {TEXT_COLUMN}-* columns")
+
+    if text_columns:
+        aggregator = {system_name(column): CorpusAggregator() for column in text_columns}
+    else:
+        aggregator = CorpusAggregator() if args.summary else None
+    timer = None
+    if args.timings or args.progress is not None:
+        timer = StageTimer(report_every=args.progress)
+    evaluate_file(
+        args.input,
+        cache=cache,
+        group_by_file=True,
+        workers=args.jobs,
+        chunk_size=args.task_size,
+        stream_rows=args.chunk_size,
+        with_counts=args.counts,
+        aggregator=aggregator,
+        output_path=args.output,
+        output_format=args.format,
+        write_output=not args.summary,
+        text_columns=text_columns,
+        result_cache=result_cache,
+        timer=timer,
+        profile=args.profile,
+        profile_mode=args.profile_mode,
+        span_metrics=args.spans,
+        alignments=args.alignments,
+        alignments_format=args.alignments_format,
+    )
+    if args.timings:
+        timer.write_json(args.timings)
+    if text_columns:
+        summary = systems_summary(aggregator)
+        if args.summary:
+            print(json.dumps(json_nulls({
+                "systems": {system: agg.result() for system, agg in aggregator.items()},
+                "summary": summary.to_dict(orient="index"),
+            }), indent=2, allow_nan=False))
+        else:
+            print(summary.to_string(float_format="{:.4f}".format))
+    elif aggregator is not None:
+        print(json.dumps(json_nulls(aggregator.result()), indent=2, allow_nan=False))
+
+
+if __name__ == "__main__":
+    main()
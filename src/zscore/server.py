@@ -0,0 +1,388 @@
+# python -m zscore.server (--socket PATH | --port N) [options]  (JSON lines in, JSON lines out)
+"""
+Long-running scoring server.
+
+References are loaded once and the alignment engine stays warm, so each
+request only pays for its own alignment.  Clients send one JSON object
+per line and get one back per line, in order:
+
+    {"id": 1, "filename": "sw2005.mrg", "generated_text": "..."}
+    {"id": 2, "rows": [["sw2005.mrg", "..."], ["sw2010.mrg", "..."]], "counts": true}
+    {"op": "stats"}    {"op": "ping"}
+
+Scores are {"id", "metrics", ["counts"], "latency_ms"}, with one metrics
+dict per row for "rows" requests and null for NaN.  Rows from concurrent
+requests are batched (up to batch_rows, waiting at most batch_wait
+seconds) and scored together, on a process pool if workers > 1.
+"""
+import argparse
+import json
+import math
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+
+from zscore.utils_evaluate import COUNT_COLUMNS, METRIC_COLUMNS, align, metrics_from_counts
+from zscore.utils_references import DEFAULT_MAX_TOKENS, ReferenceCache, ReferenceStore
+from zscore.zscore import DEFAULT_CHUNK_SIZE, make_executor, score_rows
+
+#  constants
+DEFAULT_BATCH_ROWS = 256
+DEFAULT_BATCH_WAIT = 0.002  # seconds to wait for more requests before scoring a batch
+LATENCY_WINDOW = 10_000     # recent requests the latency percentiles are taken over
+
+
+def warm_up():
+    """Run one tiny alignment so imports and the tokenizer are loaded before the first request."""
+    align(["uh", "i", "do"], ["INTJ", "NONE", "NONE"], "I don't")
+    return os.getpid()
+
+
+class ServerStats:
+    """Request, row and latency counters, safe to update from any thread."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.rows = 0
+        self.errors = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def add_batch(self):
+        with self._lock:
+            self.batches += 1
+
+    def add_request(self, n_rows, latency, error=False):
+        with self._lock:
+            self.requests += 1
+            self.rows += n_rows
+            self.errors += error
+            self.latencies.append(latency)
+
+    def result(self):
+        with self._lock:
+            uptime = time.perf_counter() - self.started
+            latencies = np.array(self.latencies) * 1e3
+            requests, rows, errors, batches = self.requests, self.rows, self.errors, self.batches
+        result = {
+            "uptime_s": uptime,
+            "requests": requests,
+            "rows": rows,
+            "errors": errors,
+            "batches": batches,
+            "rows_per_batch": rows / batches if batches else None,
+            "requests_per_s": requests / uptime,
+            "rows_per_s": rows / uptime,
+            "latency_ms": None,
+        }
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).tolist()
+            result["latency_ms"] = {"mean": latencies.mean().item(), "p50": p50, "p95": p95, "p99": p99,
+                                    "max": latencies.max().item()}
+        return result
+
+
+class Batcher:
+    """
+    Collects rows from concurrent requests and scores them together on one thread.
+
+    submit() returns a Future of the (n, len(COUNT_COLUMNS)) counts of its rows.
+    """
+
+    def __init__(self, cache, executor=None, chunk_size=DEFAULT_CHUNK_SIZE, batch_rows=DEFAULT_BATCH_ROWS,
+                 batch_wait=DEFAULT_BATCH_WAIT, stats=None, result_cache=None):
+        self.cache = cache
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.batch_rows = batch_rows
+        self.batch_wait = batch_wait
+        self.stats = stats
+        self.result_cache = result_cache
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="zscore-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, rows):
+        future = Future()
+        self._queue.put((list(rows), future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        n_rows = len(item[0])
+        deadline = time.perf_counter() + self.batch_wait
+        while n_rows < self.batch_rows:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # finish this batch, then stop
+                break
+            batch.append(item)
+            n_rows += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            rows = [row for request_rows, _ in batch for row in request_rows]
+            try:
+                counts = score_rows([file_id for file_id, _ in rows], [str(text) for _, text in rows], self.cache,
+                                    group_by_file=True, executor=self.executor, chunk_size=self.chunk_size,
+                                    result_cache=self.result_cache)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            if self.stats is not None:
+                self.stats.add_batch()
+            start = 0
+            for request_rows, future in batch:
+                future.set_result(counts[start:start + len(request_rows)])
+                start += len(request_rows)
+
+
+def _json_floats(values):
+    return [None if math.isnan(v) else v for v in values.tolist()]
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        app = self.server.app
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = app.handle_line(line)
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class EvaluationServer:
+    """
+    JSON-lines scoring server on a Unix socket (address is a path) or on
+    localhost TCP (address is a (host, port) pair; port 0 picks one).
+    """
+
+    def __init__(self, cache, address, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, batch_rows=DEFAULT_BATCH_ROWS,
+                 batch_wait=DEFAULT_BATCH_WAIT, result_cache=None):
+        self.cache = cache
+        self.stats = ServerStats()
+        self.executor = make_executor(cache, workers) if workers > 1 else None
+        warm_up()
+        if self.executor is not None:
+            list(self.executor.map(_warm_up_task, range(workers)))
+        self.batcher = Batcher(cache, self.executor, chunk_size, batch_rows, batch_wait, self.stats, result_cache)
+
+        if isinstance(address, (str, os.PathLike)):
+            if os.path.exists(address):
+                os.unlink(address)  # stale socket from an earlier run
+            self._server = _UnixServer(str(address), _Handler)
+        else:
+            self._server = _TCPServer(tuple(address), _Handler)
+        self._server.app = self
+        self.address = self._server.server_address
+        self._thread = None
+
+    def handle_line(self, line):
+        start = time.perf_counter()
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            self.stats.add_request(0, time.perf_counter() - start, error=True)
+            return {"error": f"invalid JSON: {e}"}
+        if not isinstance(request, dict):
+            self.stats.add_request(0, time.perf_counter() - start, error=True)
+            return {"error": "request must be a JSON object"}
+
+        op = request.get("op", "score")
+        if op == "ping":
+            return {"id": request.get("id"), "ok": True}
+        if op == "stats":
+            return {"id": request.get("id"), "stats": self.stats.result()}
+        try:
+            if op != "score":
+                raise ValueError(f"unknown op {op!r}")
+            if "rows" in request:
+                rows = [(file_id, text) for file_id, text in request["rows"]]
+            else:
+                rows = [(request["filename"], request["generated_text"])]
+            counts = self.batcher.submit(rows).result()
+        except Exception as e:
+            self.stats.add_request(0, time.perf_counter() - start, error=True)
+            return {"id": request.get("id"), "error": str(e)}
+
+        response = {"id": request.get("id")}
+        metrics = [dict(zip(METRIC_COLUMNS, _json_floats(m))) for m in metrics_from_counts(counts)]
+        response["metrics"] = metrics if "rows" in request else metrics[0]
+        if request.get("counts"):
+            row_counts = [dict(zip(COUNT_COLUMNS, _json_floats(c))) for c in counts]
+            response["counts"] = row_counts if "rows" in request else row_counts[0]
+        latency = time.perf_counter() - start
+        response["latency_ms"] = latency * 1e3
+        self.stats.add_request(len(rows), latency, error=bool(np.isnan(counts).any()))
+        return response
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        """Serve on a background thread (e.g. in tests); returns self."""
+        self._thread = threading.Thread(target=self.serve_forever, name="zscore-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        self.batcher.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _warm_up_task(_):
+    return warm_up()
+
+
+class Client:
+    """Blocking client for EvaluationServer; address as for the server."""
+
+    def __init__(self, address, timeout=None):
+        if isinstance(address, (str, os.PathLike)):
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(str(address))
+        else:
+            self._sock = socket.create_connection(tuple(address))
+        self._sock.settimeout(timeout)
+        self._file = self._sock.makefile("rwb")
+        self._next_id = 0
+
+    def request(self, payload):
+        self._next_id += 1
+        payload = {"id": self._next_id, **payload}
+        self._file.write(json.dumps(payload).encode("utf-8") + b"\n")
+        self._file.flush()
+        response = json.loads(self._file.readline())
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    def score(self, filename, generated_text, counts=False):
+        return self.request({"filename": filename, "generated_text": generated_text, "counts": counts})
+
+    def score_many(self, rows, counts=False):
+        return self.request({"rows": [list(row) for row in rows], "counts": counts})
+
+    def stats(self):
+        return self.request({"op": "stats"})["stats"]
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def preload(cache, mrg_dir):
+    """Parse every sw*.mrg file under mrg_dir into cache; returns the number of files."""
+    paths = sorted(Path(mrg_dir).rglob("sw*.mrg"))
+    for path in paths:
+        cache.get(path.name)
+    return len(paths)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--socket", help="Unix socket path to listen on")
+    where.add_argument("--port", type=int, help="localhost TCP port to listen on")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="worker processes (default: 1)")
+    parser.add_argument("--task-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per task sent to a worker")
+    parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS)
+    parser.add_argument("--batch-wait-ms", type=float, default=DEFAULT_BATCH_WAIT * 1e3)
+    parser.add_argument("--treebank-dir", default=None)
+    parser.add_argument("--reference-store", default=None)
+    parser.add_argument("--cache-tokens", type=int, default=DEFAULT_MAX_TOKENS)
+    parser.add_argument("--preload", action="store_true",
+                        help="parse the whole treebank into the server's cache before listening "
+                             "(single process only; use --reference-store with --jobs)")
+    parser.add_argument("--result-cache", default=None, metavar="PATH")
+    args = parser.parse_args(argv)
+    if args.preload and args.jobs > 1:
+        # workers build their own caches; only the server process's would be filled
+        parser.error("--preload only works with --jobs 1; use --reference-store to share references with workers")
+
+    if args.reference_store:
+        cache = ReferenceStore(args.reference_store)
+    else:
+        treebank_dir = args.treebank_dir
+        if args.preload and treebank_dir is None:
+            from zscore.utils_dirs import TREEBANK_MRG_DIR
+            treebank_dir = TREEBANK_MRG_DIR  # read the files from where preload finds them
+        cache = ReferenceCache(max_tokens=args.cache_tokens, base_dir=treebank_dir)
+        if args.preload:
+            n_files = preload(cache, treebank_dir)
+            print(f"Preloaded {n_files} files ({cache.n_tokens} tokens)")
+    result_cache = None
+    if args.result_cache:
+        from zscore.utils_results import ResultCache
+        result_cache = ResultCache(args.result_cache)
+
+    address = args.socket if args.socket else (args.host, args.port)
+    server = EvaluationServer(cache, address, workers=args.jobs, chunk_size=args.task_size,
+                              batch_rows=args.batch_rows, batch_wait=args.batch_wait_ms / 1e3,
+                              result_cache=result_cache)
+    print(f"Listening on {server.address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
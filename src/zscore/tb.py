@@ -29,9 +29,10 @@ import collections, glob, re, sys
 PTB_base_dir = "/home/grads/m/mariateleki/disfluency/treebank_3"  # read PTB from here
 
 _header_re = re.compile(r"(\*x\*.*\*x\*[ \t]*\n)*\s*")
-_openpar_re = re.compile(r"\s*\(\s*([^ \t\n\r\f\v()]*)\s*")
-_closepar_re = re.compile(r"\s*\)\s*")
-_terminal_re = re.compile(r"\s*([^ \t\n\r\f\v()]*)\s*")
+
+# A single tokenizer for trees: group 1 is a close paren, group 2 an open
+# paren with its label in group 3, and otherwise group 4 is a terminal.
+_token_re = re.compile(r"\s*(?:(\))\s*|(\()\s*([^ \t\n\r\f\v()]*)\s*|([^ \t\n\r\f\v()]*)\s*)")
 
 # This is such a complicated regular expression that I use the special
 # "verbose" form of regular expressions, which lets me index and document it
@@ -62,40 +63,59 @@ def read_file(filename):
     
     with open(filename, "r", encoding="utf-8") as f:
         filecontents = f.read()
-    pos = _header_re.match(filecontents).end()
-    trees = []
-    _string_trees(trees, filecontents, pos)
-    return trees
+    return read_string(filecontents)
+
+def read_string(s):
+
+    """Returns the trees in s, the contents of a PTB file, after its header."""
+
+    return _string_trees_stack(s, header_end(s))
+
+def header_end(s):
+
+    """Returns the position in s after the *x* header lines of a PTB file."""
+
+    return _header_re.match(s).end()
 
 def string_trees(s):
     
     """Returns a list of the trees in PTB-format string s"""
     
-    trees = []
-    _string_trees(trees, s)
-    return trees
+    return _string_trees_stack(s)
 
-def _string_trees(trees, s, pos=0):
-    
-    """Reads a sequence of trees in string s[pos:].
-    Appends the trees to the argument trees.
-    Returns the ending position of those trees in s."""
-    
-    while pos < len(s):
-        closepar_mo = _closepar_re.match(s, pos)
-        if closepar_mo:
-            return closepar_mo.end()
-        openpar_mo = _openpar_re.match(s, pos)
-        if openpar_mo:
-            tree = [openpar_mo.group(1)]
-            trees.append(tree)
-            pos = _string_trees(tree, s, openpar_mo.end())
-        else:
-            terminal_mo = _terminal_re.match(s, pos)
-            trees.append(terminal_mo.group(1))
-            pos = terminal_mo.end()
-    return pos
+def string_tokens(s, pos=0):
+
+    """Returns the tokens of s[pos:] as (closepar, openpar, label, terminal)
+    tuples: closepar or openpar is set for a parenthesis, with the node
+    label in label, and otherwise terminal is the terminal."""
+
+    tokens = _token_re.findall(s, pos)
+    tokens.pop()  # the empty match at the end of s
+    return tokens
+
+def _string_trees_stack(s, pos=0):
+
+    """Returns the trees in string s[pos:].
 
+    Tokenizes s with a single regular expression and builds the trees
+    with an explicit stack, so it does not recurse on deep trees."""
+
+    trees = []
+    stack = []
+    node = trees
+    for closepar, openpar, label, terminal in string_tokens(s, pos):
+        if closepar:
+            if not stack:
+                break
+            node = stack.pop()
+        elif openpar:
+            tree = [label]
+            node.append(tree)
+            stack.append(node)
+            node = tree
+        else:
+            node.append(terminal)
+    return trees
 
 def make_nonterminal(label, children):
     
@@ -167,6 +187,12 @@ def is_punctuation(subtree):
 
     return is_preterminal(subtree) and tree_category(subtree) in _punctuation_cats
 
+def is_punctuation_label(label):
+
+    """True if label is the label of a punctuation or empty preterminal."""
+
+    return label_category(label) in _punctuation_cats
+
 
 _partial_word_rex = re.compile(r"^[a-zA-Z]+[-]$")  # matches non-punctuation words that end in "-"
 
@@ -249,10 +275,25 @@ def map_labels(tree, fn):
     
     """Returns a tree in which every node's label is mapped by fn"""
 
-    if isinstance(tree, list):
-        return [fn(tree[0])]+[map_labels(child,fn) for child in tree[1:]]
-    else:
+    if not isinstance(tree, list):
         return tree
+    # preorder with an explicit stack of (node, parent copy, index in parent),
+    # so fn sees the labels in the same order as a recursive preorder walk
+    root = [None]
+    stack = [(tree, root, 0)]
+    while stack:
+        node, parent, i = stack.pop()
+        mapped = [fn(node[0])]
+        parent[i] = mapped
+        pending = []
+        for child in node[1:]:
+            if isinstance(child, list):
+                pending.append((child, mapped, len(mapped)))
+                mapped.append(None)
+            else:
+                mapped.append(child)
+        stack.extend(reversed(pending))
+    return root[0]
 
 
 def map_subtrees(tree, fn):
@@ -263,11 +304,23 @@ def map_subtrees(tree, fn):
     have been mapped.
     """
 
-    if isinstance(tree, list):
-        return fn([map_subtrees(child, fn) if i > 0 else child 
-                   for i, child in enumerate(tree)])
-    else:
+    if not isinstance(tree, list):
         return fn(tree)
+    # postorder with an explicit stack of (mapped children so far, remaining children)
+    stack = [(tree[:1], iter(tree[1:]))]
+    while True:
+        mapped, children = stack[-1]
+        for child in children:
+            if isinstance(child, list):
+                stack.append((child[:1], iter(child[1:])))
+                break
+            mapped.append(fn(child))
+        else:
+            stack.pop()
+            result = fn(mapped)
+            if not stack:
+                return result
+            stack[-1][0].append(result)
 
 
 def label_noindices(label):
@@ -296,10 +349,20 @@ def tree_copy(tree):
 
     """Returns a deep copy of tree"""
 
-    if isinstance(tree, list):
-        return [tree_copy(child) for child in tree]
-    else:
+    if not isinstance(tree, list):
         return tree
+    copy = []
+    stack = [(tree, copy)]
+    while stack:
+        node, new = stack.pop()
+        for child in node:
+            if isinstance(child, list):
+                new_child = []
+                new.append(new_child)
+                stack.append((child, new_child))
+            else:
+                new.append(child)
+    return copy
 
 
 def prune(tree, remove_empty=False, 
@@ -315,25 +378,89 @@ def prune(tree, remove_empty=False,
     if binarise is not False then left-binarise nodes.
     """
 
+    return _pruner(remove_empty, remove_partial, remove_punctuation, collapse_unary, binarise, relabel)(tree)
+
+
+def prune_trees(trees, remove_empty=False, 
+                remove_partial=False, 
+                remove_punctuation=False, 
+                collapse_unary=False, 
+                binarise=False, 
+                relabel=lambda x: x):
+
+    """Returns [prune(tree, ...) for tree in trees], sharing one configuration.
+
+    The removal tests and relabel are computed once per distinct label
+    (and word), so relabel must be a pure function of the label.
+    """
+
+    prune_tree = _pruner(remove_empty, remove_partial, remove_punctuation, collapse_unary, binarise,
+                         _memoize(relabel), memoize=True)
+    return [prune_tree(tree) for tree in trees]
+
+
+def _memoize(fn):
+    cache = {}
+    def memoized(x):
+        try:
+            return cache[x]
+        except KeyError:
+            value = cache[x] = fn(x)
+            return value
+    return memoized
+
+
+def _pruner(remove_empty, remove_partial, remove_punctuation, collapse_unary, binarise, relabel, memoize=False):
+
+    """Returns a function that prunes one tree as prune() does, with an explicit stack."""
+
     def left_binarise(cs, rightpos):
-        label = '.'.join(tree_label(cs[i]) for i in range(rightpos))
-        if rightpos <= 2:
-            return make_nonterminal(label, cs[:rightpos])
-        else:
-            return make_nonterminal(label, [left_binarise(cs, rightpos-1),cs[rightpos-1]])
+        # built bottom-up; same trees and labels as the recursive definition
+        labels = [tree_label(c) for c in cs[:rightpos]]
+        r = min(rightpos, 2)
+        label = '.'.join(labels[:r])
+        node = make_nonterminal(label, cs[:r])
+        for r in range(3, rightpos+1):
+            label = label + '.' + labels[r-1]
+            node = make_nonterminal(label, [node, cs[r-1]])
+        return node
 
     def right_binarise(cs, leftpos, len_cs):
-        label = '.'.join(tree_label(c) for c in cs[leftpos:])
-        if leftpos + 2 >= len_cs:
-            return make_nonterminal(label, cs[leftpos:])
-        else:
-            return make_nonterminal(label, [cs[leftpos], right_binarise(cs, leftpos+1, len_cs)])
+        m = max(leftpos, len_cs-2)
+        label = '.'.join(tree_label(c) for c in cs[m:])
+        node = make_nonterminal(label, cs[m:])
+        for l in range(m-1, leftpos-1, -1):
+            label = tree_label(cs[l]) + '.' + label
+            node = make_nonterminal(label, [cs[l], node])
+        return node
+
+    def removed(label, word):
+        preterminal = [label, word]
+        return ((remove_empty and label in _empty_cats) or
+                (remove_partial and is_partial_word(preterminal)) or
+                (remove_punctuation and is_punctuation(preterminal)))
+
+    if memoize:
+        removed_cache = {}
+        removed_uncached = removed
+        def removed(label, word):
+            key = (label, word)
+            try:
+                return removed_cache[key]
+            except KeyError:
+                value = removed_cache[key] = removed_uncached(label, word)
+                return value
+
+    def prune_leaf(tree):
+        # tree is not phrasal
+        if is_preterminal(tree):
+            if removed(tree[0], tree[1]):
+                return None
+            return make_nonterminal(relabel(tree[0]), tree_children(tree))
+        return tree
 
-    label = tree_label(tree)
-    if is_phrasal(tree):
-        cs = (prune(c, remove_empty, remove_partial, remove_punctuation, collapse_unary, binarise, relabel) 
-              for c in tree_children(tree))
-        cs = [c for c in cs if c]
+    def prune_phrasal(label, cs):
+        # cs are the pruned, non-empty children
         if cs or not remove_empty:
             len_cs = len(cs)
             if collapse_unary and len_cs == 1:
@@ -351,84 +478,91 @@ def prune(tree, remove_empty=False,
                                         cs)
         else:
             return None
-    elif is_preterminal(tree):
-        if remove_empty and label in _empty_cats:
-            return None
-        if remove_partial and is_partial_word(tree):
-            return None
-        if remove_punctuation and is_punctuation(tree):
-            return None
-        return make_nonterminal(relabel(label), tree_children(tree))
-    else:
-        return tree
+
+    def prune_tree(tree):
+        if not is_phrasal(tree):
+            return prune_leaf(tree)
+        # postorder with an explicit stack of [node, next child index, pruned children]
+        stack = [[tree, 1, []]]
+        while True:
+            frame = stack[-1]
+            node, i, cs = frame
+            if i < len(node):
+                frame[1] = i+1
+                child = node[i]
+                if is_phrasal(child):
+                    stack.append([child, 1, []])
+                else:
+                    child = prune_leaf(child)
+                    if child:
+                        cs.append(child)
+            else:
+                stack.pop()
+                result = prune_phrasal(node[0], cs)
+                if not stack:
+                    return result
+                if result:
+                    stack[-1][2].append(result)
+
+    return prune_tree
 
 
 def tree_nodes(tree):
     
     """Yields all the nodes in tree."""
 
-    def visit(node):
+    stack = [tree]
+    while stack:
+        node = stack.pop()
         yield node
         if isinstance(node, list):
-            for child in node[1:]:
-                yield from visit(child)
-
-    yield from visit(tree)
+            stack.extend(node[:0:-1])
     
 
 def tree_terminals(tree):
     
     """Yields the terminal or leaf nodes of tree."""
 
-    def visit(node):
+    stack = [tree]
+    while stack:
+        node = stack.pop()
         if isinstance(node, list):
-            for child in node[1:]:
-                yield from visit(child)
+            stack.extend(node[:0:-1])
         else:
             yield node
 
-    yield from visit(tree)
-
 
 def tree_preterminalnodes(tree):
 
     """Yields the preterminal nodes of tree."""
 
-    def visit(node):
+    stack = [tree]
+    while stack:
+        node = stack.pop()
         if is_preterminal(node):
             yield node
-        else:
-            for child in node[1:]:
-                yield from visit(child)
-
-    yield from visit(tree)
+        elif isinstance(node, list):
+            stack.extend(node[:0:-1])
 
 
 def tree_preterminallabels(tree):
 
     """Yields the labels of the preterminal nodes in tree."""
 
-    def visit(node):
-        if is_preterminal(node):
-            yield node[0]
-        else:
-            for child in node[1:]:
-                yield from visit(child)
-
-    yield from visit(tree)
+    for node in tree_preterminalnodes(tree):
+        yield node[0]
 
 
 def tree_phrasalnodes(tree):
 
     """Yields the phrasal (i.e., nonterminal and non-preterminal) nodes of tree"""
 
-    def visit(node):
+    stack = [tree]
+    while stack:
+        node = stack.pop()
         if is_phrasal(node):
             yield node
-            for child in node[1:]:
-                yield from visit(child)
-
-    yield from visit(tree)
+            stack.extend(node[:0:-1])
 
 
 Constituent = collections.namedtuple('Constituent', ('label', 'left', 'right'))
@@ -466,13 +600,29 @@ def tree_constituents(tree,
             if include_terminals:
                 constituents.append(Constituent(labelfn(node),left,left+1))
             return left+1
-        else:
-            right = left
-            for child in tree_children(node):
-                right = visitor(child, right, constituents)
-            if include_preterminals or is_phrasal(node):
-                constituents.append(Constituent(labelfn(node),left,right))
-            return right
+        # postorder with an explicit stack of [node, remaining children, left, right]
+        stack = [[node, iter(node[1:]), left, left]]
+        while True:
+            frame = stack[-1]
+            node, children, left, right = frame
+            for child in children:
+                if ignore_punctuation and is_punctuation(child):
+                    continue
+                if is_terminal(child):
+                    if include_terminals:
+                        constituents.append(Constituent(labelfn(child),right,right+1))
+                    right += 1
+                else:
+                    frame[3] = right
+                    stack.append([child, iter(child[1:]), right, right])
+                    break
+            else:
+                stack.pop()
+                if include_preterminals or is_phrasal(node):
+                    constituents.append(Constituent(labelfn(node),left,right))
+                if not stack:
+                    return right
+                stack[-1][3] = right
 
     constituents = []
     if include_root:
@@ -0,0 +1,369 @@
+"""
+Compact, array-backed forests of Penn Treebank trees (see tb for the nested-list form).
+
+A CompactForest stores every node of a list of trees in preorder, in
+parallel NumPy arrays:
+
+  label        : int32 id into strings of the node's label (or word, for terminals)
+  terminal     : bool, True for terminal nodes (words and empty elements)
+  parent       : int32 index of the parent node, -1 for roots
+  first_child  : int32 index of the first child, -1 if none
+  next_sibling : int32 index of the next sibling, -1 if none
+  end          : int32 index one past the last node of the node's subtree
+
+so the subtree of node i is the contiguous range [i, end[i]), and roots
+holds the node index of each tree.  That is about 21 bytes per node
+instead of the hundreds a nested list of strings takes, and the traversals
+below are NumPy operations over these ranges rather than Python recursion.
+
+Labels and words are interned in an Interner, which several forests (e.g.
+one per file) can share.
+"""
+
+import string
+
+import numpy as np
+
+from zscore import tb
+from zscore.utils_process_trees import TreeTokens
+
+INDEX_DTYPE = np.int32
+
+
+class Interner:
+    """Maps strings to consecutive int ids; strings[id] is the string."""
+
+    __slots__ = ("ids", "strings")
+
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def __len__(self):
+        return len(self.strings)
+
+    def intern(self, s):
+        i = self.ids.get(s)
+        if i is None:
+            i = self.ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+
+class _ForestBuilder:
+    # accumulates nodes in preorder; open nodes are closed by close()
+
+    def __init__(self, interner):
+        self.interner = interner
+        self.label, self.terminal, self.parent = [], [], []
+        self.first_child, self.next_sibling, self.end = [], [], []
+        self.last_child = []
+        self.roots = []
+        self.stack = []
+
+    def add(self, s, terminal):
+        i = len(self.label)
+        parent = self.stack[-1] if self.stack else -1
+        self.label.append(self.interner.intern(s))
+        self.terminal.append(terminal)
+        self.parent.append(parent)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        self.last_child.append(-1)
+        self.end.append(i + 1)
+        if parent < 0:
+            self.roots.append(i)
+        else:
+            previous = self.last_child[parent]
+            if previous < 0:
+                self.first_child[parent] = i
+            else:
+                self.next_sibling[previous] = i
+            self.last_child[parent] = i
+        if not terminal:
+            self.stack.append(i)
+
+    def close(self):
+        self.end[self.stack.pop()] = len(self.label)
+
+    def build(self):
+        while self.stack:  # trees left open at the end of the input
+            self.close()
+        return CompactForest(
+            self.interner,
+            np.asarray(self.label, dtype=INDEX_DTYPE),
+            np.asarray(self.terminal, dtype=bool),
+            np.asarray(self.parent, dtype=INDEX_DTYPE),
+            np.asarray(self.first_child, dtype=INDEX_DTYPE),
+            np.asarray(self.next_sibling, dtype=INDEX_DTYPE),
+            np.asarray(self.end, dtype=INDEX_DTYPE),
+            np.asarray(self.roots, dtype=INDEX_DTYPE),
+        )
+
+
+class CompactForest:
+    """A list of trees as parallel node arrays; see the module docstring."""
+
+    __slots__ = ("interner", "label", "terminal", "parent", "first_child", "next_sibling", "end", "roots")
+
+    def __init__(self, interner, label, terminal, parent, first_child, next_sibling, end, roots):
+        self.interner = interner
+        self.label = label
+        self.terminal = terminal
+        self.parent = parent
+        self.first_child = first_child
+        self.next_sibling = next_sibling
+        self.end = end
+        self.roots = roots
+
+    def __len__(self):
+        return len(self.roots)
+
+    @property
+    def strings(self):
+        return self.interner.strings
+
+    @property
+    def nbytes(self):
+        """Bytes held by the node arrays (the shared strings are not counted)."""
+        return sum(getattr(self, name).nbytes for name in
+                   ("label", "terminal", "parent", "first_child", "next_sibling", "end", "roots"))
+
+    def children(self, node):
+        """Node indices of the children of node."""
+        children = []
+        child = int(self.first_child[node])
+        while child >= 0:
+            children.append(child)
+            child = int(self.next_sibling[child])
+        return children
+
+    def subtree(self, node):
+        """The subtree rooted at node in tb's nested-list form."""
+        start, end = int(node), int(self.end[node])
+        strings = self.interner.strings
+        labels = self.label[start:end].tolist()
+        terminals = self.terminal[start:end].tolist()
+        parents = (self.parent[start:end] - start).tolist()
+        built = []
+        for label, terminal, parent in zip(labels, terminals, parents):
+            s = strings[label]
+            node_value = s if terminal else [s]
+            built.append(node_value)
+            if len(built) > 1:
+                built[parent].append(node_value)
+        return built[0]
+
+    def tree(self, k):
+        """Tree k in tb's nested-list form."""
+        return self.subtree(self.roots[k])
+
+    def to_trees(self):
+        """All trees in tb's nested-list form, as tb.read_file returns them."""
+        return [self.tree(k) for k in range(len(self))]
+
+    def string_mask(self, predicate, start=0, end=None):
+        """predicate(strings[label[i]]) for the nodes i in [start, end), calling predicate once per distinct label."""
+        labels = self.label[start:end]
+        strings = self.interner.strings
+        if len(labels) >= len(strings):  # e.g. the whole forest: one call per interned string
+            return np.fromiter(map(predicate, strings), dtype=bool, count=len(strings))[labels]
+        ids, inverse = np.unique(labels, return_inverse=True)
+        by_id = np.fromiter((predicate(strings[i]) for i in ids.tolist()), dtype=bool, count=len(ids))
+        return by_id[inverse.reshape(-1)]
+
+    def preterminal_mask(self, start=0, end=None):
+        """True for the nodes in [start, end) with exactly one child, which is terminal (tb.is_preterminal)."""
+        child = self.first_child[start:end]
+        has_child = child >= 0
+        safe = np.where(has_child, child, 0)
+        return ~self.terminal[start:end] & has_child & self.terminal[safe] & (self.next_sibling[safe] < 0)
+
+    def phrasal_mask(self, start=0, end=None):
+        """True for the nonterminals in [start, end) with no children or a nonterminal first child (tb.is_phrasal)."""
+        child = self.first_child[start:end]
+        safe = np.where(child >= 0, child, 0)
+        return ~self.terminal[start:end] & ((child < 0) | ~self.terminal[safe])
+
+
+def from_trees(trees, interner=None):
+    """CompactForest of trees in tb's nested-list form (e.g. from tb.read_file)."""
+    builder = _ForestBuilder(interner or Interner())
+    for tree in trees:
+        # events: a tree to add, or None to close the innermost open node
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                builder.close()
+            elif isinstance(node, list):
+                builder.add(node[0], False)
+                stack.append(None)
+                stack.extend(node[:0:-1])
+            else:
+                builder.add(node, True)
+    return builder.build()
+
+
+def _add_string(builder, s, pos=0):
+    # same tokens and structure as tb.string_trees, without building lists
+    for closepar, openpar, label, terminal in tb.string_tokens(s, pos):
+        if closepar:
+            if not builder.stack:
+                break
+            builder.close()
+        elif openpar:
+            builder.add(label, False)
+        else:
+            builder.add(terminal, True)
+
+
+def string_forest(s, interner=None):
+    """CompactForest of the trees in PTB-format string s, as tb.string_trees reads them."""
+    builder = _ForestBuilder(interner or Interner())
+    _add_string(builder, s)
+    return builder.build()
+
+
+def read_file(filename, interner=None):
+    """CompactForest of the trees in a PTB file, as tb.read_file reads them."""
+    return read_files([filename], interner)[0]
+
+
+def read_files(filenames, interner=None):
+    """
+    One CompactForest of the trees of every file, and int64 offsets such
+    that the trees of filenames[f] are roots[offsets[f]:offsets[f + 1]].
+    """
+    builder = _ForestBuilder(interner or Interner())
+    offsets = np.zeros(len(filenames) + 1, dtype=np.int64)
+    for f, filename in enumerate(filenames):
+        with open(filename, "r", encoding="utf-8") as fh:
+            s = fh.read()
+        _add_string(builder, s, tb.header_end(s))
+        while builder.stack:
+            builder.close()
+        offsets[f + 1] = len(builder.roots)
+    return builder.build(), offsets
+
+
+def tree_terminals(forest, node):
+    """The terminal strings under node, left to right (tb.tree_terminals)."""
+    start, end = int(node), int(forest.end[node])
+    ids = forest.label[start:end][forest.terminal[start:end]]
+    strings = forest.interner.strings
+    return [strings[i] for i in ids.tolist()]
+
+
+def tree_preterminalnodes(forest, node):
+    """Node indices of the preterminal nodes under node, left to right (tb.tree_preterminalnodes)."""
+    start, end = int(node), int(forest.end[node])
+    return (start + np.flatnonzero(forest.preterminal_mask(start, end))).tolist()
+
+
+def tree_constituents(forest, node,
+                      include_root=False,
+                      include_terminals=False,
+                      include_preterminals=False,
+                      ignore_punctuation=True,
+                      labelfn=None):
+    """
+    tb.tree_constituents of the subtree at node, computed with array operations.
+
+    labelfn is applied to each constituent's label string (default: the label itself).
+    Returns the same list of tb.Constituent tuples, in the same (post-)order.
+    """
+    start, end = int(node), int(forest.end[node])
+    terminal = forest.terminal[start:end]
+    pre = forest.preterminal_mask(start, end)
+    parents = forest.parent[start:end] - start
+
+    skipped = np.zeros(end - start, dtype=bool)
+    if ignore_punctuation:
+        skipped = pre & forest.string_mask(tb.is_punctuation_label, start, end)
+        skipped[0] &= include_root  # without the root, its children are visited even if it is punctuation
+    # a skipped preterminal's word does not advance the string position
+    in_skipped = skipped.copy()
+    words = np.flatnonzero(terminal)
+    word_parents = parents[words]
+    in_skipped[words] |= (word_parents >= 0) & skipped[np.maximum(word_parents, 0)]
+    counted = terminal & ~in_skipped
+
+    positions = np.zeros(end - start + 1, dtype=np.int64)
+    np.cumsum(counted, out=positions[1:])
+    ends = forest.end[start:end] - start
+    left, right = positions[:-1], positions[ends]
+
+    keep = ~in_skipped & np.where(terminal, include_terminals,
+                                  include_preterminals | forest.phrasal_mask(start, end))
+    if not include_root:
+        keep[0] = False
+    chosen = np.flatnonzero(keep)
+    chosen = chosen[np.lexsort((-chosen, ends[chosen]))]  # post-order: children before parents
+
+    strings = forest.interner.strings
+    labels = forest.label[start:end]
+    if labelfn is None:
+        labelfn = str
+    return [tb.Constituent(labelfn(strings[labels[i]]), l, r)
+            for i, l, r in zip(chosen.tolist(), left[chosen].tolist(), right[chosen].tolist())]
+
+
+def extract_tokens(forest, return_tags=False, return_spans=False):
+    """
+    utils_process_trees.extract_file_tokens over every tree of forest,
+    computed with array operations; returns the same TreeTokens.
+    """
+    return_tags = return_tags or return_spans
+    n = len(forest.label)
+    ends = forest.end
+
+    def covered(mask):
+        # number of masked nodes whose subtree contains each node
+        diff = np.zeros(n + 1, dtype=np.int64)
+        marked = np.flatnonzero(mask)
+        np.add.at(diff, marked, 1)
+        np.add.at(diff, ends[marked], -1)
+        return np.cumsum(diff[:-1])
+
+    metadata = covered(~forest.terminal & forest.string_mask(lambda s: s in ("CODE", "SYM"))) > 0
+    disfluent = ~forest.terminal & forest.string_mask(lambda s: s in ("EDITED", "INTJ", "PRN"))
+    top = np.flatnonzero(disfluent & (covered(disfluent) == 1))  # disfluent nodes under no other
+
+    def spread(values):
+        # values[k] on every node of top[k]'s subtree, -1 elsewhere: top spans are disjoint
+        diff = np.zeros(n + 1, dtype=np.int64)
+        diff[top] += values + 1
+        diff[ends[top]] -= values + 1
+        return np.cumsum(diff[:-1]) - 1
+
+    disfluent_label = spread(forest.label[top])
+
+    pre = forest.preterminal_mask()
+    words = np.where(pre, forest.first_child, 0)
+    keep = pre & ~metadata & ~forest.string_mask(lambda s: s in ("-NONE-", "-DFL-"))
+    keep &= forest.string_mask(lambda s: s != "MUMBLEx")[words]
+    nodes = np.flatnonzero(keep)
+    word_ids = forest.label[words[nodes]]
+    node_labels = disfluent_label[nodes]
+    fluent = node_labels < 0
+
+    strings = forest.interner.strings
+    tree_starts = forest.roots
+    out = TreeTokens(len(forest), return_tags, return_spans)
+    out.disfluent = [strings[i] for i in word_ids.tolist()]
+    out.fluent = [strings[i] for i in word_ids[fluent].tolist()]
+    out.disfluent_offsets[:] = np.append(np.searchsorted(nodes, tree_starts), len(nodes))
+    out.fluent_offsets[:] = np.append(np.searchsorted(nodes[fluent], tree_starts), fluent.sum())
+    if return_tags:
+        punctuation = string.punctuation
+        tagged = forest.string_mask(lambda s: s not in punctuation)[words[nodes]]
+        out.tokens = [strings[i] for i in word_ids[tagged].tolist()]
+        out.tags = [strings[i] if i >= 0 else "NONE" for i in node_labels[tagged].tolist()]
+        out.tag_offsets[:] = np.append(np.searchsorted(nodes[tagged], tree_starts), tagged.sum())
+    if return_spans:
+        # spans are numbered in preorder, skipping those the walk never reaches (under CODE/SYM)
+        numbered = ~metadata[top]
+        span_ids = np.where(numbered, np.cumsum(numbered) - 1, -1)
+        out.spans = spread(span_ids)[nodes[tagged]].astype(np.int32)
+    return out
@@ -0,0 +1,391 @@
+# python -m zscore.utils_alignments STORE [--output FILE] [--spans]  (re-scores a saved alignment store)
+import argparse
+import json
+import os
+import shutil
+from itertools import chain
+
+import numpy as np
+
+from zscore import __version__
+from zscore.utils_evaluate import (COUNT_COLUMNS, METRIC_COLUMNS, PAD, SPAN_METRIC_COLUMNS, TAG_CODES, AlignmentResult,
+                                   CorpusAggregator, json_nulls, metrics_from_counts, segment_counts,
+                                   span_metrics_from_counts)
+
+# pyarrow is imported on first use, as for the other optional output formats
+
+#  constants
+ALIGNMENT_FORMATS = ("arrow", "parquet")
+METADATA_FILE = "_alignments.json"  # "_" so pyarrow.dataset skips it
+FLUSH_TOKENS = 1 << 22  # alignment rows buffered before they are written out
+TAG_DICTIONARY = ("",) + tuple(TAG_CODES)  # w_t dictionary: index = TAG_CODES value + 1, "" for padding
+
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("row", pa.int32()),
+        ("system", pa.int8()),
+        ("w_d", pa.dictionary(pa.int32(), pa.string())),
+        ("w_t", pa.dictionary(pa.int8(), pa.string())),
+        ("w_g", pa.dictionary(pa.int32(), pa.string())),
+        ("gt_mask", pa.int8()),
+        ("pred_mask", pa.int8()),
+        ("span_id", pa.int32()),
+    ])
+
+
+def partition_dir(path, file_id):
+    """Directory of file_id's alignments, hive-style (file_id=sw2005.mrg) so pyarrow.dataset can read the store."""
+    return os.path.join(path, f"file_id={file_id}")
+
+
+class AlignmentBuffer:
+    """
+    Alignments of scored rows, grouped by file id, waiting to be written
+    by an AlignmentWriter; worker processes fill one per chunk.
+    """
+
+    def __init__(self):
+        self.by_file = {}
+        self.n_tokens = 0
+
+    def __len__(self):
+        return sum(len(items) for items in self.by_file.values())
+
+    def add(self, row, system, file_id, alignment):
+        """Add the alignment of system (an index) on row of the input."""
+        self.by_file.setdefault(str(file_id), []).append((row, system, alignment))
+        self.n_tokens += max(len(alignment), 1)
+
+    def extend(self, other):
+        """Add every alignment of another buffer, e.g. one sent back by a worker."""
+        for file_id, items in other.by_file.items():
+            for row, system, alignment in items:
+                self.add(row, system, file_id, alignment)
+
+
+# stands in for an alignment without rows
+_EMPTY = AlignmentResult([""], [""], [""], np.full(1, PAD, dtype=np.int8), np.full(1, PAD, dtype=np.int8),
+                         np.full(1, PAD, dtype=np.int8), np.full(1, -1, dtype=np.int32))
+
+
+def alignment_table(items):
+    """
+    The (row, system, AlignmentResult) items as one Arrow table of
+    alignment rows in the store's schema.
+
+    An alignment without rows is written as a single padding row with
+    empty tokens, so the store still records that it was scored.
+    """
+    import pyarrow as pa
+    alignments = [alignment if len(alignment) else _EMPTY for _, _, alignment in items]
+    lengths = [len(alignment) for alignment in alignments]
+    rows = np.repeat(np.array([row for row, _, _ in items], dtype=np.int32), lengths)
+    systems = np.repeat(np.array([system for _, system, _ in items], dtype=np.int8), lengths)
+    tag_codes = np.concatenate([alignment.tag_codes for alignment in alignments])
+    columns = [
+        pa.array(rows),
+        pa.array(systems),
+        pa.array(list(chain.from_iterable(a.w_d for a in alignments)), pa.string()).dictionary_encode(),
+        pa.DictionaryArray.from_arrays(pa.array((tag_codes + 1).astype(np.int8)), pa.array(TAG_DICTIONARY)),
+        pa.array(list(chain.from_iterable(a.w_g for a in alignments)), pa.string()).dictionary_encode(),
+        pa.array(np.concatenate([alignment.gt_mask for alignment in alignments])),
+        pa.array(np.concatenate([alignment.pred_mask for alignment in alignments])),
+        pa.array(np.concatenate([alignment.reference_spans() for alignment in alignments]).astype(np.int32)),
+    ]
+    return pa.Table.from_arrays(columns, schema=_schema())
+
+
+class AlignmentWriter(AlignmentBuffer):
+    """
+    Persist the per-token alignment of every scored row into a directory.
+
+    Each file id gets a partition directory of part files, one table per
+    flush: rows of (row, system, w_d, w_t, w_g, gt_mask, pred_mask,
+    span_id) with dictionary-encoded tokens and int8 masks.  "arrow" parts
+    are Arrow IPC files that AlignmentStore memory-maps without copying;
+    "parquet" parts are smaller but are decoded on read.
+
+    row is the input row (added to row_offset, which evaluate_file
+    advances per chunk) and system indexes systems.  An existing store at
+    path is replaced; any other non-empty directory, including one that
+    holds anything besides a store's files, is an error and left as is.
+    """
+
+    def __init__(self, path, fmt="arrow", systems=("generated-text",), flush_tokens=FLUSH_TOKENS):
+        super().__init__()
+        if fmt not in ALIGNMENT_FORMATS:
+            raise ValueError(f"unknown alignment format {fmt!r}; expected one of {ALIGNMENT_FORMATS}")
+        self.path = str(path)
+        self.fmt = fmt
+        self.systems = list(systems)
+        self.flush_tokens = flush_tokens
+        self.row_offset = 0
+        self.n_rows = 0
+        self._parts = 0
+        if os.path.isdir(self.path) and os.listdir(self.path):
+            entries = _store_entries(self.path)
+            if entries is None:
+                raise FileExistsError(f"{self.path} is not empty and is not an alignment store")
+            for entry in entries:
+                if os.path.isdir(entry):
+                    shutil.rmtree(entry)
+                else:
+                    os.remove(entry)
+        os.makedirs(self.path, exist_ok=True)
+        self._write_metadata(complete=False)
+
+    def add(self, row, system, file_id, alignment):
+        super().add(self.row_offset + row, system, file_id, alignment)
+        self.n_rows = max(self.n_rows, self.row_offset + row + 1)
+        if self.n_tokens >= self.flush_tokens:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered alignments, one part file per file id."""
+        for file_id, items in self.by_file.items():
+            table = alignment_table(items)
+            directory = partition_dir(self.path, file_id)
+            os.makedirs(directory, exist_ok=True)
+            part_path = os.path.join(directory, f"part-{self._parts:06d}.{self.fmt}")
+            self._parts += 1
+            if self.fmt == "arrow":
+                import pyarrow as pa
+                with pa.OSFile(part_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            else:
+                import pyarrow.parquet as pq
+                pq.write_table(table, part_path)
+        self.by_file.clear()
+        self.n_tokens = 0
+
+    def close(self, n_rows=None, complete=True):
+        """
+        Flush and record the number of input rows (default: up to the last
+        row added); complete=False marks a run that stopped early.
+        """
+        self.flush()
+        if n_rows is not None:
+            self.n_rows = n_rows
+        self._write_metadata(complete)
+
+    def _write_metadata(self, complete):
+        metadata = {"version": __version__, "format": self.fmt, "systems": self.systems,
+                    "rows": self.n_rows, "complete": complete}
+        tmp_path = os.path.join(self.path, METADATA_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.path, METADATA_FILE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self.close(complete=exc_type is None)
+
+
+def _store_entries(path):
+    """
+    The files and partition directories of the alignment store at path,
+    or None if path holds anything an AlignmentWriter does not write.
+    """
+    try:
+        with open(os.path.join(path, METADATA_FILE), "r", encoding="utf-8") as f:
+            if json.load(f).get("format") not in ALIGNMENT_FORMATS:
+                return None
+    except (OSError, ValueError, AttributeError):
+        return None
+    parts = tuple(f".{fmt}" for fmt in ALIGNMENT_FORMATS)
+    entries = []
+    for name in os.listdir(path):
+        entry = os.path.join(path, name)
+        if name.startswith("file_id=") and os.path.isdir(entry):
+            if not all(part.startswith("part-") and part.endswith(parts) for part in os.listdir(entry)):
+                return None
+        elif name not in (METADATA_FILE, METADATA_FILE + ".tmp"):
+            return None
+        entries.append(entry)
+    return entries
+
+
+def _numpy(column):
+    # one chunk (every Arrow part) converts without a copy
+    if column.num_chunks == 1:
+        return column.chunk(0).to_numpy()
+    return column.to_numpy()
+
+
+class AlignmentBatch:
+    """
+    The alignments of one part file of an AlignmentStore.
+
+    rows, systems : input row and system index of each alignment
+    offsets       : alignment k is token rows offsets[k]:offsets[k + 1]
+    tag_codes, gt_mask, pred_mask, span_ids : the token columns as NumPy
+                    arrays; the masks and span ids of Arrow parts are views
+                    of the memory-mapped file
+    table         : the pyarrow Table, for the token strings
+
+    counts() gives each alignment's COUNT_COLUMNS with array operations
+    only; alignment(k) rebuilds one AlignmentResult for custom metrics.
+    """
+
+    __slots__ = ("file_id", "table", "rows", "systems", "offsets", "tag_codes", "gt_mask", "pred_mask", "span_ids")
+
+    def __init__(self, file_id, table):
+        self.file_id = file_id
+        self.table = table
+        row, system = _numpy(table.column("row")), _numpy(table.column("system"))
+        starts = np.flatnonzero(np.concatenate(([True], (row[1:] != row[:-1]) | (system[1:] != system[:-1])))) \
+            if len(row) else np.zeros(0, dtype=np.intp)
+        self.rows, self.systems = row[starts], system[starts]
+        self.offsets = np.append(starts, len(row))
+        self.tag_codes = np.concatenate([np.array([TAG_CODES.get(t, PAD) for t in chunk.dictionary.to_pylist()],
+                                                  dtype=np.int8)[chunk.indices.to_numpy()]
+                                         for chunk in table.column("w_t").chunks] or [np.zeros(0, dtype=np.int8)])
+        self.gt_mask = _numpy(table.column("gt_mask"))
+        self.pred_mask = _numpy(table.column("pred_mask"))
+        self.span_ids = _numpy(table.column("span_id"))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def counts(self):
+        """(len(self), len(COUNT_COLUMNS)) counts, as alignment_counts gives for each alignment."""
+        return segment_counts(self.offsets, self.tag_codes, self.gt_mask, self.pred_mask, self.span_ids)
+
+    def alignment(self, k):
+        """The AlignmentResult of alignment k (an empty one for an alignment without rows)."""
+        start, end = self.offsets[k:k + 2].tolist()
+        tokens = self.table.slice(start, end - start)
+        w_d, w_t, w_g = (tokens.column(name).to_pylist() for name in ("w_d", "w_t", "w_g"))
+        if end - start == 1 and w_d == w_g == [""]:
+            return AlignmentResult([], [], [], *(np.zeros(0, dtype=np.int8),) * 3, np.zeros(0, dtype=np.int32))
+        return AlignmentResult(w_d, w_t, w_g, self.tag_codes[start:end], self.gt_mask[start:end],
+                               self.pred_mask[start:end], self.span_ids[start:end])
+
+
+class AlignmentStore:
+    """
+    Read-only view of a directory written by AlignmentWriter (e.g. by
+    evaluate_file(..., alignments=path)), to re-score a run without
+    aligning again.
+
+    counts() reproduces the run's per-row counts from the saved masks, so
+    metrics() gives the METRIC_COLUMNS (and SPAN_METRIC_COLUMNS) of every
+    row; map_batches and map_alignments compute custom metrics.  Rows that
+    failed to evaluate are not in the store and come out as NaN.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(os.path.join(self.path, METADATA_FILE), "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        self.fmt = metadata["format"]
+        self.systems = metadata["systems"]
+        self.n_rows = metadata["rows"]
+        self.complete = metadata["complete"]
+        prefix = "file_id="
+        self.parts = {}
+        for name in sorted(os.listdir(self.path)):
+            if name.startswith(prefix):
+                directory = os.path.join(self.path, name)
+                self.parts[name[len(prefix):]] = [os.path.join(directory, part) for part in sorted(os.listdir(directory))
+                                                  if part.endswith("." + self.fmt)]
+
+    def file_ids(self):
+        return list(self.parts)
+
+    def system_index(self, system):
+        """Index of a system given by name or index (None: the first)."""
+        if system is None:
+            return 0
+        return system if isinstance(system, int) else self.systems.index(system)
+
+    def read_part(self, part_path):
+        """One part file as a pyarrow Table, memory-mapped for Arrow parts."""
+        import pyarrow as pa
+        if self.fmt == "arrow":
+            return pa.ipc.open_file(pa.memory_map(part_path, "r")).read_all()
+        import pyarrow.parquet as pq
+        return pq.read_table(part_path, memory_map=True)
+
+    def batches(self, file_ids=None):
+        """Yield an AlignmentBatch per part file, for file_ids (default: all)."""
+        for file_id in self.parts if file_ids is None else file_ids:
+            for part_path in self.parts.get(file_id, ()):
+                yield AlignmentBatch(file_id, self.read_part(part_path))
+
+    def map_batches(self, fn, width=None, file_ids=None):
+        """
+        Vectorized custom metrics: fn(batch) returns one value (or a row of
+        width values) per alignment of the batch.  Returns an
+        (n_systems, n_rows) or (n_systems, n_rows, width) float array, NaN
+        for rows not in the store.
+        """
+        shape = (len(self.systems), self.n_rows) + (() if width is None else (width,))
+        out = np.full(shape, np.nan)
+        for batch in self.batches(file_ids):
+            out[batch.systems, batch.rows] = fn(batch)
+        return out
+
+    def map_alignments(self, fn, system=None, width=None, file_ids=None):
+        """
+        fn(AlignmentResult) -> value (or width values) for each alignment of
+        system, e.g. e_prf.  Returns an (n_rows,) or (n_rows, width) float
+        array, NaN for rows not in the store.
+        """
+        s = self.system_index(system)
+        out = np.full((self.n_rows,) + (() if width is None else (width,)), np.nan)
+        for batch in self.batches(file_ids):
+            for k in np.flatnonzero(batch.systems == s).tolist():
+                out[batch.rows[k]] = fn(batch.alignment(k))
+        return out
+
+    def counts(self, file_ids=None):
+        """(n_systems, n_rows, len(COUNT_COLUMNS)) counts, as score_systems returns them."""
+        return self.map_batches(AlignmentBatch.counts, len(COUNT_COLUMNS), file_ids)
+
+    def metrics(self, system=None, span_metrics=False, with_counts=False):
+        """{column: np.ndarray} of system's rows, like evaluate_records returns."""
+        counts = self.counts()[self.system_index(system)]
+        results = dict(zip(METRIC_COLUMNS, metrics_from_counts(counts).T))
+        if span_metrics:
+            results.update(zip(SPAN_METRIC_COLUMNS, span_metrics_from_counts(counts).T))
+        if with_counts:
+            results.update(zip(COUNT_COLUMNS, counts.T))
+        return results
+
+    def aggregate(self):
+        """{system: CorpusAggregator} over every row of the store."""
+        aggregators = {}
+        for system, counts in zip(self.systems, self.counts()):
+            aggregators[system] = CorpusAggregator()
+            aggregators[system].add_many(counts)
+        return aggregators
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score the alignments saved by zscore --alignments.")
+    parser.add_argument("store", help="directory written with --alignments")
+    parser.add_argument("-o", "--output", default=None, help="write per-row metrics to this CSV")
+    parser.add_argument("--spans", action="store_true", help="include the span-level scores")
+    args = parser.parse_args(argv)
+    store = AlignmentStore(args.store)
+    if args.output:
+        import pandas as pd
+        frames = []
+        for system in store.systems:
+            suffix = "" if len(store.systems) == 1 else "__" + system
+            metrics = store.metrics(system, span_metrics=args.spans)
+            frames.append(pd.DataFrame({k + suffix: v for k, v in metrics.items()}))
+        pd.concat(frames, axis=1).to_csv(args.output, index=False)
+        print(f"Saved metrics of {store.n_rows} rows to {args.output}")
+    else:
+        results = {system: agg.result() for system, agg in store.aggregate().items()}
+        print(json.dumps(json_nulls(results), indent=2, allow_nan=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+from difflib import Match, SequenceMatcher
+from functools import cached_property
+
+import numpy as np
+
+#  constants
+MAX_PAIRS = 20_000_000  # beyond this many equal bigram pairs, fall back to difflib
+MIN_BOX_SEGMENTS = 8    # search boxes with fewer match segments in plain Python
+MIN_AREA = 250_000      # below len(a) * len(b), difflib itself is as fast
+ENGINES = ("difflib", "int")
+DEFAULT_ENGINE = "int"
+
+
+class SequenceIndex:
+    """
+    Integer ids for the tokens of a, built on first use and shared by every
+    IntSequenceMatcher that diffs the same a against a different b.
+    """
+
+    def __init__(self, a):
+        self.a = a
+
+    @cached_property
+    def vocab(self):
+        vocab = {}
+        for w in self.a:
+            vocab.setdefault(w, len(vocab))
+        return vocab
+
+    @cached_property
+    def ids(self):
+        vocab = self.vocab
+        return np.fromiter((vocab[w] for w in self.a), dtype=np.int64, count=len(self.a))
+
+    def intern(self, b):
+        """Ids of the tokens of b; tokens that never occur in a get -1, since they can never match."""
+        vocab = self.vocab
+        return np.fromiter((vocab.get(w, -1) for w in b), dtype=np.int64, count=len(b))
+
+
+def intern_tokens(a, b, index=None):
+    """
+    Map the tokens of a and b to integer ids, reusing index (a SequenceIndex of a) if given.
+
+    Tokens of b that never occur in a get id -1, since they can never match.
+    """
+    if index is None:
+        index = SequenceIndex(a)
+    return index.ids, index.intern(b), len(index.vocab)
+
+
+def _equal_pairs(a_keys, b_keys, max_pairs):
+    """Return every (i, j) with a_keys[i] == b_keys[j] >= 0, ordered by i then j (or None past max_pairs)."""
+    keys, inverse = np.unique(np.concatenate([a_keys, b_keys]), return_inverse=True)
+    a_ids, b_ids = inverse[:len(a_keys)], inverse[len(a_keys):]
+    b_pos = np.flatnonzero(b_keys >= 0)
+    b_valid = b_ids[b_pos]
+    order_b = b_pos[np.argsort(b_valid, kind="stable")]
+    count_b = np.bincount(b_valid, minlength=len(keys))
+    start_b = np.cumsum(count_b) - count_b
+
+    reps = np.where(a_keys >= 0, count_b[a_ids], 0)
+    n_pairs = int(reps.sum())
+    if n_pairs > max_pairs:
+        return None
+    i_pos = np.repeat(np.arange(len(a_keys)), reps)
+    offsets = np.repeat(start_b[a_ids] - (np.cumsum(reps) - reps), reps)
+    j_pos = order_b[offsets + np.arange(n_pairs)]
+    return i_pos, j_pos
+
+
+def match_segments(a_ids, b_ids, n_ids, max_pairs=MAX_PAIRS):
+    """
+    Return the maximal diagonal runs a[i0:i0+L] == b[j0:j0+L] with L >= 2, as arrays (i0, j0, L).
+
+    Every common substring of length >= 2 lies inside one of these runs.
+    Runs are seeded from equal bigrams, so frequent single tokens do not
+    blow up the number of candidate pairs.  Returns None if a and b share
+    more than max_pairs equal bigrams.
+    """
+    empty = np.zeros(0, dtype=np.int64)
+    if len(a_ids) < 2 or len(b_ids) < 2:
+        return empty, empty, empty
+
+    a_bigrams = a_ids[:-1] * n_ids + a_ids[1:]
+    b_bigrams = np.where((b_ids[:-1] >= 0) & (b_ids[1:] >= 0), b_ids[:-1] * n_ids + b_ids[1:], -1)
+    pairs = _equal_pairs(a_bigrams, b_bigrams, max_pairs)
+    if pairs is None:
+        return None
+    i_pos, j_pos = pairs
+    if len(i_pos) == 0:
+        return empty, empty, empty
+
+    # chain bigram matches (i, j), (i+1, j+1), ... along each diagonal j - i
+    diag = j_pos - i_pos
+    order = np.lexsort((i_pos, diag))
+    i_pos, diag = i_pos[order], diag[order]
+    starts = np.ones(len(i_pos), dtype=bool)
+    starts[1:] = (diag[1:] != diag[:-1]) | (i_pos[1:] != i_pos[:-1] + 1)
+    first = np.flatnonzero(starts)
+    lengths = np.diff(np.append(first, len(i_pos))) + 1
+    return i_pos[first], diag[first] + i_pos[first], lengths
+
+
+def _clip(segments, alo, ahi, blo, bhi):
+    """Clip segments to the box [alo, ahi) x [blo, bhi); returns (i, j, length) arrays."""
+    i0, j0, lengths = segments
+    shift = np.maximum(np.maximum(alo - i0, blo - j0), 0)
+    length = np.minimum(np.minimum(lengths, ahi - i0), bhi - j0) - shift
+    return i0 + shift, j0 + shift, length
+
+
+def _first_equal(a_ids, b_ids, alo, ahi, blo, bhi):
+    """Lowest i, then lowest j, with a[i] == b[j] in the box, as a length-1 match."""
+    first_j = {}
+    for j in range(bhi - 1, blo - 1, -1):
+        first_j[b_ids[j]] = j
+    for i in range(alo, ahi):
+        j = first_j.get(a_ids[i])
+        if j is not None:
+            return i, j, 1
+    return alo, blo, 0
+
+
+def _longest_in_box(segments, a_ids, b_ids, alo, ahi, blo, bhi):
+    """Same result as SequenceMatcher.find_longest_match without junk: longest, then lowest i, then lowest j."""
+    i, j, length = _clip(segments, alo, ahi, blo, bhi)
+    if len(length) < MIN_BOX_SEGMENTS:
+        best = (alo, blo, 0)
+        for x in zip(i.tolist(), j.tolist(), length.tolist()):
+            if x[2] > best[2] or (x[2] == best[2] > 0 and x[:2] < best[:2]):
+                best = x
+    else:
+        k = int(length.max()) if len(length) else 0
+        candidates = np.flatnonzero(length == k)
+        b = candidates[np.lexsort((j[candidates], i[candidates]))[0]]
+        best = int(i[b]), int(j[b]), k
+    if best[2] >= 2:
+        return best
+    # no run of two or more: any single equal token will do
+    return _first_equal(a_ids, b_ids, alo, ahi, blo, bhi)
+
+
+def _in_box(segments, alo, ahi, blo, bhi):
+    keep = _clip(segments, alo, ahi, blo, bhi)[2] >= 2
+    return tuple(x[keep] for x in segments)
+
+
+class IntSequenceMatcher(SequenceMatcher):
+    """
+    Drop-in for SequenceMatcher(None, a, b, autojunk=False) on hashable tokens.
+
+    Tokens are interned to integer ids and all diagonal match runs are found
+    once with NumPy, so each longest-match search in the Ratcliff/Obershelp
+    recursion only scans the runs inside its box instead of rescanning b.
+    get_matching_blocks() and get_opcodes() return exactly what difflib does.
+
+    index : SequenceIndex of a, to share its interning across matchers
+    """
+
+    def __init__(self, a=(), b=(), index=None):
+        self.index = index
+        self.isjunk = None
+        self.autojunk = False
+        self.a = a
+        self.b = b
+        self.matching_blocks = self.opcodes = None
+        self.fullbcount = None
+        self.bjunk = self.bpopular = set()
+
+    def set_seq1(self, a):
+        self.a = a
+        self.index = None
+        self.matching_blocks = self.opcodes = None
+
+    def set_seq2(self, b):
+        self.b = b
+        self.matching_blocks = self.opcodes = None
+        self.fullbcount = None
+
+    def find_longest_match(self, alo=0, ahi=None, blo=0, bhi=None):
+        if ahi is None:
+            ahi = len(self.a)
+        if bhi is None:
+            bhi = len(self.b)
+        a_ids, b_ids, n_ids = intern_tokens(self.a, self.b, self.index)
+        segments = match_segments(a_ids, b_ids, n_ids, max_pairs=float("inf"))
+        return Match(*_longest_in_box(segments, a_ids.tolist(), b_ids.tolist(), alo, ahi, blo, bhi))
+
+    def get_matching_blocks(self):
+        if self.matching_blocks is not None:
+            return self.matching_blocks
+        la, lb = len(self.a), len(self.b)
+
+        segments = None
+        if la * lb >= MIN_AREA:
+            a_ids, b_ids, n_ids = intern_tokens(self.a, self.b, self.index)
+            segments = match_segments(a_ids, b_ids, n_ids)
+        if segments is None:
+            self.matching_blocks = SequenceMatcher(None, self.a, self.b, autojunk=False).get_matching_blocks()
+            return self.matching_blocks
+
+        # same recursion as difflib, but each box only sees the runs inside it
+        a_ids, b_ids = a_ids.tolist(), b_ids.tolist()
+        queue = [(0, la, 0, lb, segments)]
+        matching_blocks = []
+        while queue:
+            alo, ahi, blo, bhi, box_segments = queue.pop()
+            i, j, k = _longest_in_box(box_segments, a_ids, b_ids, alo, ahi, blo, bhi)
+            if k:
+                matching_blocks.append((i, j, k))
+                if alo < i and blo < j:
+                    queue.append((alo, i, blo, j, _in_box(box_segments, alo, i, blo, j)))
+                if i + k < ahi and j + k < bhi:
+                    queue.append((i + k, ahi, j + k, bhi, _in_box(box_segments, i + k, ahi, j + k, bhi)))
+        matching_blocks.sort()
+
+        # collapse adjacent blocks, exactly as difflib does
+        i1 = j1 = k1 = 0
+        non_adjacent = []
+        for i2, j2, k2 in matching_blocks:
+            if i1 + k1 == i2 and j1 + k1 == j2:
+                k1 += k2
+            else:
+                if k1:
+                    non_adjacent.append((i1, j1, k1))
+                i1, j1, k1 = i2, j2, k2
+        if k1:
+            non_adjacent.append((i1, j1, k1))
+
+        non_adjacent.append((la, lb, 0))
+        self.matching_blocks = list(map(Match._make, non_adjacent))
+        return self.matching_blocks
+
+
+def sequence_matcher(a, b, engine=DEFAULT_ENGINE, index=None):
+    """Return a matcher for a and b; engine is one of ENGINES, index an optional SequenceIndex of a."""
+    if engine == "difflib":
+        return SequenceMatcher(None, a, b, autojunk=False)
+    if engine == "int":
+        return IntSequenceMatcher(a, b, index=index)
+    raise ValueError(f"unknown alignment engine {engine!r}; expected 'difflib' or 'int'")
@@ -14,4 +14,11 @@ TREEBANK_MRG_DIR = BASE_DIR / "data" / "treebank_3" / "parsed" / "mrg" / "swbd"
 TREEBANK_SAMPLE_MRG_FILE = TREEBANK_MRG_DIR / "4" / "sw4004.mrg"
 
 # treebank txt files
-TREEBANK_PROCESSED_DIR = BASE_DIR / "data" / "treebank_3_flat"
\ No newline at end of file
+TREEBANK_PROCESSED_DIR = BASE_DIR / "data" / "treebank_3_flat"
+
+# compiled reference store (python -m zscore.utils_references)
+REFERENCE_STORE_FILE = DATA_DIR / "swbd_references.zsr"
+
+
+# per-row result cache shared across runs (zscore.utils_results)
+RESULT_CACHE_FILE = RESULTS_DIR / "zscore_results.sqlite"
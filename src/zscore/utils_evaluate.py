@@ -1,33 +1,316 @@
 from __future__ import annotations
 
-from difflib import SequenceMatcher
+import math
+import re
+from functools import lru_cache
 from typing import List, Tuple
 
-import pandas as pd
-from nltk.tokenize import TreebankWordTokenizer
+import numpy as np
+
+from zscore.utils_diff import DEFAULT_ENGINE, SequenceIndex, sequence_matcher
+from zscore.utils_profile import stage
+
+# pandas and nltk are imported on first use; importing this module only needs NumPy
 
 #  constants 
-TOKENIZER = TreebankWordTokenizer()
 DISFLUENCY_CLASSES = ("EDITED", "INTJ", "PRN")  # order matters for z_eip
+PAD = -1  # mask value for padding (hallucinated) rows
+TAG_CODES = {"NONE": 0, **{lab: i + 1 for i, lab in enumerate(DISFLUENCY_CLASSES)}}
+METRIC_COLUMNS = ("e_p", "e_r", "e_f", "z_e", "z_i", "z_p")
+COUNT_COLUMNS = ("tp", "fp", "fn", "tn") + tuple(
+    f"{lab.lower()}_{kind}" for lab in DISFLUENCY_CLASSES for kind in ("total", "removed")
+) + tuple(
+    f"{lab.lower()}_{kind}" for lab in DISFLUENCY_CLASSES for kind in ("spans", "spans_full", "spans_partial")
+)
+SPAN_COUNTS_START = COUNT_COLUMNS.index("edited_spans")
+SPAN_METRIC_COLUMNS = tuple(
+    f"s_{lab[0].lower()}_{outcome}" for lab in DISFLUENCY_CLASSES for outcome in ("full", "partial", "none")
+)
+
+MASK_COLUMNS = ("gt_mask", "pred_mask", "tp_mask", "tn_mask", "fp_mask", "fn_mask")
+
+_tokenizer = None
+
+def get_tokenizer():
+    """The shared TreebankWordTokenizer, built on first use."""
+    global _tokenizer
+    if _tokenizer is None:
+        from nltk.tokenize import TreebankWordTokenizer
+        _tokenizer = TreebankWordTokenizer()
+    return _tokenizer
+
+def __getattr__(name):
+    # TOKENIZER used to be built at import time; keep it importable
+    if name == "TOKENIZER":
+        return get_tokenizer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Characters (and pairs) whose Treebank rules look past the current word:
+# quotes, start/end-of-text punctuation and whitespace other than " ".
+# Texts without them tokenize word by word.
+_CROSS_WORD_RE = re.compile(r"""["`:,.;@#$%&?!()\[\]{}<>]|''|[^\S ]""")
+_PLAIN_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+_SPLIT_WORDS = frozenset({"cannot", "gimme", "gonna", "gotta", "lemme", "wanna"})  # nltk's CONTRACTIONS2
+MAX_MEMO_WORDS = 1_000_000
+GENERATED_MEMO_SIZE = 10_000  # distinct generated texts remembered by align
+
+class TreebankTokenizer:
+    """
+    Same tokens as nltk's TreebankWordTokenizer, without running its regex cascade per text.
+
+    Text whose only whitespace is " " and that has none of the characters
+    the cascade treats across word boundaries is split once on " "; plain
+    alphanumeric words pass through as they are, and the rest (contractions,
+    hyphens, ...) are tokenized by nltk once per distinct word and
+    remembered.  Any other text goes to nltk whole.
+
+    lowercase : lowercase the tokens (after tokenizing, as nltk's rules are case-sensitive)
+    strip     : characters deleted from the text before tokenizing
+    memo_size : if > 0, remember the tokens of this many recent distinct texts
+    """
+
+    def __init__(self, lowercase=False, strip="", memo_size=0):
+        self.lowercase = lowercase
+        self.strip = str.maketrans("", "", strip)
+        self.memo_size = memo_size
+        self._words = {}
+        self._tokens = lru_cache(maxsize=memo_size)(self._tokenize) if memo_size > 0 else self._tokenize
 
-def build_alignment_df(d_tok, tags, g_tok):
+    def tokenize(self, text):
+        return list(self._tokens(text))
+
+    def _tokenize(self, text):
+        text = text.translate(self.strip)
+        if _CROSS_WORD_RE.search(text):
+            return self._nltk(text)
+
+        tokens = []
+        *words, last = text.split(" ")
+        for word in words:
+            if word:
+                tokens.extend(self._word(word, " "))
+        if last:
+            tokens.extend(self._word(last, ""))  # a final "'" splits differently at the end of the text
+        return tuple(tokens)
+
+    def _word(self, word, following):
+        if _PLAIN_WORD_RE.fullmatch(word) and word.lower() not in _SPLIT_WORDS:
+            return (word.lower() if self.lowercase else word,)
+        key = (word, following)
+        word_tokens = self._words.get(key)
+        if word_tokens is None:
+            if len(self._words) >= MAX_MEMO_WORDS:
+                self._words.clear()
+            word_tokens = self._words[key] = self._nltk(word + following)
+        return word_tokens
+
+    def _nltk(self, text):
+        tokens = get_tokenizer().tokenize(text)
+        return tuple(w.lower() for w in tokens) if self.lowercase else tuple(tokens)
+
+_generated_tokenizer = TreebankTokenizer(lowercase=True, strip=",.!?", memo_size=GENERATED_MEMO_SIZE)
+
+def tokenize_generated(generated_text):
+    """Lowercased tokens of a generated text as align sees them (",.!?" removed first)."""
+    return _generated_tokenizer.tokenize(generated_text)
+
+class AlignmentResult:
+    """
+    Aligned tokens and masks for one example.
+
+    Attributes:
+        w_d, w_t, w_g : original/disfluent token, its tag, generated token
+        tag_codes : int8 TAG_CODES of w_t, PAD padding
+        gt_mask   : int8, 1 if token *should* be removed, 0 if kept, PAD padding
+        pred_mask : int8, 1 if model *removed* token, 0 if kept, PAD padding
+        span_ids  : int32 span id of w_d's top-most disfluent node (-1 for
+                    fluent tokens and padding), or None if the reference
+                    had none; see span_counts
+
+    tp_mask, tn_mask, fp_mask, fn_mask are derived on access, and
+    to_dataframe() builds the full alignment table for inspection.
+    """
+
+    __slots__ = ("w_d", "w_t", "w_g", "tag_codes", "gt_mask", "pred_mask", "span_ids", "_df")
+
+    def __init__(self, w_d, w_t, w_g, tag_codes, gt_mask, pred_mask, span_ids=None):
+        self.w_d = w_d
+        self.w_t = w_t
+        self.w_g = w_g
+        self.tag_codes = tag_codes
+        self.gt_mask = gt_mask
+        self.pred_mask = pred_mask
+        self.span_ids = span_ids
+        self._df = None
+
+    def __len__(self):
+        return len(self.w_d)
+
+    @property
+    def tp_mask(self):
+        return confusion_masks(self.gt_mask, self.pred_mask)[0]
+
+    @property
+    def tn_mask(self):
+        return confusion_masks(self.gt_mask, self.pred_mask)[1]
+
+    @property
+    def fp_mask(self):
+        return confusion_masks(self.gt_mask, self.pred_mask)[2]
+
+    @property
+    def fn_mask(self):
+        return confusion_masks(self.gt_mask, self.pred_mask)[3]
+
+    def confusion_counts(self):
+        """Return (tp, tn, fp, fn) counts."""
+        return confusion_counts(self.gt_mask, self.pred_mask)
+
+    def class_counts(self):
+        """Return (totals, removed) token counts per DISFLUENCY_CLASSES entry."""
+        # (class, removed) -> a single code in 0..5, one pass over the rows
+        disfluent = self.tag_codes > 0
+        codes = (self.tag_codes[disfluent].astype(np.intp) - 1) * 2 + (self.pred_mask[disfluent] == 1)
+        counts = np.bincount(codes, minlength=2 * len(DISFLUENCY_CLASSES))
+        removed = counts[1::2]
+        return counts[0::2] + removed, removed
+
+    def span_counts(self):
+        """
+        Return (spans, full, partial) counts per DISFLUENCY_CLASSES entry:
+        disfluent spans, and those whose tokens were all / only some removed.
+
+        Spans are those of reference_spans().  Computed with one segment
+        reduction over the runs, not per span.
+        """
+        reference = self.tag_codes != PAD
+        codes = self.tag_codes[reference]
+        spans = self.reference_spans()[reference]
+        disfluent = codes > 0
+        codes, spans = codes[disfluent], spans[disfluent]
+        removed = (self.pred_mask[reference][disfluent] == 1).astype(np.intp)
+
+        k = len(DISFLUENCY_CLASSES)
+        if not len(codes):
+            zeros = np.zeros(k, dtype=np.intp)
+            return zeros, zeros, zeros
+        starts = np.flatnonzero(np.concatenate(([True], spans[1:] != spans[:-1])))
+        lengths = np.diff(np.append(starts, len(spans)))
+        span_removed = np.add.reduceat(removed, starts)
+        # (class, outcome) with outcome 0 none, 1 partial, 2 full -> a single code in 0..3k-1
+        outcomes = (span_removed > 0).astype(np.intp) + (span_removed == lengths)
+        counts = np.bincount((codes[starts].astype(np.intp) - 1) * 3 + outcomes, minlength=3 * k).reshape(k, 3)
+        return counts.sum(axis=1), counts[:, 2], counts[:, 1]
+
+    def reference_spans(self):
+        """
+        span_ids.  Alignments made from tags alone (align without
+        disfluent_spans) have none, and take each run of reference tokens
+        with the same tag as a span (-1 for padding).
+        """
+        if self.span_ids is not None:
+            return self.span_ids
+        reference = self.tag_codes != PAD
+        codes = self.tag_codes[reference]
+        spans = np.full(len(self.tag_codes), -1, dtype=np.int32)
+        spans[reference] = np.cumsum(np.concatenate(([0], codes[1:] != codes[:-1])))
+        return spans
+
+    def to_dataframe(self):
+        """Return (and memoize) the alignment as a DataFrame with w_d, w_t, w_g and int8 mask columns."""
+        if self._df is None:
+            import pandas as pd
+            df = pd.DataFrame({"w_d": self.w_d, "w_t": self.w_t, "w_g": self.w_g})
+            df["gt_mask"] = self.gt_mask
+            df["pred_mask"] = self.pred_mask
+            for name, mask in zip(MASK_COLUMNS[2:], confusion_masks(self.gt_mask, self.pred_mask)):
+                df[name] = mask
+            self._df = df
+        return self._df
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """Inverse of to_dataframe(), for tables saved by build_alignment_df."""
+        w_t = df["w_t"].tolist()
+        tag_codes = np.fromiter((TAG_CODES.get(t, PAD) for t in w_t), dtype=np.int8, count=len(w_t))
+        return cls(df["w_d"].tolist(), w_t, df["w_g"].tolist(), tag_codes,
+                   df["gt_mask"].to_numpy(dtype=np.int8), df["pred_mask"].to_numpy(dtype=np.int8))
+
+def build_alignment_df(d_tok, tags, g_tok, engine=DEFAULT_ENGINE):
     """
     Return a DataFrame with aligned tokens and masks.
 
     Columns:
         w_d, w_t, w_g : original/disfluent token, its tag, generated token
-        gt_mask   : 1 if token *should* be removed, 0 if kept, "*" padding
-        pred_mask     : 1 if model *removed* token, 0 if kept,  "*" padding
+        gt_mask   : 1 if token *should* be removed, 0 if kept, PAD padding
+        pred_mask     : 1 if model *removed* token, 0 if kept,  PAD padding
+        tp_mask, tn_mask, fp_mask, fn_mask : 1/0, PAD where both masks are PAD
+
+    All mask columns are int8.
+    """
+    return build_alignment(d_tok, tags, g_tok, engine=engine).to_dataframe()
+
+class PreparedReference:
+    """
+    A reference's tokens and tags with everything align derives from them
+    alone: the §tag sequence that is diffed, and the diff engine's index of
+    it.  Built once per reference and reused for every output aligned to it.
+    spans optionally holds the span id of each token (see extract_tokens).
+    """
+
+    __slots__ = ("tokens", "tags", "spans", "tokens_prime", "index")
+
+    def __init__(self, tokens, tags, spans=None):
+        self.tokens = tokens
+        self.tags = tags
+        self.spans = spans
+        # special token in tokens_prime forces disfluent (ONLY disfluent) g_tokens into "replace" block (instead of "equal" block) for late matching
+        self.tokens_prime = [w if t == "NONE" else f"{w}§{t}" for w, t in zip(tokens, tags, strict=True)]
+        self.index = SequenceIndex(self.tokens_prime)
+
+def prepare_reference(disfluent_tokens, disfluent_tags, disfluent_spans=None):
+    """Lowercase and prepare a reference (e.g. from ReferenceCache.get) for align_prepared."""
+    if len(disfluent_tokens) != len(disfluent_tags):
+        raise ValueError(
+            f"tag_list length {len(disfluent_tokens)} ≠ token count {len(disfluent_tags)}"
+        )
+    if disfluent_spans is not None:
+        if len(disfluent_spans) != len(disfluent_tokens):
+            raise ValueError(
+                f"span list length {len(disfluent_spans)} ≠ token count {len(disfluent_tokens)}"
+            )
+        disfluent_spans = np.asarray(disfluent_spans, dtype=np.int32)
+    with stage("prepare_reference") as timed:
+        timed.add(len(disfluent_tokens))
+        return PreparedReference([w.lower() for w in disfluent_tokens], list(disfluent_tags), disfluent_spans)
+
+def build_alignment(d_tok, tags, g_tok, engine=DEFAULT_ENGINE):
     """
-    # Alter disfluent tokens so SequenceMatcher aligns them late
+    Return the AlignmentResult of disfluent tokens d_tok (tagged by tags) and generated tokens g_tok.
 
-    # special token in g_tok_prime forces disfluent (ONLY disfluent) g_tokens into "replace" block (instead of "equal" block) for late matching
-    g_tok_prime = [w if t == "NONE" else f"{w}§{t}" for w, t in zip(d_tok, tags, strict=True)]
+    engine selects the diff backend from utils_diff.ENGINES; all engines
+    produce the same opcodes as difflib.SequenceMatcher(autojunk=False).
+    """
+    return build_prepared_alignment(PreparedReference(d_tok, tags), g_tok, engine=engine)
 
+def build_prepared_alignment(reference, g_tok, engine=DEFAULT_ENGINE):
+    """build_alignment against a PreparedReference."""
     # match g_tok_prime & g_tok, but actually write with d_tok & g_tok
-    sm = SequenceMatcher(None, g_tok_prime, g_tok, autojunk=False)
+    with stage("diff") as timed:
+        opcodes = sequence_matcher(reference.tokens_prime, g_tok, engine=engine, index=reference.index).get_opcodes()
+        timed.add(len(reference.tokens_prime) + len(g_tok))
+    with stage("masks") as timed:
+        alignment = _alignment_from_opcodes(reference.tokens, reference.tags, g_tok, opcodes)
+        if reference.spans is not None:
+            # every reference token is one row, in order; the other rows are padding
+            alignment.span_ids = np.full(len(alignment.w_d), -1, dtype=np.int32)
+            alignment.span_ids[alignment.tag_codes != PAD] = reference.spans
+        timed.add(len(alignment.w_d))
+    return alignment
+
+def _alignment_from_opcodes(d_tok, tags, g_tok, opcodes):
     rows = []
-    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+    for tag, i1, i2, j1, j2 in opcodes:
         if tag == "equal":  #  exact match with non-disfluent g_tokens
             for k in range(i2 - i1):
                 rows.append((d_tok[i1 + k], tags[i1 + k], g_tok[j1 + k]))
@@ -59,110 +342,62 @@ def build_alignment_df(d_tok, tags, g_tok):
             for tok, cnt in inserted.items():
                 rows.extend([("", "", tok)] * cnt)
 
-    df = pd.DataFrame(rows, columns=["w_d", "w_t", "w_g"])
-
-    # mask columns 
-    gt_mask = []
-    pred_mask = []
-    tp_mask = []
-    tn_mask = []
-    fp_mask = []
-    fn_mask = []
-
-    for _, row in df.iterrows():
-        w_d = row["w_d"]
-        w_t = row["w_t"]
-        w_g = row["w_g"]
-        
-        # gt_mask: should we remove it or not?
-        gt_mask_current = ""
-        if w_t in {"EDITED","PRN","INTJ"}:
-            gt_mask_current = 1
-        elif w_t == "NONE":
-            gt_mask_current = 0
-        else:
-            gt_mask_current = "*"
-        gt_mask.append(gt_mask_current)
-        
-        # pred_mask: did we remove it or not?
-        pred_mask_current = ""
-        if (w_d == ""):
-            pred_mask_current = "*"  # hallucinated token
-        elif w_d != w_g:
-            pred_mask_current = 1
-        else:
-            pred_mask_current = 0
-        pred_mask.append(pred_mask_current)
-        
-        
-        if (pred_mask_current == "*") and (gt_mask_current == "*"):
-            tp_mask.append("*")
-            tn_mask.append("*")
-            fp_mask.append("*")
-            fn_mask.append("*")
-        else: 
-
-            # tp
-            if (pred_mask_current == 1) and (gt_mask_current == 1):
-                tp_mask.append(1)
-            else:
-                tp_mask.append(0)
-            
-            # tn
-            if (pred_mask_current == 0) and (gt_mask_current == 0):
-                tn_mask.append(1)
-            else:
-                tn_mask.append(0)
-            
-            # fp
-            if (pred_mask_current == 1) and (gt_mask_current == 0):
-                fp_mask.append(1)
-            else:
-                fp_mask.append(0)
-            
-            # fn
-            if (pred_mask_current == 0) and (gt_mask_current == 1):
-                fn_mask.append(1)
-            else:
-                fn_mask.append(0)
-        
-    df["gt_mask"] = gt_mask
-    df["pred_mask"] = pred_mask
-    df["tp_mask"] = tp_mask
-    df["tn_mask"] = tn_mask
-    df["fp_mask"] = fp_mask
-    df["fn_mask"] = fn_mask
-    return df
-
-def align(disfluent_tokens, disfluent_tags, generated_text):
-    if len(disfluent_tokens) != len(disfluent_tags):
-        raise ValueError(
-            f"tag_list length {len(disfluent_tokens)} ≠ token count {len(disfluent_tags)}"
-        )
-    
-    # clean and tokenize generated_text
-    def remove_selected_punctuation(text, punctuation=",."):
-        return text.translate(str.maketrans('', '', punctuation))
-    generated_text = remove_selected_punctuation(generated_text, punctuation=",.!?")
-    g_tok = TOKENIZER.tokenize(generated_text)
+    w_d, w_t, w_g = (list(col) for col in zip(*rows)) if rows else ([], [], [])
+    tag_codes = np.fromiter((TAG_CODES.get(t, PAD) for t in w_t), dtype=np.int8, count=len(w_t))
+
+    # gt_mask: should we remove it or not?
+    gt_mask = np.minimum(tag_codes, 1)
+
+    # pred_mask: did we remove it or not?
+    d = np.array(w_d, dtype=object)
+    pred_mask = (d != np.array(w_g, dtype=object)).astype(np.int8)
+    pred_mask[d == ""] = PAD  # hallucinated token
+
+    return AlignmentResult(w_d, w_t, w_g, tag_codes, gt_mask, pred_mask)
+
+def confusion_masks(gt_mask, pred_mask):
+    """
+    Return the tp, tn, fp, fn masks for int8 gt/pred masks.
+
+    Rows where both gt and pred are padding are PAD in every mask.
+    """
+    both_pad = (gt_mask == PAD) & (pred_mask == PAD)
+    masks = []
+    for pred, gt in ((1, 1), (0, 0), (1, 0), (0, 1)):
+        mask = ((pred_mask == pred) & (gt_mask == gt)).astype(np.int8)
+        mask[both_pad] = PAD
+        masks.append(mask)
+    return masks
 
-    # lower both token lists
-    g_tok = [w.lower() for w in g_tok]
-    disfluent_tokens = [w.lower() for w in disfluent_tokens]
+def confusion_counts(gt_mask, pred_mask):
+    """Return (tp, tn, fp, fn) counts for int8 gt/pred masks in one pass."""
+    # (pred, gt) in {PAD, 0, 1}^2 -> a single code in 0..8
+    codes = (np.asarray(pred_mask, dtype=np.intp) + 1) * 3 + (np.asarray(gt_mask, dtype=np.intp) + 1)
+    counts = np.bincount(codes, minlength=9)
+    return int(counts[8]), int(counts[4]), int(counts[7]), int(counts[5])
 
-    # build the alignment df
-    alignment_df = build_alignment_df(disfluent_tokens, disfluent_tags, g_tok)
+def align(disfluent_tokens, disfluent_tags, generated_text, engine=DEFAULT_ENGINE, disfluent_spans=None):
+    # build the alignment; call .to_dataframe() on it for the full table
+    reference = prepare_reference(disfluent_tokens, disfluent_tags, disfluent_spans)
+    return align_prepared(reference, generated_text, engine=engine)
 
-    return alignment_df
+def align_prepared(reference, generated_text, engine=DEFAULT_ENGINE):
+    """align against a PreparedReference, e.g. to score several systems' outputs for one reference."""
+    # clean, tokenize and lower generated_text
+    with stage("tokenize") as timed:
+        g_tok = tokenize_generated(generated_text)
+        timed.add(len(g_tok))
+    return build_prepared_alignment(reference, g_tok, engine=engine)
 
+def as_alignment(alignment):
+    """Accept an AlignmentResult or an alignment DataFrame."""
+    if isinstance(alignment, AlignmentResult):
+        return alignment
+    return AlignmentResult.from_dataframe(alignment)
 
-def e_prf(alignment_df):
-    df = alignment_df
 
-    tp = float((df["tp_mask"] == 1).sum())
-    tn = float((df["tn_mask"] == 1).sum())
-    fp = float((df["fp_mask"] == 1).sum())
-    fn = float((df["fn_mask"] == 1).sum())
+def e_prf(alignment):
+    tp, tn, fp, fn = (float(c) for c in as_alignment(alignment).confusion_counts())
 
     e_p = tp / (tp + fp) if tp + fp else float("nan")
     e_r = tp / (tp + fn) if tp + fn else float("nan")
@@ -170,7 +405,7 @@ def e_prf(alignment_df):
     return e_p, e_r, e_f
 
 
-def z_eip(alignment_df):
+def z_eip(alignment):
     """
     Per-class removal *rate* for EDITED, INTJ, PRN on this example.
 
@@ -178,11 +413,174 @@ def z_eip(alignment_df):
     z_i : INTJ removal rate
     z_p : PRN removal rate
     """
-    df = alignment_df
+    totals, removed = as_alignment(alignment).class_counts()
     rates = []
-    for lab in DISFLUENCY_CLASSES:
-        total = int((df["w_t"] == lab).sum())
-        removed = int(((df["w_t"] == lab) & (df["pred_mask"] == 1)).sum())
-        rates.append(removed / total if total else float("nan"))
+    for total, rem in zip(totals, removed):
+        rates.append(int(rem) / int(total) if total else float("nan"))
     # Order: EDITED → INTJ → PRN
     return tuple(rates)  # type: ignore[return-value]
+
+
+def span_eip(alignment):
+    """
+    Span-level removal for EDITED, INTJ, PRN on this example, in
+    SPAN_METRIC_COLUMNS order: per class, the fraction of its spans removed
+    completely, partially and not at all (NaN without spans of the class).
+    """
+    return tuple(span_metrics_from_counts(alignment_counts(alignment)).tolist())
+
+
+def alignment_counts(alignment):
+    """
+    Raw per-example counts behind e_prf, z_eip and span_eip, in COUNT_COLUMNS
+    order: tp, fp, fn, tn, then total and removed tokens for EDITED, INTJ, PRN,
+    then spans and completely / partially removed spans of each.
+    """
+    alignment = as_alignment(alignment)
+    with stage("counts"):
+        tp, tn, fp, fn = alignment.confusion_counts()
+        counts = [tp, fp, fn, tn]
+        for total, removed in zip(*alignment.class_counts()):
+            counts += [int(total), int(removed)]
+        for spans, full, partial in zip(*alignment.span_counts()):
+            counts += [int(spans), int(full), int(partial)]
+    return tuple(counts)
+
+
+def segment_counts(offsets, tag_codes, gt_mask, pred_mask, span_ids):
+    """
+    alignment_counts of many alignments at once, from their concatenated
+    tag_codes, masks and reference_spans(): alignment k is rows
+    offsets[k]:offsets[k + 1].  Returns an (n, len(COUNT_COLUMNS)) int64 array.
+    """
+    n, k = len(offsets) - 1, len(DISFLUENCY_CLASSES)
+    tag_codes, gt_mask, pred_mask = (np.asarray(a, dtype=np.int8) for a in (tag_codes, gt_mask, pred_mask))
+    # one small code per row for both (pred, gt) in 0..8 and (class, removed) in 1..2k (0 if fluent or
+    # padding), counted per alignment by a single bincount
+    removed = pred_mask == 1
+    disfluent = tag_codes > 0
+    classes = np.where(disfluent, tag_codes * 2 - 1 + removed, 0).astype(np.int8)
+    width = 2 * k + 1
+    codes = ((pred_mask + 1) * 3 + (gt_mask + 1)) * width + classes
+    segments = np.repeat(np.arange(n, dtype=np.intp) * (9 * width), np.diff(offsets))
+    by_code = np.bincount(segments + codes, minlength=9 * width * n).reshape(n, 9, width)
+    confusion = by_code.sum(axis=2)
+    by_class = by_code.sum(axis=1)[:, 1:].reshape(n, k, 2)
+
+    # spans: runs of equal span ids among each alignment's disfluent rows
+    rows = np.flatnonzero(disfluent)
+    segments = np.repeat(np.arange(n, dtype=np.intp), by_class.sum(axis=(1, 2)))
+    spans, span_classes, removed = span_ids[rows], tag_codes[rows].astype(np.intp) - 1, removed[rows].view(np.int8)
+    boundaries = np.ones(len(rows), dtype=bool)
+    boundaries[1:] = (spans[1:] != spans[:-1]) | (segments[1:] != segments[:-1])
+    starts = np.flatnonzero(boundaries)
+    lengths = np.diff(np.append(starts, len(rows)))
+    span_removed = np.add.reduceat(removed, starts, dtype=np.intp) if len(starts) else lengths
+    outcomes = (span_removed > 0).astype(np.intp) + (span_removed == lengths)
+    by_outcome = np.bincount(segments[starts] * 3 * k + span_classes[starts] * 3 + outcomes,
+                             minlength=3 * k * n).reshape(n, k, 3)
+
+    counts = np.empty((n, len(COUNT_COLUMNS)), dtype=np.int64)
+    counts[:, :4] = confusion[:, [8, 7, 5, 4]]  # tp, fp, fn, tn
+    counts[:, 4:SPAN_COUNTS_START:2] = by_class.sum(axis=2)
+    counts[:, 5:SPAN_COUNTS_START:2] = by_class[:, :, 1]
+    counts[:, SPAN_COUNTS_START::3] = by_outcome.sum(axis=2)
+    counts[:, SPAN_COUNTS_START + 1::3] = by_outcome[:, :, 2]
+    counts[:, SPAN_COUNTS_START + 2::3] = by_outcome[:, :, 1]
+    return counts
+
+
+def metrics_from_counts(counts):
+    """
+    Vectorized e_prf + z_eip from counts in COUNT_COLUMNS order.
+
+    counts may be one row of counts (e.g. corpus sums) or an (n, len(COUNT_COLUMNS))
+    array; returns the METRIC_COLUMNS values with the same NaN rules as e_prf/z_eip.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    tp, fp, fn = counts[..., 0], counts[..., 1], counts[..., 2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        e_p = tp / (tp + fp)
+        e_r = tp / (tp + fn)
+        e_f = 2 * e_p * e_r / (e_p + e_r)
+        z = counts[..., 5:SPAN_COUNTS_START:2] / counts[..., 4:SPAN_COUNTS_START:2]
+    return np.concatenate([np.stack([e_p, e_r, e_f], axis=-1), z], axis=-1)
+
+
+def span_metrics_from_counts(counts):
+    """Vectorized span_eip from counts in COUNT_COLUMNS order, like metrics_from_counts."""
+    counts = np.asarray(counts, dtype=np.float64)
+    spans = counts[..., SPAN_COUNTS_START::3]
+    full, partial = counts[..., SPAN_COUNTS_START + 1::3], counts[..., SPAN_COUNTS_START + 2::3]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fractions = np.stack([full, partial, spans - full - partial], axis=-1) / spans[..., None]
+    return fractions.reshape(*counts.shape[:-1], len(SPAN_METRIC_COLUMNS))
+
+
+def json_nulls(value):
+    """value (e.g. CorpusAggregator.result()) with NaN scores as None, since JSON has no NaN."""
+    if isinstance(value, dict):
+        return {key: json_nulls(v) for key, v in value.items()}
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class CorpusAggregator:
+    """
+    Corpus-level E-scores and Z-scores, accumulated from per-example counts.
+
+    micro : e_prf / z_eip of the counts summed over all examples
+    macro : mean of the per-example metrics, skipping examples where a
+            metric is NaN (what averaging an eval__*.csv column gives)
+    spans : span_eip of the summed counts, i.e. over every span of the corpus
+
+    Examples whose counts are NaN (rows that failed to evaluate) are only
+    counted in n_failed.
+    """
+
+    def __init__(self):
+        self.n_rows = 0
+        self.n_failed = 0
+        self.counts = np.zeros(len(COUNT_COLUMNS), dtype=np.int64)
+        self.metric_sums = np.zeros(len(METRIC_COLUMNS))
+        self.metric_rows = np.zeros(len(METRIC_COLUMNS), dtype=np.int64)
+
+    def add(self, counts):
+        """Add one example's counts (e.g. from alignment_counts)."""
+        self.add_many([counts])
+
+    def add_many(self, counts):
+        """Add an (n, len(COUNT_COLUMNS)) array of per-example counts."""
+        counts = np.asarray(counts, dtype=np.float64).reshape(-1, len(COUNT_COLUMNS))
+        failed = np.isnan(counts).any(axis=1)
+        counts = counts[~failed]
+        metrics = metrics_from_counts(counts)
+        valid = ~np.isnan(metrics)
+
+        self.n_rows += len(counts)
+        self.n_failed += int(failed.sum())
+        self.counts += counts.sum(axis=0).astype(np.int64)
+        self.metric_sums += np.where(valid, metrics, 0.0).sum(axis=0)
+        self.metric_rows += valid.sum(axis=0)
+
+    def merge(self, other):
+        """Fold in another aggregator, e.g. one filled by a worker process."""
+        self.n_rows += other.n_rows
+        self.n_failed += other.n_failed
+        self.counts += other.counts
+        self.metric_sums += other.metric_sums
+        self.metric_rows += other.metric_rows
+
+    def result(self):
+        """Return {"rows", "failed", "counts", "micro", "macro", "spans"}; spans are the micro span_eip."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            macro = self.metric_sums / self.metric_rows
+        return {
+            "rows": self.n_rows,
+            "failed": self.n_failed,
+            "counts": dict(zip(COUNT_COLUMNS, self.counts.tolist())),
+            "micro": dict(zip(METRIC_COLUMNS, metrics_from_counts(self.counts).tolist())),
+            "macro": dict(zip(METRIC_COLUMNS, macro.tolist())),
+            "spans": dict(zip(SPAN_METRIC_COLUMNS, span_metrics_from_counts(self.counts).tolist())),
+        }
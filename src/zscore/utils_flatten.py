@@ -0,0 +1,131 @@
+# python -m zscore.utils_flatten [--mrg-dir DIR] [--output-dir DIR] [-j N] [--force]  (builds the flat corpus)
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from zscore import __version__, tb
+from zscore.utils_dirs import TREEBANK_MRG_DIR, TREEBANK_PROCESSED_DIR
+from zscore.utils_process_trees import get_text_dual
+
+#  constants
+MANIFEST_FILE = "manifest.json"
+TEXT_KINDS = ("fluent", "disfluent")
+FILES_PER_TASK = 8
+
+
+def flat_paths(output_dir, mrg_name):
+    """Where the fluent and disfluent text of an .mrg file go, e.g. fluent/sw2005.txt."""
+    name = mrg_name.replace('.mrg', '.txt')
+    return tuple(os.path.join(output_dir, kind, name) for kind in TEXT_KINDS)
+
+
+def _write_text(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text + "\n")
+    os.replace(tmp_path, path)
+
+
+def flatten_file(mrg_path, output_dir, known_digest=None):
+    """
+    Write the fluent and disfluent text of one .mrg file (see get_text_dual).
+
+    The file is read once, for both its digest and its trees.  If its
+    digest equals known_digest and both texts exist, nothing is written.
+    Returns (digest, rebuilt).
+    """
+    with open(mrg_path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    paths = flat_paths(output_dir, os.path.basename(mrg_path))
+    if digest == known_digest and all(os.path.exists(path) for path in paths):
+        return digest, False
+
+    contents = data.decode("utf-8")
+    for path, text in zip(paths, get_text_dual(tb.read_string(contents))):
+        _write_text(path, text)
+    return digest, True
+
+
+def _flatten_task(args):
+    return flatten_file(*args)
+
+
+def read_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    # text written by another version may differ: rebuild everything
+    return manifest["files"] if manifest.get("version") == __version__ else {}
+
+
+def write_manifest(output_dir, files):
+    _write_text(os.path.join(output_dir, MANIFEST_FILE),
+                json.dumps({"version": __version__, "files": files}, indent=1, sort_keys=True))
+
+
+def build_flat_corpus(mrg_dir=TREEBANK_MRG_DIR, output_dir=TREEBANK_PROCESSED_DIR, workers=1, force=False):
+    """
+    Flatten every sw*.mrg file under mrg_dir into output_dir/fluent and output_dir/disfluent.
+
+    Only files whose size or mtime changed since the last build are read,
+    and of those only the ones whose content hash changed are rebuilt, so
+    regenerating an up-to-date corpus is cheap.  Texts of .mrg files that
+    no longer exist are removed.  Returns {"built", "unchanged", "removed"} counts.
+    """
+    for kind in TEXT_KINDS:
+        os.makedirs(os.path.join(output_dir, kind), exist_ok=True)
+    previous = {} if force else read_manifest(output_dir)
+
+    files, tasks = {}, []
+    for path in sorted(Path(mrg_dir).rglob("sw*.mrg")):
+        stat = path.stat()
+        entry = previous.get(path.name)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns \
+                and all(os.path.exists(p) for p in flat_paths(output_dir, path.name)):
+            files[path.name] = entry
+            continue
+        files[path.name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        tasks.append((str(path), str(output_dir), entry and entry["sha256"]))
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_flatten_task, tasks, chunksize=FILES_PER_TASK))
+    else:
+        results = [flatten_file(*task) for task in tasks]
+
+    built = 0
+    for (mrg_path, _, _), (digest, rebuilt) in zip(tasks, results):
+        files[os.path.basename(mrg_path)]["sha256"] = digest
+        built += rebuilt
+
+    removed = 0
+    for name in set(previous) - set(files):
+        for path in flat_paths(output_dir, name):
+            if os.path.exists(path):
+                os.remove(path)
+        removed += 1
+
+    write_manifest(output_dir, files)
+    return {"built": built, "unchanged": len(files) - built, "removed": removed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flatten the Switchboard treebank into fluent and disfluent text.")
+    parser.add_argument("--mrg-dir", default=str(TREEBANK_MRG_DIR))
+    parser.add_argument("--output-dir", default=str(TREEBANK_PROCESSED_DIR))
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    parser.add_argument("--force", action="store_true", help="rebuild every file")
+    args = parser.parse_args(argv)
+    counts = build_flat_corpus(args.mrg_dir, args.output_dir, workers=args.jobs, force=args.force)
+    print(f"Built {counts['built']}, unchanged {counts['unchanged']}, removed {counts['removed']} "
+          f"files in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
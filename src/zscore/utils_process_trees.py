@@ -1,7 +1,8 @@
 import re
 import os
 import string
-from icecream import ic
+
+import numpy as np
 
 from zscore import tb # For parsing Penn Treebank format
 from zscore.utils_dirs import * 
@@ -11,56 +12,55 @@ def get_tree_file_path(file_id, base_dir="data/treebank_3/parsed/mrg/swbd"):
     return os.path.join(base_dir, subdir, file_id.replace('.txt','.mrg'))
 
 
-# Extract terminal tokens from preterminal nodes, while skipping disfluency, speaker codes, and mumbles
-def get_leaves_from_preterminals(tree):
-    words = []
-
-    # Identify and skip speaker label subtrees like (CODE (SYM SpeakerA1))
-    def is_speaker_code(subtree):
-        if isinstance(subtree, list) and len(subtree) >= 2 and subtree[0] == "CODE":
+# Identify speaker label subtrees like (CODE (SYM SpeakerA1))
+def is_speaker_code(subtree):
+    if isinstance(subtree, list) and len(subtree) >= 2 and subtree[0] == "CODE":
+        for child in subtree[1:]:
+            if isinstance(child, list) and len(child) == 2 and child[0] == "SYM" and child[1].startswith("Speaker"):
+                return True
+    return False
+
+# Identify unintelligible speech markers like (X (XX MUMBLEx))
+def is_mumble(subtree):
+    if isinstance(subtree, list):
+        if len(subtree) == 2 and subtree[1] == "MUMBLEx":
+            return True
+        if subtree[0] in ("XX", "X"):
             for child in subtree[1:]:
-                if isinstance(child, list) and len(child) == 2 and child[0] == "SYM" and child[1].startswith("Speaker"):
+                if isinstance(child, str) and child == "MUMBLEx":
                     return True
-        return False
+    return False
 
-    # Identify and skip unintelligible speech markers like (X (XX MUMBLEx))
-    def is_mumble(subtree):
-        if isinstance(subtree, list):
-            if len(subtree) == 2 and subtree[1] == "MUMBLEx":
-                return True
-            if subtree[0] in ("XX", "X"):
-                for child in subtree[1:]:
-                    if isinstance(child, str) and child == "MUMBLEx":
-                        return True
-        return False
-
-    # Traverse the tree recursively
-    if isinstance(tree, list):
-        if is_speaker_code(tree) or is_mumble(tree):
-            return []  # Skip unwanted metadata or noise nodes
+# Extract terminal tokens from preterminal nodes, while skipping disfluency, speaker codes, and mumbles
+def get_leaves_from_preterminals(tree):
+    words = []
+    # Walk the tree with an explicit stack, children pushed right to left so leaves come out in order
+    stack = [tree]
+    while stack:
+        subtree = stack.pop()
+        if not isinstance(subtree, list) or is_speaker_code(subtree) or is_mumble(subtree):
+            continue  # Skip strings, metadata and noise nodes
         # If it's a preterminal node with a real word, collect the word
-        if len(tree) == 2 and isinstance(tree[1], str) and tree[0] not in ("-NONE-", "-DFL-"):
-            words.append(tree[1])
+        if len(subtree) == 2 and isinstance(subtree[1], str) and subtree[0] not in ("-NONE-", "-DFL-"):
+            words.append(subtree[1])
         else:
-            # Recursively process children
-            for subtree in tree[1:]:
-                words.extend(get_leaves_from_preterminals(subtree))
-
+            stack.extend(subtree[:0:-1])
     return words
 
+# One pass that removes space before punctuation, adds a missing space after it
+# (group 2: a following word character), and collapses other runs of whitespace
+_clean_sentence_re = re.compile(r'\s*([.,!?])(?=([^\s.,!?])?)|\s{2,}')
+
+def _clean_sentence_sub(m):
+    punctuation = m.group(1)
+    if punctuation is None:
+        return ' '
+    return punctuation + ' ' if m.group(2) else punctuation
+
 # Clean punctuation spacing and collapse extra whitespace
 def clean_sentence(tokens):
     sentence = " ".join(tokens)
-
-    # Remove unnecessary space before punctuation
-    sentence = re.sub(r'\s+([.,!?])', r'\1', sentence)
-
-    # Add space after punctuation if it's missing
-    sentence = re.sub(r'([.,!?])(?=[^\s.,!?])', r'\1 ', sentence)
-
-    # Replace multiple spaces with a single space
-    sentence = re.sub(r'\s{2,}', ' ', sentence)
-
+    sentence = _clean_sentence_re.sub(_clean_sentence_sub, sentence)
     return sentence.strip()
 
 # Fix tokenized contractions into natural English form
@@ -82,89 +82,157 @@ def postprocess_sentence(tokens):
 def is_disfluent_node(label):
     return label in ("EDITED", "INTJ", "PRN")
 
-def extract_tokens(tree, return_tags=False):
-    # Lists to hold fluent and disfluent token outputs
-    fluent_tokens = []
-    disfluent_tokens = []
-    token_tag_pairs = []  # Optional: (token, tag)
-
-    # Utility to check if a label indicates a metadata node
-    def is_metadata_node(label):
-        return label in ("CODE", "SYM")
-
-    # Utility to check if a token represents unintelligible speech
-    def is_mumble_token(token):
-        return token == "MUMBLEx"
-
-    # Recursive helper to traverse the tree and collect tokens
-    # Now also tracks the highest-level disfluent node label (EDITED, INTJ, PRN)
-    def recurse(subtree, under_disfluent=False, disfluent_label=None):
-
-        if isinstance(subtree, list):
-            label = subtree[0] if subtree else ""
-
-            # Skip entire subtree if it is a metadata node
-            if is_metadata_node(label):
-                return
-
-            # Determine if current node is disfluent and capture top-level label
-            if is_disfluent_node(label) and not under_disfluent:
-                under_disfluent = True
-                disfluent_label = label  # store the top-most disfluent label
-
-            # Check if this is a preterminal node (label and a word)
-            if len(subtree) == 2 and isinstance(subtree[1], str):
-                token = subtree[1]
-                if subtree[0] not in ("-NONE-", "-DFL-") and not is_mumble_token(token):
-
-                    # Include in fluent output only if not under disfluent context
-                    if not under_disfluent:
-                        fluent_tokens.append(token)
-
-                    # Always include in disfluent output
-                    disfluent_tokens.append(token)
-
-                    # Append tag for disfluent output if requested
-                    if return_tags:
-                        tag = disfluent_label if under_disfluent else "NONE"
-                        if token not in string.punctuation:
-                            token_tag_pairs.append((token, tag))
-            else:
-                # Recurse into children with updated disfluent status and top-level label
-                for child in subtree[1:]:
-                    recurse(child, under_disfluent, disfluent_label)
-
-    recurse(tree)
-
+def _walk_tokens(tree, fluent_tokens, disfluent_tokens, tagged_tokens=None, tags=None, spans=None, first_span=0):
+    # Single walk with an explicit stack of (subtree, top-most disfluent label or None),
+    # children pushed right to left so tokens come out in order.  Top-most disfluent
+    # nodes are numbered from first_span as they are reached; in this preorder every
+    # token under one comes before the next one is reached.  Returns the next number.
+    punctuation = string.punctuation
+    span = first_span - 1
+    stack = [(tree, None)]
+    pop, push = stack.pop, stack.append
+    while stack:
+        subtree, disfluent_label = pop()
+        label = subtree[0] if subtree else ""
+
+        # Skip entire subtree if it is a metadata node
+        if label == "CODE" or label == "SYM":
+            continue
+
+        # Track the highest-level disfluent node label (EDITED, INTJ, PRN)
+        if disfluent_label is None and (label == "EDITED" or label == "INTJ" or label == "PRN"):
+            disfluent_label = label
+            span += 1
+
+        # Preterminal node (label and a word)
+        if len(subtree) == 2 and isinstance(subtree[1], str):
+            token = subtree[1]
+            if label != "-NONE-" and label != "-DFL-" and token != "MUMBLEx":
+                # Include in fluent output only if not under disfluent context
+                if disfluent_label is None:
+                    fluent_tokens.append(token)
+                disfluent_tokens.append(token)
+                if tags is not None and token not in punctuation:
+                    tagged_tokens.append(token)
+                    tags.append(disfluent_label or "NONE")
+                    if spans is not None:
+                        spans.append(-1 if disfluent_label is None else span)
+        else:
+            for child in subtree[:0:-1]:
+                if isinstance(child, list):
+                    push((child, disfluent_label))
+    return span + 1
+
+def extract_tokens(tree, return_tags=False, return_spans=False):
+    """
+    Return the fluent and disfluent tokens of tree, and with return_tags
+    also (token, tag) pairs of its non-punctuation tokens, where tag is the
+    top-most disfluent node (EDITED, INTJ, PRN) above the token or "NONE".
+
+    return_spans (implies return_tags) also returns the span id of each
+    pair: the number of its top-most disfluent node in the tree (0, 1, ...
+    in order), or -1 for fluent tokens.
+    """
+    return_tags = return_tags or return_spans
+    fluent_tokens, disfluent_tokens = [], []
+    if not isinstance(tree, list):
+        if return_spans:
+            return fluent_tokens, disfluent_tokens, [], []
+        return (fluent_tokens, disfluent_tokens, []) if return_tags else (fluent_tokens, disfluent_tokens)
+    if not return_tags:
+        _walk_tokens(tree, fluent_tokens, disfluent_tokens)
+        return fluent_tokens, disfluent_tokens
+
+    tagged_tokens, tags, spans = [], [], [] if return_spans else None
+    _walk_tokens(tree, fluent_tokens, disfluent_tokens, tagged_tokens, tags, spans)
+    if return_spans:
+        return fluent_tokens, disfluent_tokens, list(zip(tagged_tokens, tags)), spans
+    return fluent_tokens, disfluent_tokens, list(zip(tagged_tokens, tags))
+
+class TreeTokens:
+    """
+    extract_tokens of every tree of a file, in flat lists with int64 offsets.
+
+    The tokens of tree k are fluent[fluent_offsets[k]:fluent_offsets[k + 1]],
+    and likewise for disfluent and (with return_tags) tokens/tags.  With
+    return_spans, spans is an int32 array of the span id of each tag, with
+    top-most disfluent nodes numbered across the whole file.
+    """
+
+    __slots__ = ("fluent", "disfluent", "tokens", "tags", "spans", "fluent_offsets", "disfluent_offsets",
+                 "tag_offsets")
+
+    def __init__(self, n_trees, return_tags=False, return_spans=False):
+        return_tags = return_tags or return_spans
+        self.fluent, self.disfluent = [], []
+        self.tokens, self.tags = ([], []) if return_tags else (None, None)
+        self.spans = np.zeros(0, dtype=np.int32) if return_spans else None
+        self.fluent_offsets = np.zeros(n_trees + 1, dtype=np.int64)
+        self.disfluent_offsets = np.zeros(n_trees + 1, dtype=np.int64)
+        self.tag_offsets = np.zeros(n_trees + 1, dtype=np.int64) if return_tags else None
+
+    def __len__(self):
+        return len(self.fluent_offsets) - 1
+
+    def tree(self, k):
+        """Same as extract_tokens(trees[k], return_tags)."""
+        f0, f1 = self.fluent_offsets[k:k + 2].tolist()
+        d0, d1 = self.disfluent_offsets[k:k + 2].tolist()
+        if self.tags is None:
+            return self.fluent[f0:f1], self.disfluent[d0:d1]
+        t0, t1 = self.tag_offsets[k:k + 2].tolist()
+        return self.fluent[f0:f1], self.disfluent[d0:d1], list(zip(self.tokens[t0:t1], self.tags[t0:t1]))
+
+def extract_file_tokens(trees, return_tags=False, return_spans=False):
+    """extract_tokens of every tree in trees (e.g. from tb.read_file) in one call, as a TreeTokens."""
+    return_tags = return_tags or return_spans
+    out = TreeTokens(len(trees), return_tags, return_spans)
+    fluent, disfluent, tokens, tags = out.fluent, out.disfluent, out.tokens, out.tags
+    spans = [] if return_spans else None
+    fluent_offsets, disfluent_offsets, tag_offsets = [0], [0], [0]
+    next_span = 0
+    for tree in trees:
+        if isinstance(tree, list):
+            next_span = _walk_tokens(tree, fluent, disfluent, tokens, tags, spans, next_span)
+        fluent_offsets.append(len(fluent))
+        disfluent_offsets.append(len(disfluent))
+        if return_tags:
+            tag_offsets.append(len(tags))
+    out.fluent_offsets[:] = fluent_offsets
+    out.disfluent_offsets[:] = disfluent_offsets
     if return_tags:
-        return fluent_tokens, disfluent_tokens, token_tag_pairs
+        out.tag_offsets[:] = tag_offsets
+    if return_spans:
+        out.spans = np.asarray(spans, dtype=np.int32)
+    return out
 
-    return fluent_tokens, disfluent_tokens
 
+# Runs of punctuation, paired across whitespace (",." or ",," or ", ."), that reduce to their last mark
+_punctuation_run_re = re.compile(r'[.,!?]+\s*[.,!?]+')
+_space_before_punctuation_re = re.compile(r'\s+([.,!?])')
+_multiple_spaces_re = re.compile(r'\s{2,}')
 
 def correct_final_punctuation(text):
-    # Remove leading punctuation errors like ",." or ",,"
-    text = re.sub(r'([.,!?]){2,}', lambda m: m.group(0)[-1], text)  # Reduce repeated punctuations to the last one
-    text = re.sub(r'([.,!?])\s*([.,!?])', r'\2', text)              # Fix sequences like ", ." or ",." to "."
+    # Remove punctuation errors like ",." or ",," or ", ." in one pass, keeping the last mark
+    text = _punctuation_run_re.sub(lambda m: m.group()[-1], text)
 
     # Remove space before punctuation
-    text = re.sub(r'\s+([.,!?])', r'\1', text)
+    text = _space_before_punctuation_re.sub(r'\1', text)
 
     # Replace multiple spaces with a single space
-    text = re.sub(r'\s{2,}', ' ', text)
+    text = _multiple_spaces_re.sub(' ', text)
 
     # Remove extra spaces
-    text = text.strip()
-
-    return text
+    return text.strip()
 
 def get_text_dual(trees):
     fluent_sentences = []
     disfluent_sentences = []
 
     sep_counter = 1
-    for i, tree in enumerate(trees):
-        fluent_tokens, disfluent_tokens = extract_tokens(tree)
+    file_tokens = extract_file_tokens(trees)
+    for i in range(len(file_tokens)):
+        fluent_tokens, disfluent_tokens = file_tokens.tree(i)
 
         fluent_sentence = postprocess_sentence(fluent_tokens).replace('\n','')
         disfluent_sentence = postprocess_sentence(disfluent_tokens).replace('\n','')
@@ -0,0 +1,221 @@
+# optional instrumentation for evaluate_file and align (see StageTimer and profiled)
+import cProfile
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+#  constants
+STACK_SAMPLE_INTERVAL = 0.001  # seconds between samples of the collapsed-stack sampler
+PROFILE_MODES = ("cprofile", "stacks")
+
+_active = None  # the StageTimer that stage() records into, if any
+
+
+class _Stage:
+    __slots__ = ("timer", "name", "items", "start")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.items = 0
+
+    def add(self, items):
+        self.items += items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.add(self.name, time.perf_counter() - self.start, self.items)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def add(self, items):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    """
+    Context manager timing a named stage into the active StageTimer; call
+    .add(n) on it to record n items (rows, tokens, trees) processed.
+    With no active timer this is a shared no-op.
+    """
+    return _NULL_STAGE if _active is None else _Stage(_active, name)
+
+
+def active_timer():
+    return _active
+
+
+@contextmanager
+def recording(timer):
+    """Make timer the active StageTimer for the duration (None leaves instrumentation off)."""
+    global _active
+    previous, _active = _active, timer
+    try:
+        yield timer
+    finally:
+        _active = previous
+
+
+def estimate_rows(file_path):
+    """Number of lines after the header, a cheap estimate of a CSV's rows for ETAs."""
+    lines = 0
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            lines += block.count(b"\n")
+    return max(lines - 1, 0)
+
+
+class StageTimer:
+    """
+    Wall time, call counts and item volumes per stage, plus rows/sec and ETA.
+
+    Stages nest (e.g. "score" contains "align"), so their times are not
+    additive.  Stages recorded in worker processes are merged in, so with
+    workers their seconds are summed over processes.
+
+    report_every : if set, print rows/sec and ETA to stderr at most this often (seconds)
+    total_rows   : expected rows, for the ETA (evaluate_file estimates it)
+    """
+
+    def __init__(self, report_every=None, total_rows=None, stream=None):
+        self.report_every = report_every
+        self.total_rows = total_rows
+        self.stream = stream
+        self.stages = {}  # name -> [seconds, calls, items]
+        self.rows = 0
+        self.started = time.perf_counter()
+        self._last_report = self.started
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, items=0, calls=1):
+        with self._lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                entry = self.stages[name] = [0.0, 0, 0]
+            entry[0] += seconds
+            entry[1] += calls
+            entry[2] += items
+
+    def merge(self, stages):
+        """Fold in the stages of another timer (e.g. StageTimer.stages from a worker)."""
+        for name, (seconds, calls, items) in stages.items():
+            self.add(name, seconds, items, calls)
+
+    def add_rows(self, n):
+        self.rows += n
+        if self.report_every is not None:
+            now = time.perf_counter()
+            if now - self._last_report >= self.report_every:
+                self._last_report = now
+                print(self.progress(), file=self.stream or sys.stderr, flush=True)
+
+    def progress(self):
+        """One line with rows done, rows/sec and the ETA."""
+        elapsed = time.perf_counter() - self.started
+        rate = self.rows / elapsed if elapsed > 0 else 0.0
+        line = f"scored {self.rows}"
+        if self.total_rows:
+            line += f"/{self.total_rows}"
+        line += f" rows ({rate:.1f} rows/s"
+        if self.total_rows and rate > 0:
+            line += f", ETA {max(self.total_rows - self.rows, 0) / rate:.0f}s"
+        return line + ")"
+
+    def summary(self):
+        """{"wall_s", "rows", "rows_per_s", "stages": {name: {seconds, calls, items, items_per_s, share}}}."""
+        wall = time.perf_counter() - self.started
+        stages = {}
+        for name, (seconds, calls, items) in sorted(self.stages.items(), key=lambda kv: -kv[1][0]):
+            stages[name] = {
+                "seconds": seconds,
+                "calls": calls,
+                "items": items,
+                "items_per_s": items / seconds if seconds > 0 else None,
+                "share": seconds / wall if wall > 0 else None,
+            }
+        return {"wall_s": wall, "rows": self.rows, "rows_per_s": self.rows / wall if wall > 0 else None,
+                "stages": stages}
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+class StackSampler:
+    """Samples one thread's Python stack every interval seconds into collapsed-stack counts."""
+
+    def __init__(self, thread_id=None, interval=STACK_SAMPLE_INTERVAL):
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="zscore-stack-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        """Write "frame;frame;frame count" lines, as read by flamegraph.pl and speedscope."""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profiled(path, mode="cprofile"):
+    """
+    Profile the body of the with block into path.
+
+    mode "cprofile" : deterministic cProfile, saved for pstats/snakeviz
+    mode "stacks"   : sampled collapsed stacks of the calling thread
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"unknown profile mode {mode!r}; expected one of {PROFILE_MODES}")
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+    else:
+        sampler = StackSampler().start()
+        try:
+            yield sampler
+        finally:
+            sampler.stop()
+            sampler.write(path)
@@ -0,0 +1,283 @@
+# python -m zscore.utils_references [--mrg-dir DIR] [--output FILE]  (builds the reference store)
+import argparse
+import hashlib
+import json
+import os
+import struct
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from zscore import tb
+from zscore.utils_dirs import REFERENCE_STORE_FILE, TREEBANK_MRG_DIR
+from zscore.utils_process_trees import extract_file_tokens, get_tree_file_path
+from zscore.utils_profile import stage
+
+#  constants
+DEFAULT_MAX_TOKENS = 2_000_000  # roughly all of Switchboard's disfluent tokens
+TAG_NAMES = ("NONE", "EDITED", "INTJ", "PRN")  # index = utils_evaluate.TAG_CODES value
+STORE_MAGIC = b"ZSREF\x00\x02\x00"  # layout 2 added span_ids; older stores must be rebuilt
+
+
+def read_reference(tree_file, with_spans=False):
+    """
+    Parse a treebank file into its lowercased disfluent tokens and tags.
+
+    Returns two tuples of equal length: the tokens (as used by align) and
+    the top-most disfluency tag of each token ("NONE" for fluent tokens).
+    with_spans also returns the int32 span id of each token, numbering the
+    file's top-most disfluent nodes (-1 for fluent tokens).
+    """
+    tokens, tags, _, spans = read_reference_trees(tree_file)
+    if with_spans:
+        return tuple(tokens), tuple(tags), spans
+    return tuple(tokens), tuple(tags)
+
+
+def read_reference_trees(tree_file):
+    """Like read_reference with spans, but returns lists and also the number of tokens in each tree."""
+    with stage("tb.read_file") as timed:
+        trees = tb.read_file(tree_file)
+        timed.add(len(trees))
+    with stage("extract_tokens") as timed:
+        file_tokens = extract_file_tokens(trees, return_spans=True)
+        tokens = [token.lower() for token in file_tokens.tokens]
+        timed.add(len(tokens))
+    return tokens, file_tokens.tags, np.diff(file_tokens.tag_offsets).tolist(), file_tokens.spans
+
+
+def file_digest(path):
+    """sha256 hex digest of a file's bytes, used to key results computed from it."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class ReferenceCache:
+    """
+    LRU cache of parsed references, keyed by treebank file.
+
+    The cache is bounded by the total number of tokens it holds rather than
+    by the number of files, since Switchboard conversations vary a lot in
+    length.  A reference longer than max_tokens is returned but not stored.
+    """
+
+    def __init__(self, max_tokens=DEFAULT_MAX_TOKENS, base_dir=None):
+        self.max_tokens = max_tokens
+        self.base_dir = base_dir
+        self.n_tokens = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._digests = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, file_id):
+        return self.tree_file_path(file_id) in self._entries
+
+    def config(self):
+        """Arguments that build an equivalent (empty) cache, e.g. in a worker process."""
+        return {"max_tokens": self.max_tokens, "base_dir": self.base_dir}
+
+    def reference_size(self, file_id):
+        """Cheap size estimate for scheduling: the tree file's size in bytes."""
+        return os.path.getsize(self.tree_file_path(file_id))
+
+    def reference_digest(self, file_id):
+        """Digest of file_id's tree file (see file_digest), read once per cache."""
+        key = self.tree_file_path(file_id)
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = self._digests[key] = file_digest(key)
+        return digest
+
+    def tree_file_path(self, file_id):
+        if self.base_dir is None:
+            return get_tree_file_path(file_id)
+        return get_tree_file_path(file_id, base_dir=str(self.base_dir))
+
+    def get(self, file_id, with_spans=False):
+        """Return (tokens, tags) for file_id, parsing the tree file on a miss; with_spans adds the span ids."""
+        key = self.tree_file_path(file_id)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            entry = read_reference(key, with_spans=True)
+            self._store(key, entry)
+        return entry if with_spans else entry[:2]
+
+    def _store(self, key, entry):
+        size = len(entry[0])
+        if size > self.max_tokens:
+            return
+        self._entries[key] = entry
+        self.n_tokens += size
+        while self.n_tokens > self.max_tokens:
+            _, (evicted, *_) = self._entries.popitem(last=False)
+            self.n_tokens -= len(evicted)
+
+    def clear(self):
+        self._entries.clear()
+        self.n_tokens = 0
+
+
+def store_key(file_id):
+    """Key of file_id in a ReferenceStore, e.g. 'sw2005.txt' -> 'sw2005.mrg'."""
+    return os.path.basename(str(file_id)).replace('.txt', '.mrg')
+
+
+def build_reference_store(mrg_dir=TREEBANK_MRG_DIR, output=REFERENCE_STORE_FILE, workers=1):
+    """
+    Compile every sw*.mrg file under mrg_dir into one binary reference store.
+
+    The store holds interned int32 token ids, int8 tag codes (indices into
+    TAG_NAMES), int32 span ids, and per-file and per-tree token offsets,
+    laid out so that ReferenceStore can memory-map it.  Returns the number
+    of files stored.
+    """
+    paths = sorted(Path(mrg_dir).rglob("sw*.mrg"))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed = list(executor.map(read_reference_trees, paths, chunksize=8))
+    else:
+        parsed = [read_reference_trees(path) for path in paths]
+    digests = [file_digest(path) for path in paths]
+
+    vocab = {}
+    tag_codes = {tag: code for code, tag in enumerate(TAG_NAMES)}
+    token_ids, tags, tree_lengths, file_trees = [], [], [], [0]
+    for tokens, file_tags, lengths, _ in parsed:
+        token_ids.extend(vocab.setdefault(w, len(vocab)) for w in tokens)
+        tags.extend(tag_codes[t] for t in file_tags)
+        tree_lengths.extend(lengths)
+        file_trees.append(len(tree_lengths))
+
+    tree_offsets = np.zeros(len(tree_lengths) + 1, dtype=np.int64)
+    np.cumsum(tree_lengths, out=tree_offsets[1:])
+    arrays = {
+        "token_ids": np.asarray(token_ids, dtype=np.int32),
+        "tag_codes": np.asarray(tags, dtype=np.int8),
+        "span_ids": np.concatenate([np.zeros(0, dtype=np.int32)] + [spans for *_, spans in parsed]),
+        "tree_offsets": tree_offsets,                          # token offset of each tree
+        "file_trees": np.asarray(file_trees, dtype=np.int64),  # tree index of each file
+    }
+    _write_store(output, [store_key(path.name) for path in paths], digests, list(vocab), arrays)
+    return len(paths)
+
+
+def _write_store(output, files, digests, vocab, arrays):
+    # layout: magic, header length, JSON header, then 8-byte aligned arrays
+    header = {"files": files, "digests": digests, "vocab": vocab, "tags": list(TAG_NAMES), "arrays": {}}
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = [offset, array.dtype.str, len(array)]
+        offset += -(-array.nbytes // 8) * 8
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    header_bytes += b" " * (-(len(STORE_MAGIC) + 8 + len(header_bytes)) % 8)
+
+    tmp_path = f"{output}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(STORE_MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for array in arrays.values():
+            f.write(array.tobytes())
+            f.write(b"\x00" * (-array.nbytes % 8))
+    os.replace(tmp_path, output)
+
+
+class ReferenceStore:
+    """
+    Read-only, memory-mapped view of a store built by build_reference_store.
+
+    Lookups are O(1) by file id and only touch that file's slice of the
+    arrays, and processes that open the same store share its pages.
+    get() returns the same (tokens, tags) and span ids as ReferenceCache.get().
+    """
+
+    def __init__(self, path=REFERENCE_STORE_FILE):
+        self.path = str(path)
+        with open(self.path, "rb") as f:
+            magic = f.read(len(STORE_MAGIC))
+            if magic != STORE_MAGIC:
+                if magic.startswith(STORE_MAGIC[:5]):
+                    raise ValueError(f"{self.path} was built by an older zscore; rebuild it with "
+                                     f"python -m zscore.utils_references")
+                raise ValueError(f"{self.path} is not a zscore reference store")
+            (header_len,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_len))
+        data_start = len(STORE_MAGIC) + 8 + header_len
+
+        self.vocab = header["vocab"]
+        self.tag_names = tuple(header["tags"])
+        self.file_index = {file_id: i for i, file_id in enumerate(header["files"])}
+        self.digests = header["digests"]
+        for name, (offset, dtype, length) in header["arrays"].items():
+            array = np.memmap(self.path, dtype=np.dtype(dtype), mode="r", offset=data_start + offset, shape=(length,)) \
+                if length else np.zeros(0, dtype=np.dtype(dtype))
+            setattr(self, name, array)
+
+    def __len__(self):
+        return len(self.file_index)
+
+    def __contains__(self, file_id):
+        return store_key(file_id) in self.file_index
+
+    def config(self):
+        """Arguments that reopen this store, e.g. in a worker process."""
+        return {"path": self.path}
+
+    def _token_range(self, file_id):
+        try:
+            i = self.file_index[store_key(file_id)]
+        except KeyError:
+            raise KeyError(f"{file_id} is not in reference store {self.path}") from None
+        first_tree, end_tree = self.file_trees[i], self.file_trees[i + 1]
+        return int(self.tree_offsets[first_tree]), int(self.tree_offsets[end_tree])
+
+    def reference_size(self, file_id):
+        start, end = self._token_range(file_id)
+        return end - start
+
+    def reference_digest(self, file_id):
+        """Digest of the tree file file_id was compiled from, as ReferenceCache.reference_digest."""
+        return self.digests[self.file_index[store_key(file_id)]]
+
+    def get(self, file_id, with_spans=False):
+        """Return (tokens, tags) for file_id, as ReferenceCache.get does; with_spans adds the span ids."""
+        start, end = self._token_range(file_id)
+        with stage("store_lookup") as timed:
+            vocab, tag_names = self.vocab, self.tag_names
+            tokens = tuple(vocab[k] for k in self.token_ids[start:end].tolist())
+            tags = tuple(tag_names[k] for k in self.tag_codes[start:end].tolist())
+            timed.add(end - start)
+        if not with_spans:
+            return tokens, tags
+        return tokens, tags, np.array(self.span_ids[start:end])
+
+    def tree_token_ranges(self, file_id):
+        """(start, end) token offsets of each tree of file_id within get(file_id)."""
+        i = self.file_index[store_key(file_id)]
+        offsets = self.tree_offsets[self.file_trees[i]:self.file_trees[i + 1] + 1]
+        offsets = offsets - offsets[0]
+        return list(zip(offsets[:-1].tolist(), offsets[1:].tolist()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the memory-mapped Switchboard reference store.")
+    parser.add_argument("--mrg-dir", default=str(TREEBANK_MRG_DIR))
+    parser.add_argument("--output", default=str(REFERENCE_STORE_FILE))
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    args = parser.parse_args(argv)
+    n_files = build_reference_store(args.mrg_dir, args.output, workers=args.jobs)
+    print(f"Stored {n_files} files in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# per-row result cache shared across runs and processes (see evaluate_file's result_cache)
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from zscore import __version__
+from zscore.utils_dirs import RESULT_CACHE_FILE
+from zscore.utils_evaluate import COUNT_COLUMNS, tokenize_generated
+
+#  constants
+DEFAULT_MAX_ENTRIES = 5_000_000  # about 0.5 GB of rows
+BUSY_TIMEOUT = 60.0  # seconds a writer waits for another process's transaction
+SQLITE_MAX_VARIABLES = 900  # stay under SQLite's bound-parameter limit per statement
+COUNTS_DTYPE = np.dtype("<i8")
+
+
+def result_key(reference_digest, generated_text, version=__version__):
+    """
+    Cache key of one row: a hash of its reference file, the tokens align
+    sees in generated_text (so case and ",.!?" do not matter) and the
+    zscore version that scored it.
+    """
+    tokens = "\x1f".join(tokenize_generated(generated_text))
+    return hashlib.sha256(f"{version}\x1e{reference_digest}\x1e{tokens}".encode("utf-8")).digest()
+
+
+class ResultCache:
+    """
+    SQLite cache of per-row COUNT_COLUMNS counts, keyed by result_key.
+
+    Metrics are not stored since metrics_from_counts rebuilds them exactly.
+    The database is in WAL mode and every write is one short transaction,
+    so any number of processes can read and write it at once.  Once it
+    holds more than max_entries rows the least recently used are evicted.
+    """
+
+    def __init__(self, path=RESULT_CACHE_FILE, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._pid = None
+        self._conn = None
+        self._connect()
+
+    def _connect(self):
+        # connections must not cross fork(): reopen in each process
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # usable from one thread at a time, not necessarily the one that opened it
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, counts BLOB NOT NULL, used REAL NOT NULL)"
+            " WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        self._conn, self._pid = conn, os.getpid()
+        return conn
+
+    def config(self):
+        """Arguments that open the same cache, e.g. in a worker process."""
+        return {"path": self.path, "max_entries": self.max_entries}
+
+    def __len__(self):
+        return self._connect().execute("SELECT count(*) FROM results").fetchone()[0]
+
+    def get_many(self, keys):
+        """
+        Return {key: counts array} for the keys that are cached, and mark
+        them used.  Rows written with another COUNT_COLUMNS layout are misses.
+        """
+        conn = self._connect()
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            batch = keys[start:start + SQLITE_MAX_VARIABLES]
+            marks = ",".join("?" * len(batch))
+            for key, counts in conn.execute(f"SELECT key, counts FROM results WHERE key IN ({marks})", batch):
+                if len(counts) == len(COUNT_COLUMNS) * COUNTS_DTYPE.itemsize:
+                    found[key] = np.frombuffer(counts, dtype=COUNTS_DTYPE).astype(np.float64)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        if found:
+            now = time.time()
+            with _immediate(conn):
+                conn.executemany("UPDATE results SET used = ? WHERE key = ?", ((now, key) for key in found))
+        return found
+
+    def put_many(self, items):
+        """Store (key, counts) pairs; counts with NaNs (failed rows) are skipped."""
+        rows = []
+        now = time.time()
+        for key, counts in items:
+            counts = np.asarray(counts, dtype=np.float64)
+            if len(counts) == len(COUNT_COLUMNS) and not np.isnan(counts).any():
+                rows.append((key, counts.astype(COUNTS_DTYPE).tobytes(), now))
+        if not rows:
+            return
+        conn = self._connect()
+        with _immediate(conn):
+            conn.executemany("INSERT OR REPLACE INTO results (key, counts, used) VALUES (?, ?, ?)", rows)
+            excess = conn.execute("SELECT count(*) FROM results").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)", (excess,)
+                )
+
+    def clear(self):
+        conn = self._connect()
+        with _immediate(conn):
+            conn.execute("DELETE FROM results")
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def __getstate__(self):
+        return self.config()
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+@contextmanager
+def _immediate(conn):
+    """BEGIN IMMEDIATE ... COMMIT: concurrent writers wait on the busy timeout instead of failing mid-transaction."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
@@ -0,0 +1,144 @@
+import numpy as np
+
+from zscore.utils_evaluate import COUNT_COLUMNS, METRIC_COLUMNS, metrics_from_counts
+
+#  constants
+DEFAULT_RESAMPLES = 10_000
+WEIGHTS_PER_BATCH = 4_000_000  # resample weights held in memory at once (batch x rows)
+BINCOUNT_BINS = 1 << 18  # resample weights counted per bincount call
+
+
+def counts_array(df):
+    """
+    Per-row counts from an eval frame written with with_counts=True.
+
+    Rows that failed to evaluate (NaN counts) are dropped, so when pairing
+    two systems drop failures from both frames before calling this.
+    """
+    counts = df[list(COUNT_COLUMNS)].to_numpy(dtype=np.float64)
+    return counts[~np.isnan(counts).any(axis=1)]
+
+
+def _scorer(counts, average):
+    """
+    Return (score, linear_parts) for counts under average.
+
+    Both averages are ratios of row sums, so a resample only needs
+    weights @ linear_parts: summed counts for "micro", and per-row metric
+    sums plus non-NaN row counts for "macro".
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    if average == "micro":
+        return metrics_from_counts, counts
+    if average == "macro":
+        metrics = metrics_from_counts(counts)
+        valid = ~np.isnan(metrics)
+        parts = np.concatenate([np.where(valid, metrics, 0.0), valid], axis=1)
+
+        def score(sums):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return sums[..., :len(METRIC_COLUMNS)] / sums[..., len(METRIC_COLUMNS):]
+        return score, parts
+    raise ValueError(f"unknown average {average!r}; expected 'micro' or 'macro'")
+
+
+def _bootstrap_weights(n_rows, n_resamples, rng):
+    """Yield (batch, n_rows) arrays of how often each row is drawn in each resample."""
+    batch = max(1, WEIGHTS_PER_BATCH // max(n_rows, 1))
+    for start in range(0, n_resamples, batch):
+        draws = rng.integers(0, n_rows, size=(min(batch, n_resamples - start), n_rows), dtype=np.int32)
+        weights = np.empty(draws.shape)
+        # one bincount per group of resamples, resample k of a group counting into bins k * n_rows ...;
+        # groups are kept cache-sized, since one bincount over the whole batch is slower than per row
+        group = max(1, BINCOUNT_BINS // max(n_rows, 1))
+        offsets = np.arange(min(group, len(draws)), dtype=np.int32)[:, None] * n_rows
+        for g in range(0, len(draws), group):
+            block = draws[g:g + group]
+            block += offsets[:len(block)]
+            weights[g:g + group] = np.bincount(block.ravel(), minlength=block.size).reshape(block.shape)
+        yield weights
+
+
+def _confidence_interval(samples, alpha):
+    low, high = np.nanpercentile(samples, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    return low, high
+
+
+def bootstrap_ci(counts, n_resamples=DEFAULT_RESAMPLES, alpha=0.05, average="micro", seed=None):
+    """
+    Percentile bootstrap confidence intervals for the corpus E-scores and Z-scores.
+
+    counts  : (n, len(COUNT_COLUMNS)) per-row counts (see alignment_counts)
+    average : "micro" (metrics of summed counts) or "macro" (mean of row metrics)
+
+    Returns {metric: (score, low, high)} for each of METRIC_COLUMNS.
+    """
+    score, parts = _scorer(counts, average)
+    rng = np.random.default_rng(seed)
+    samples = np.concatenate([score(w @ parts) for w in _bootstrap_weights(len(parts), n_resamples, rng)])
+    estimate = score(parts.sum(axis=0))
+    low, high = _confidence_interval(samples, alpha)
+    return {m: (estimate[k], low[k], high[k]) for k, m in enumerate(METRIC_COLUMNS)}
+
+
+def paired_bootstrap(counts_a, counts_b, n_resamples=DEFAULT_RESAMPLES, alpha=0.05, average="micro", seed=None):
+    """
+    Paired bootstrap of the difference b - a between two systems scored on the same rows.
+
+    Row k of counts_a and counts_b must be the same reference and prompt.
+    Returns {metric: (difference, low, high, p_value)}, where p_value is the
+    two-sided bootstrap p-value of the difference being zero.
+    """
+    score_a, parts_a = _scorer(counts_a, average)
+    score_b, parts_b = _scorer(counts_b, average)
+    if parts_a.shape != parts_b.shape:
+        raise ValueError(f"systems have different numbers of rows: {len(parts_a)} vs {len(parts_b)}")
+
+    rng = np.random.default_rng(seed)
+    parts = np.concatenate([parts_a, parts_b], axis=1)
+    width = parts_a.shape[1]
+    samples = []
+    for w in _bootstrap_weights(len(parts), n_resamples, rng):
+        sums = w @ parts
+        samples.append(score_b(sums[:, width:]) - score_a(sums[:, :width]))
+    samples = np.concatenate(samples)
+
+    difference = score_b(parts_b.sum(axis=0)) - score_a(parts_a.sum(axis=0))
+    low, high = _confidence_interval(samples, alpha)
+    with np.errstate(invalid="ignore"):
+        n_valid = (~np.isnan(samples)).sum(axis=0)
+        below = np.minimum((samples <= 0).sum(axis=0), (samples >= 0).sum(axis=0))
+        p_values = np.minimum(1.0, 2 * below / n_valid)
+    return {m: (difference[k], low[k], high[k], p_values[k]) for k, m in enumerate(METRIC_COLUMNS)}
+
+
+def permutation_test(counts_a, counts_b, n_resamples=DEFAULT_RESAMPLES, average="micro", seed=None):
+    """
+    Paired approximate randomization test between two systems scored on the same rows.
+
+    Each resample swaps the two systems' outputs on a random half of the
+    rows.  Returns {metric: (difference b - a, p_value)} with the usual
+    (hits + 1) / (resamples + 1) estimate.
+    """
+    score_a, parts_a = _scorer(counts_a, average)
+    score_b, parts_b = _scorer(counts_b, average)
+    if parts_a.shape != parts_b.shape:
+        raise ValueError(f"systems have different numbers of rows: {len(parts_a)} vs {len(parts_b)}")
+
+    sum_a, sum_b = parts_a.sum(axis=0), parts_b.sum(axis=0)
+    observed = np.abs(score_b(sum_b) - score_a(sum_a))
+    delta = parts_b - parts_a
+
+    rng = np.random.default_rng(seed)
+    n_rows = len(delta)
+    batch = max(1, WEIGHTS_PER_BATCH // max(n_rows, 1))
+    hits = np.zeros(len(METRIC_COLUMNS))
+    for start in range(0, n_resamples, batch):
+        swaps = rng.integers(0, 2, size=(min(batch, n_resamples - start), n_rows)).astype(np.float64)
+        moved = swaps @ delta  # what the swapped rows move from b to a
+        with np.errstate(invalid="ignore"):
+            hits += (np.abs(score_b(sum_b - moved) - score_a(sum_a + moved)) >= observed - 1e-12).sum(axis=0)
+
+    difference = score_b(sum_b) - score_a(sum_a)
+    p_values = np.where(np.isnan(observed), np.nan, (hits + 1) / (n_resamples + 1))
+    return {m: (difference[k], p_values[k]) for k, m in enumerate(METRIC_COLUMNS)}
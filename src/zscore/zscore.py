@@ -1,57 +1,479 @@
-# python -m zscore.zscore
-import re
+# python -m zscore.zscore input.csv (see zscore.cli)
 import os
-import pandas as pd
-from pathlib import Path
-from icecream import ic
-import fnmatch
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
 
-from zscore.utils_evaluate import *
-from zscore import tb
-from zscore.utils_process_trees import extract_tokens, get_tree_file_path
+from zscore.utils_evaluate import (COUNT_COLUMNS, METRIC_COLUMNS, SPAN_METRIC_COLUMNS, align_prepared, alignment_counts,
+                                   metrics_from_counts, prepare_reference, span_metrics_from_counts)
+from zscore.utils_alignments import AlignmentBuffer, AlignmentWriter
+from zscore.utils_profile import StageTimer, active_timer, estimate_rows, profiled, recording, stage
+from zscore.utils_references import ReferenceCache
+from zscore.utils_results import result_key
 
-def evaluate_file(file_path):
-    df = pd.read_csv(file_path)
+# pandas is imported only where DataFrames are read or built, so that
+# evaluate_records and worker processes start without it
 
-    metrics = {"e_p": [], "e_r": [], "e_f": [], "z_e": [], "z_i": [], "z_p": []}
+NAN_COUNTS = (float("nan"),) * len(COUNT_COLUMNS)
+DEFAULT_CHUNK_SIZE = 32  # rows per task in parallel mode
+ARROW_BLOCK_SIZE = 1 << 24  # bytes of CSV per Arrow batch when streaming
 
-    for _, row in df.iterrows():
-        try:
-            generated_text = str(row["generated-text"])
-            file_id = row["filename"]  # e.g., 'sw2005.mrg'
-            tree_file = get_tree_file_path(file_id)
-
-            # Parse trees and extract tokens and tags
-            trees = tb.read_file(tree_file)
-            disfluent_tokens = []
-            disfluent_tags = []
-
-            for tree in trees:
-                _, _, token_tag_pairs = extract_tokens(tree, return_tags=True)
-                if token_tag_pairs:
-                    tokens, tags = zip(*token_tag_pairs)
-                    disfluent_tokens.extend(tokens)
-                    disfluent_tags.extend(tags)
-
-            # Run alignment and metric computation
-            alignment = align(disfluent_tokens, disfluent_tags, generated_text)
-            e_p, e_r, e_f = e_prf(alignment)
-            z_e, z_i, z_p = z_eip(alignment)
+TEXT_COLUMN = "generated-text"
+
+def evaluate_rows(rows, cache, alignments=None):
+    """
+    Evaluate (index, file_id, generated_texts) rows, one text per system.
 
+    Returns (index, [counts per system]) pairs; failures get NaN counts.
+    Consecutive rows of the same file share one prepared reference.
+    With alignments (an AlignmentBuffer), every alignment is also added to it.
+    """
+    results = []
+    prepared_id = reference = None
+    timer = active_timer()
+    for i, file_id, generated_texts in rows:
+        if timer is not None:
+            timer.add_rows(1)
+        try:
+            if file_id != prepared_id or reference is None:
+                prepared_id, reference = file_id, None
+                reference = prepare_reference(*cache.get(file_id, with_spans=True))
         except Exception as e:
-            print(f"Error processing row ({row.get('filename', 'unknown')}): {e}")
-            e_p, e_r, e_f, z_e, z_i, z_p = [float("nan")] * 6
-
-        metrics["e_p"].append(e_p)
-        metrics["e_r"].append(e_r)
-        metrics["e_f"].append(e_f)
-        metrics["z_e"].append(z_e)
-        metrics["z_i"].append(z_i)
-        metrics["z_p"].append(z_p)
-
-    for k, v in metrics.items():
-        df[k] = v
-
-    eval_path = os.path.join(os.path.dirname(file_path), "eval__" + os.path.basename(file_path))
-    df.to_csv(eval_path, index=False)
-    print(f"Saved evaluation to {eval_path}")
+            print(f"Error processing row ({file_id}): {e}")
+            results.append((i, [NAN_COUNTS] * len(generated_texts)))
+            continue
+
+        row_counts = []
+        for system, generated_text in enumerate(generated_texts):
+            try:
+                with stage("align") as timed:
+                    alignment = align_prepared(reference, generated_text)
+                    row_counts.append(alignment_counts(alignment))
+                    timed.add(1)
+                if alignments is not None:
+                    alignments.add(i, system, file_id, alignment)
+            except Exception as e:
+                print(f"Error processing row ({file_id}): {e}")
+                row_counts.append(NAN_COUNTS)
+        results.append((i, row_counts))
+    return results
+
+# each worker process keeps its own reference cache across chunks
+_worker_cache = None
+
+def _init_worker(cache_class, config):
+    global _worker_cache
+    _worker_cache = cache_class(**config)
+
+def _evaluate_chunk(rows, instrument=False, export_alignments=False):
+    if not instrument and not export_alignments:
+        return evaluate_rows(rows, _worker_cache)
+    # time the chunk's stages and/or collect its alignments in this worker; the parent merges them
+    alignments = AlignmentBuffer() if export_alignments else None
+    with recording(StageTimer() if instrument else None) as timer:
+        results = evaluate_rows(rows, _worker_cache, alignments)
+    return results, timer and timer.stages, alignments
+
+def longest_first(file_ids, cache):
+    """Row order with the largest reference files first, rows of the same file kept together."""
+    sizes = {}
+    for file_id in set(file_ids):
+        try:
+            sizes[file_id] = cache.reference_size(file_id)
+        except Exception:
+            sizes[file_id] = 0  # missing files fail fast in the worker
+    return sorted(range(len(file_ids)), key=lambda i: (-sizes[file_ids[i]], str(file_ids[i])))
+
+def make_executor(cache, workers):
+    """Process pool whose workers each open a cache (or store) configured like cache."""
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                               initargs=(type(cache), cache.config()))
+
+def evaluate_rows_parallel(rows, executor, chunk_size=DEFAULT_CHUNK_SIZE, alignments=None):
+    """Evaluate rows in chunks of chunk_size on executor (see make_executor)."""
+    chunks = [rows[k:k + chunk_size] for k in range(0, len(rows), chunk_size)]
+    results = []
+    timer = active_timer()
+    if timer is None and alignments is None:
+        for chunk_results in executor.map(_evaluate_chunk, chunks):
+            results.extend(chunk_results)
+        return results
+    task = partial(_evaluate_chunk, instrument=timer is not None, export_alignments=alignments is not None)
+    for chunk_results, stages, chunk_alignments in executor.map(task, chunks):
+        results.extend(chunk_results)
+        if timer is not None:
+            timer.merge(stages)
+            timer.add_rows(len(chunk_results))
+        if alignments is not None:
+            alignments.extend(chunk_alignments)
+    return results
+
+def score_rows(file_ids, generated_texts, cache, group_by_file=False, executor=None, chunk_size=DEFAULT_CHUNK_SIZE,
+               result_cache=None):
+    """Return an (n, len(COUNT_COLUMNS)) float array of counts, NaN for rows that failed."""
+    return score_systems(file_ids, [generated_texts], cache, group_by_file, executor, chunk_size, result_cache)[0]
+
+def score_systems(file_ids, texts_by_system, cache, group_by_file=False, executor=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                  result_cache=None, alignments=None):
+    """
+    Score several systems' generated texts for the same rows in one pass.
+
+    texts_by_system holds one list of n generated texts per system.  Each
+    row's reference is looked up and prepared once for all systems.  With
+    a ResultCache, (row, system) pairs scored in an earlier run are served
+    from it and only the rest are aligned, then stored.  With alignments
+    (an AlignmentBuffer or AlignmentWriter) every pair is aligned, and its
+    alignment added to it, so the cache is only written to.
+    Returns an (n_systems, n, len(COUNT_COLUMNS)) float array.
+    """
+    all_systems = tuple(range(len(texts_by_system)))
+    counts = np.full((len(texts_by_system), len(file_ids), len(COUNT_COLUMNS)), np.nan)
+    keys = pending = None
+    if result_cache is not None:
+        keys = result_keys(file_ids, texts_by_system, cache)
+        with stage("result_cache.get") as timed:
+            cached = {} if alignments is not None else \
+                result_cache.get_many(key for system_keys in keys for key in system_keys if key is not None)
+            timed.add(len(cached))
+        pending = {}
+        for i in range(len(file_ids)):
+            missing = []
+            for s in all_systems:
+                hit = cached.get(keys[s][i])
+                if hit is None:
+                    missing.append(s)
+                else:
+                    counts[s, i] = hit
+            if missing:
+                pending[i] = tuple(missing)
+        timer = active_timer()
+        if timer is not None:
+            timer.add_rows(len(file_ids) - len(pending))  # rows served entirely from the cache
+
+    order = range(len(file_ids))
+    if executor is not None:
+        order = longest_first(file_ids, cache)
+    elif group_by_file:
+        order = sorted(order, key=lambda i: str(file_ids[i]))
+    if pending is not None:
+        order = [i for i in order if i in pending]
+    systems = (lambda i: all_systems) if pending is None else pending.__getitem__
+    rows = [(i, file_ids[i], tuple(texts_by_system[s][i] for s in systems(i))) for i in order]
+
+    if executor is not None:
+        indexed_results = evaluate_rows_parallel(rows, executor, chunk_size, alignments)
+    else:
+        indexed_results = evaluate_rows(rows, cache, alignments)
+
+    for i, row_counts in indexed_results:
+        counts[list(systems(i)), i] = row_counts
+    if result_cache is not None:
+        with stage("result_cache.put"):
+            result_cache.put_many((keys[s][i], counts[s, i]) for i in pending for s in pending[i]
+                                  if keys[s][i] is not None)
+    return counts
+
+def result_keys(file_ids, texts_by_system, cache):
+    """result_key of every (system, row); None where the reference can't be read."""
+    digests = {}
+    for file_id in set(file_ids):
+        try:
+            digests[file_id] = cache.reference_digest(file_id)
+        except Exception:
+            digests[file_id] = None  # scored (and failed) as usual, never cached
+    return [[None if digests[file_id] is None else result_key(digests[file_id], text)
+             for file_id, text in zip(file_ids, texts)] for texts in texts_by_system]
+
+def system_name(column):
+    """System name of a generated-text column, e.g. 'generated-text-gpt' -> 'gpt'."""
+    if column.startswith(TEXT_COLUMN + "-"):
+        return column[len(TEXT_COLUMN) + 1:]
+    return column
+
+def system_columns(columns):
+    """The generated-text-* columns of a frame, in order."""
+    return [c for c in columns if c.startswith(TEXT_COLUMN + "-")]
+
+def evaluate_frame(df, cache, group_by_file=False, executor=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                   with_counts=False, aggregator=None, text_columns=None, result_cache=None, span_metrics=False,
+                   alignments=None):
+    """
+    Add the metric columns to df in place (see evaluate_file for the options).
+
+    With text_columns, every listed column is scored and gets its own block
+    of <metric>__<system> columns; aggregator is then {system: CorpusAggregator}.
+    """
+    import pandas as pd
+    file_ids = df["filename"].tolist()  # e.g., 'sw2005.mrg'
+    columns = [TEXT_COLUMN] if text_columns is None else list(text_columns)
+    # missing text reads as NaN with pandas and None with Arrow; both score as "nan"
+    texts_by_system = [["nan" if pd.isna(text) else str(text) for text in df[column]] for column in columns]
+    counts = score_systems(file_ids, texts_by_system, cache, group_by_file, executor, chunk_size, result_cache,
+                           alignments)
+
+    for column, system_counts in zip(columns, counts):
+        suffix = "" if text_columns is None else "__" + system_name(column)
+        for k, v in zip(METRIC_COLUMNS, metrics_from_counts(system_counts).T):
+            df[k + suffix] = v
+        if span_metrics:
+            for k, v in zip(SPAN_METRIC_COLUMNS, span_metrics_from_counts(system_counts).T):
+                df[k + suffix] = v
+        if with_counts:
+            for k, v in zip(COUNT_COLUMNS, system_counts.T):
+                df[k + suffix] = v if np.isnan(v).any() else v.astype(np.int64)
+        if aggregator is not None:
+            system_aggregator = aggregator if text_columns is None else aggregator[system_name(column)]
+            system_aggregator.add_many(system_counts)
+    return df
+
+def systems_summary(aggregators, average="micro"):
+    """
+    Side-by-side corpus scores of several systems: a DataFrame with one row
+    per system and the METRIC_COLUMNS under average ("micro" or "macro").
+    """
+    import pandas as pd
+    results = {system: aggregator.result() for system, aggregator in aggregators.items()}
+    summary = pd.DataFrame.from_dict({system: result[average] for system, result in results.items()},
+                                     orient="index", columns=list(METRIC_COLUMNS))
+    summary.insert(0, "rows", [result["rows"] for result in results.values()])
+    summary.insert(1, "failed", [result["failed"] for result in results.values()])
+    summary.index.name = "system"
+    return summary
+
+_default_cache = None
+
+def default_cache():
+    """The ReferenceCache used when no cache is passed, shared across calls in this process."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ReferenceCache()
+    return _default_cache
+
+def evaluate_records(records, cache=None, group_by_file=True, with_counts=False, aggregator=None, result_cache=None,
+                     span_metrics=False):
+    """
+    Score (filename, generated_text) pairs in memory, without a CSV round trip.
+
+    Returns {column: np.ndarray} with the METRIC_COLUMNS (and SPAN_METRIC_COLUMNS
+    if span_metrics, COUNT_COLUMNS if with_counts), in the order of records;
+    rows that fail are NaN.
+    """
+    file_ids, generated_texts = [], []
+    for file_id, generated_text in records:
+        file_ids.append(file_id)
+        generated_texts.append(str(generated_text))
+
+    counts = score_rows(file_ids, generated_texts, default_cache() if cache is None else cache, group_by_file,
+                        result_cache=result_cache)
+    if aggregator is not None:
+        aggregator.add_many(counts)
+
+    results = dict(zip(METRIC_COLUMNS, metrics_from_counts(counts).T))
+    if span_metrics:
+        results.update(zip(SPAN_METRIC_COLUMNS, span_metrics_from_counts(counts).T))
+    if with_counts:
+        results.update(zip(COUNT_COLUMNS, counts.T))
+    return results
+
+def evaluate_dataframe(df, cache=None, group_by_file=True, with_counts=False, aggregator=None, inplace=True,
+                       text_columns=None, result_cache=None, span_metrics=False):
+    """
+    Add the metric columns to a DataFrame with filename and generated-text columns.
+
+    Works on the column arrays directly; returns df (or a copy if not inplace).
+    text_columns scores several systems at once, as in evaluate_frame.
+    """
+    if not inplace:
+        df = df.copy()
+    return evaluate_frame(df, default_cache() if cache is None else cache, group_by_file,
+                          with_counts=with_counts, aggregator=aggregator, text_columns=text_columns,
+                          result_cache=result_cache, span_metrics=span_metrics)
+
+def iter_csv_chunks(file_path, chunk_rows, use_arrow=None, text_columns=(TEXT_COLUMN,)):
+    """
+    Yield DataFrames of at most chunk_rows rows from the CSV at file_path.
+
+    use_arrow    : read with pyarrow's multithreaded streaming CSV reader;
+                   None uses it when pyarrow is installed
+    text_columns : columns Arrow must read as strings
+    """
+    pa_csv = None
+    if use_arrow is not False:
+        try:
+            from pyarrow import csv as pa_csv
+        except ImportError:
+            if use_arrow:
+                raise
+
+    if pa_csv is None:
+        import pandas as pd
+        yield from pd.read_csv(file_path, chunksize=chunk_rows)
+        return
+
+    import pyarrow as pa
+    reader = pa_csv.open_csv(
+        file_path,
+        read_options=pa_csv.ReadOptions(use_threads=True, block_size=ARROW_BLOCK_SIZE),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={column: pa.string() for column in ("filename", *text_columns)},
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        for start in range(0, batch.num_rows, chunk_rows):
+            yield batch.slice(start, chunk_rows).to_pandas()
+
+OUTPUT_FORMATS = ("csv", "parquet", "jsonl")
+
+class FrameWriter:
+    """Write DataFrames one after another to a csv, jsonl or parquet file."""
+
+    def __init__(self, path, fmt="csv"):
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"unknown output format {fmt!r}; expected one of {OUTPUT_FORMATS}")
+        self.path = path
+        self.fmt = fmt
+        self._file = None
+        self._parquet = None
+        self._schema = None
+        if fmt != "parquet":
+            self._file = open(path, "w", newline="", encoding="utf-8")
+
+    def write(self, df):
+        if self.fmt == "csv":
+            df.to_csv(self._file, index=False, header=(self._file.tell() == 0))
+        elif self.fmt == "jsonl":
+            df.to_json(self._file, orient="records", lines=True, force_ascii=False)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            if self._parquet is None:
+                self._schema = table.schema
+                self._parquet = pq.ParquetWriter(self.path, self._schema)
+            self._parquet.write_table(table)  # one row group per chunk
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self._parquet is not None:
+            self._parquet.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def default_output_path(file_path, fmt="csv"):
+    """eval__<name> next to file_path, with the extension of fmt."""
+    name = os.path.basename(file_path)
+    if fmt != "csv":
+        name = os.path.splitext(name)[0] + "." + fmt
+    return os.path.join(os.path.dirname(file_path), "eval__" + name)
+
+def evaluate_file(file_path, cache=None, group_by_file=False, workers=1, chunk_size=DEFAULT_CHUNK_SIZE,
+                  stream_rows=None, use_arrow=None, with_counts=False, aggregator=None,
+                  output_path=None, output_format="csv", write_output=True, text_columns=None, result_cache=None,
+                  timer=None, profile=None, profile_mode="cprofile", span_metrics=False, alignments=None,
+                  alignments_format="arrow"):
+    """
+    Score every row of file_path and write eval__<name> next to it.
+
+    cache         : ReferenceCache or ReferenceStore to look references up in;
+                    default_cache() if None
+    group_by_file : evaluate rows grouped by filename so each reference is
+                    parsed at most once even with a small cache; the output
+                    keeps the original row order
+    workers       : if > 1, spread chunks of chunk_size rows over a process
+                    pool, longest conversations first; each worker keeps its
+                    own cache configured like cache
+    stream_rows   : if set, read, score and append the output this many rows
+                    at a time, so memory stays flat for any file size and a
+                    crash keeps the rows written so far
+    use_arrow     : for streaming, read with pyarrow (None = if installed)
+    with_counts   : also write the raw COUNT_COLUMNS per row
+    span_metrics  : also write the SPAN_METRIC_COLUMNS per row: the fraction
+                    of each class's disfluent spans removed completely,
+                    partially and not at all
+    aggregator    : CorpusAggregator that every row's counts are added to
+    output_path   : where to write instead of eval__<name>
+    output_format : one of OUTPUT_FORMATS
+    write_output  : if False, only score (e.g. to fill aggregator)
+    text_columns  : score each of these generated-text columns (e.g. from
+                    system_columns) against the same references in one pass;
+                    each system gets <metric>__<system> columns and
+                    aggregator is {system: CorpusAggregator}
+    result_cache  : ResultCache to serve unchanged rows from and store new
+                    rows in, across runs (see zscore.utils_results)
+    timer         : StageTimer to record per-stage times, rows/sec and ETA in
+                    (see zscore.utils_profile); off, and free, if None
+    profile       : path to write a profile of the run to, in profile_mode
+                    ("cprofile" stats or sampled "stacks"; see profiled)
+    alignments    : directory to save every row's per-token alignment in
+                    (alignments_format "arrow" or "parquet"), to re-score the
+                    run later with zscore.utils_alignments.AlignmentStore;
+                    every row is then aligned, even with a result_cache
+    """
+    if cache is None:
+        cache = default_cache()
+    if output_path is None:
+        output_path = default_output_path(file_path, output_format)
+    if timer is not None and timer.total_rows is None:
+        timer.total_rows = estimate_rows(file_path)
+    if stream_rows is None:
+        import pandas as pd
+        chunks = iter([pd.read_csv(file_path)])
+    else:
+        chunks = iter_csv_chunks(file_path, stream_rows, use_arrow, text_columns or (TEXT_COLUMN,))
+
+    executor = make_executor(cache, workers) if workers > 1 else None
+    writer = FrameWriter(output_path, output_format) if write_output else None
+    alignment_writer = None
+    if alignments is not None:
+        systems = [TEXT_COLUMN] if text_columns is None else [system_name(column) for column in text_columns]
+        alignment_writer = AlignmentWriter(alignments, alignments_format, systems)
+    n_rows, finished = 0, False
+    with ExitStack() as stack:
+        stack.enter_context(recording(timer))
+        if profile is not None:
+            stack.enter_context(profiled(profile, profile_mode))
+        try:
+            while True:
+                with stage("read_csv") as timed:
+                    chunk = next(chunks, None)
+                    if chunk is not None:
+                        timed.add(len(chunk))
+                if chunk is None:
+                    break
+                if alignment_writer is not None:
+                    alignment_writer.row_offset = n_rows
+                with stage("score") as timed:
+                    chunk = evaluate_frame(chunk, cache, group_by_file, executor, chunk_size,
+                                           with_counts, aggregator, text_columns, result_cache, span_metrics,
+                                           alignment_writer)
+                    timed.add(len(chunk))
+                n_rows += len(chunk)
+                if writer is not None:
+                    with stage("write_output") as timed:
+                        writer.write(chunk)
+                        timed.add(len(chunk))
+            finished = True
+        finally:
+            if writer is not None:
+                writer.close()
+            if alignment_writer is not None:
+                with stage("write_alignments"):
+                    alignment_writer.close(n_rows, complete=finished)
+            if executor is not None:
+                executor.shutdown()
+
+    if write_output:
+        print(f"Saved evaluation to {output_path}")
+
+if __name__ == "__main__":
+    from zscore.cli import main
+    main()
@@ -0,0 +1,72 @@
+# python -m unittest tests.test_cli
+
+import unittest
+import contextlib
+import io
+import json
+import os
+import tempfile
+import pandas as pd
+
+from zscore.cli import main
+from tests.test_evaluate import write_trees
+
+class TestCommandLine(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.base = self.tmpdir.name
+        write_trees(self.base, ["sw9999.mrg"])
+        self.csv_path = os.path.join(self.base, "test.csv")
+        pd.DataFrame({
+            "filename": ["sw9999.mrg", "sw9999.mrg", "sw0000.mrg"],
+            "generated-text": ["but she was truly aware", "I mean but she was truly she was truly aware", "uh"],
+        }).to_csv(self.csv_path, index=False)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_cli(self, *args):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main([self.csv_path, "--treebank-dir", self.base, *args])
+        return out.getvalue()
+
+    def test_csv_and_jsonl_outputs_agree(self):
+        self.run_cli("--chunk-size", "2")
+        from_csv = pd.read_csv(os.path.join(self.base, "eval__test.csv"))
+
+        jsonl_path = os.path.join(self.base, "out.jsonl")
+        self.run_cli("--format", "jsonl", "--output", jsonl_path, "--counts")
+        from_jsonl = pd.read_json(jsonl_path, lines=True)
+
+        self.assertEqual(from_csv["e_r"].tolist()[:2], [1.0, 0.0])
+        pd.testing.assert_frame_equal(from_jsonl[from_csv.columns], from_csv)
+        self.assertIn("tp", from_jsonl.columns)
+
+    def test_summary_prints_corpus_scores(self):
+        out = self.run_cli("--summary")
+        summary = json.loads(out[out.index("{"):], parse_constant=self.fail)  # strict JSON: no NaN
+        self.assertEqual((summary["rows"], summary["failed"]), (2, 1))
+        self.assertEqual(summary["micro"]["e_r"], 0.5)
+        self.assertIsNone(summary["micro"]["z_i"])  # no INTJ tokens
+        self.assertFalse(os.path.exists(os.path.join(self.base, "eval__test.csv")))
+
+    def test_all_systems_summary(self):
+        df = pd.read_csv(self.csv_path)
+        df["generated-text-x"] = df.pop("generated-text")
+        df["generated-text-y"] = ["she was truly aware", "I mean", "uh"]
+        df.to_csv(self.csv_path, index=False)
+
+        out = self.run_cli("--all-systems", "--summary")
+        result = json.loads(out[out.index("{"):], parse_constant=self.fail)
+        self.assertEqual(result["systems"]["x"]["micro"]["e_r"], 0.5)
+        self.assertEqual(sorted(result["summary"]), ["x", "y"])
+
+        out = self.run_cli("--systems", "generated-text-y")
+        self.assertIn("e_f", out)
+        written = pd.read_csv(os.path.join(self.base, "eval__test.csv"))
+        self.assertIn("e_f__y", written.columns)
+        self.assertNotIn("e_f__x", written.columns)
+
+if __name__ == "__main__":
+    unittest.main()
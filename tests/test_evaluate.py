@@ -2,12 +2,42 @@
 
 import unittest
 import os
+import random
 import tempfile
+from pathlib import Path
+import numpy as np
 import pandas as pd
 
-from zscore.utils_evaluate import align, e_prf, z_eip
+from zscore.utils_evaluate import (COUNT_COLUMNS, PAD, SPAN_METRIC_COLUMNS, AlignmentResult, CorpusAggregator,
+                                   TreebankTokenizer, align, alignment_counts, e_prf, get_tokenizer, metrics_from_counts,
+                                   span_eip, z_eip)
 from zscore import tb
-from zscore.utils_process_trees import extract_tokens
+from zscore.utils_dirs import TREEBANK_MRG_DIR
+from zscore.utils_process_trees import extract_tokens, get_text_dual_from_file, get_text_dual_from_string
+from zscore.utils_references import ReferenceCache, ReferenceStore, build_reference_store
+from zscore.zscore import evaluate_dataframe, evaluate_file, evaluate_records, systems_summary
+
+TREE_TEXT = """((S
+  (PRN
+    (S (NP-SBJ (PRP I))
+       (VP (VBP mean)))
+    (, ,))
+  (CC but)
+  (EDITED
+    (RM (-DFL- \\[))
+    (S
+      (NP-SBJ (PRP she))
+      (VP-UNF (VBD was)
+              (ADVP (RB truly))))
+    (, ,)
+    (IP (-DFL- \\+)))
+  (NP-SBJ (PRP she))
+  (VP (VBD was)
+      (ADJP-PRD (RB truly)
+                (RS (-DFL- -\\]))
+                (JJ aware)))
+  (. .)
+  (-DFL- E_S)))"""
 
 class TestEvaluateVariantClasses(unittest.TestCase):
     def setUp(self):
@@ -56,8 +86,8 @@ class TestEvaluateVariantClasses(unittest.TestCase):
                 ],
                 "skip_alignment_check": False,
                 "expected_alignment": {
-                    "gt_mask": [1,1,0,1,1,1,0,'*',0,0,0],
-                    "pred_mask": [0,0,0,1,1,1,1,'*',0,0,0]
+                    "gt_mask": [1,1,0,1,1,1,0,PAD,0,0,0],
+                    "pred_mask": [0,0,0,1,1,1,1,PAD,0,0,0]
                 }
             },
             "class_exact_same": {
@@ -131,13 +161,13 @@ class TestEvaluateVariantClasses(unittest.TestCase):
 
                 if not first_alignment_printed:
                     print(f"\nAlignment from first sample in {class_name}: {generated}")
-                    print(alignment.to_string(index=False))
+                    print(alignment.to_dataframe().to_string(index=False))
                     first_alignment_printed = True
 
                 e_p, e_r, e_f = e_prf(alignment)
                 z_e, z_i, z_p = z_eip(alignment)
 
-                alignments.append(alignment.reset_index(drop=True))
+                alignments.append(alignment.to_dataframe().reset_index(drop=True))
                 metric_series = pd.Series({
                     "e_p": e_p, "e_r": e_r, "e_f": e_f,
                     "z_e": z_e, "z_i": z_i, "z_p": z_p
@@ -178,6 +208,312 @@ class TestEvaluateVariantClasses(unittest.TestCase):
                                 actual = list(alignment[col])
                                 self.assert_mask_equal(expected, actual, col, class_name)
 
+class TestTreebankTokenizer(unittest.TestCase):
+    PIECES = ["can't", "won't", "gonna", "Gonna", "wanna", "wanna-be", "x-gonna", "cannot", "'tis", "'Twas",
+              "d'ye", "more'n", "it's", "it's'", "dogs'", "'", "''", "they'll's", "CAN'T", "Can'T", "we'LL",
+              "I'm", "rock'n'roll", "-", "--", "a--b", "Hello", "42", "3,000", ",", ".", "!", "?", '"', "(",
+              ")", "$", "naïve", "gimme", "x'", ":", ";", "uh", " ", "  ", "\t", "\n"]
+
+    def assert_same_as_nltk(self, texts):
+        nltk_tokenizer = get_tokenizer()
+        tokenizer = TreebankTokenizer()
+        lowered = TreebankTokenizer(lowercase=True, strip=",.!?", memo_size=64)
+        strip = str.maketrans("", "", ",.!?")
+        for text in texts:
+            self.assertEqual(tokenizer.tokenize(text), nltk_tokenizer.tokenize(text), repr(text))
+            expected = [w.lower() for w in nltk_tokenizer.tokenize(text.translate(strip))]
+            self.assertEqual(lowered.tokenize(text), expected, repr(text))
+
+    def test_matches_nltk_on_tricky_text(self):
+        rng = random.Random(0)
+        texts = []
+        for _ in range(5000):
+            words = [rng.choice(self.PIECES) for _ in range(rng.randint(0, 6))]
+            texts.append("".join(w + rng.choice(["", " ", " ", "  "]) for w in words))
+        self.assert_same_as_nltk(texts + [t.rstrip(" ") for t in texts])
+
+    def test_matches_nltk_on_treebank_text(self):
+        self.assert_same_as_nltk(get_text_dual_from_string(TREE_TEXT))
+
+    @unittest.skipUnless(TREEBANK_MRG_DIR.is_dir(), "Switchboard treebank not available")
+    def test_matches_nltk_on_switchboard(self):
+        for path in sorted(Path(TREEBANK_MRG_DIR).rglob("sw*.mrg")):
+            self.assert_same_as_nltk(get_text_dual_from_file(str(path)))
+
+    def test_memo_returns_fresh_lists(self):
+        tokenizer = TreebankTokenizer(memo_size=2)
+        first = tokenizer.tokenize("I can't go")
+        first.append("x")
+        self.assertEqual(tokenizer.tokenize("I can't go"), ["I", "ca", "n't", "go"])
+
+class TestCorpusAggregation(unittest.TestCase):
+    def setUp(self):
+        self.tokens = ["i", "mean", "but", "she", "was", "truly", "she", "was", "truly", "aware"]
+        self.tags = ["PRN", "PRN", "NONE", "EDITED", "EDITED", "EDITED", "NONE", "NONE", "NONE", "NONE"]
+
+    def test_counts_reproduce_row_metrics(self):
+        for generated in ["but she was truly aware", "I mean but she was truly she was truly aware", "cats", ""]:
+            alignment = align(self.tokens, self.tags, generated)
+            expected = list(e_prf(alignment) + z_eip(alignment))
+            actual = metrics_from_counts(alignment_counts(alignment)).tolist()
+            self.assertEqual(pd.Series(actual).fillna(-1).tolist(), pd.Series(expected).fillna(-1).tolist())
+
+    def test_micro_and_macro(self):
+        aggregator = CorpusAggregator()
+        aggregator.add(alignment_counts(align(self.tokens, self.tags, "but she was truly aware")))  # tp=5
+        aggregator.add(alignment_counts(align(self.tokens, self.tags, "mean but she was truly aware")))  # tp=4, fn=1
+        aggregator.add([float("nan")] * len(COUNT_COLUMNS))
+        result = aggregator.result()
+
+        self.assertEqual((result["rows"], result["failed"]), (2, 1))
+        self.assertEqual(result["counts"]["tp"], 9)
+        self.assertEqual(result["counts"]["prn_total"], 4)
+        self.assertEqual(result["micro"]["e_r"], 9 / 10)
+        self.assertEqual(result["macro"]["e_r"], (1.0 + 4 / 5) / 2)
+        self.assertEqual(result["micro"]["z_p"], 3 / 4)
+        self.assertTrue(pd.isna(result["micro"]["z_i"]))  # no INTJ tokens
+        self.assertTrue(pd.isna(result["macro"]["z_i"]))
+
+class TestSpanMetrics(unittest.TestCase):
+    def setUp(self):
+        # two adjacent EDITED spans, as in a repeated restart: [ I, ] [ I, ] I do
+        tree = tb.string_trees("( (S (EDITED (NP (PRP I)) (, ,)) (EDITED (NP (PRP I)) (, ,)) (NP (PRP I)) "
+                               "(VP (VBP do)) (INTJ (UH uh) (UH um)) ))")[0]
+        _, _, pairs, self.spans = extract_tokens(tree, return_spans=True)
+        self.tokens, self.tags = [list(col) for col in zip(*pairs)]
+
+    def test_extract_tokens_numbers_top_most_spans(self):
+        self.assertEqual(self.tags, ["EDITED", "EDITED", "NONE", "NONE", "INTJ", "INTJ"])
+        self.assertEqual(self.spans, [0, 1, -1, -1, 2, 2])
+        nested = tb.string_trees("( (S (EDITED (EDITED (PRP I)) (PRP I)) (PRP I) ))")[0]
+        self.assertEqual(extract_tokens(nested, return_spans=True)[3], [0, 0, -1])
+
+    def test_full_partial_and_untouched_spans(self):
+        alignment = align(self.tokens, self.tags, "I I do um", disfluent_spans=self.spans)
+        counts = dict(zip(COUNT_COLUMNS, alignment_counts(alignment)))
+        self.assertEqual((counts["edited_spans"], counts["edited_spans_full"], counts["edited_spans_partial"]),
+                         (2, 1, 0))
+        self.assertEqual((counts["intj_spans"], counts["intj_spans_full"], counts["intj_spans_partial"]), (1, 0, 1))
+        metrics = dict(zip(SPAN_METRIC_COLUMNS, span_eip(alignment)))
+        self.assertEqual((metrics["s_e_full"], metrics["s_e_partial"], metrics["s_e_none"]), (0.5, 0.0, 0.5))
+        self.assertEqual(metrics["s_i_partial"], 1.0)
+        self.assertTrue(np.isnan(metrics["s_p_full"]))
+
+        # without span ids, the adjacent EDITED spans read as one partially removed run
+        runs = dict(zip(COUNT_COLUMNS, alignment_counts(align(self.tokens, self.tags, "I I do um"))))
+        self.assertEqual((runs["edited_spans"], runs["edited_spans_partial"]), (1, 1))
+
+    def test_segment_reduction_matches_per_span_loop(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            n = rng.randint(0, 30)
+            tag_codes = np.array([rng.choice([PAD, 0, 1, 1, 2, 3]) for _ in range(n)], dtype=np.int8)
+            pred_mask = np.where(tag_codes == PAD, PAD, [rng.randint(0, 1) for _ in range(n)]).astype(np.int8)
+            span_ids, span, previous = np.full(n, -1, dtype=np.int32), -1, None
+            for k, code in enumerate(tag_codes.tolist()):
+                if code > 0:
+                    if code != previous or rng.random() < 0.3:
+                        span += 1
+                    span_ids[k] = span
+                if code != PAD:
+                    previous = code
+            alignment = AlignmentResult([""] * n, [""] * n, [""] * n, tag_codes, np.minimum(tag_codes, 1), pred_mask,
+                                        span_ids)
+
+            expected = np.zeros((3, 3), dtype=int)  # class x (spans, full, partial)
+            for span in set(span_ids[span_ids >= 0].tolist()):
+                rows = span_ids == span
+                removed, total = int((pred_mask[rows] == 1).sum()), int(rows.sum())
+                expected[tag_codes[rows][0] - 1] += [1, removed == total, 0 < removed < total]
+            self.assertEqual(np.stack(alignment.span_counts(), axis=1).tolist(), expected.tolist())
+
+    def test_corpus_spans_and_output_columns(self):
+        with tempfile.TemporaryDirectory() as base:
+            write_trees(base, ["sw9999.mrg"])
+            aggregator = CorpusAggregator()
+            records = [("sw9999.mrg", "but she was truly aware"),
+                       ("sw9999.mrg", "i but she was truly she was truly aware")]
+            results = evaluate_records(records, cache=ReferenceCache(base_dir=base), aggregator=aggregator,
+                                       span_metrics=True)
+        self.assertEqual(results["s_e_full"].tolist(), [1.0, 0.0])
+        self.assertEqual(results["s_p_partial"].tolist(), [0.0, 1.0])
+        spans = aggregator.result()["spans"]
+        self.assertEqual(list(spans), list(SPAN_METRIC_COLUMNS))
+        self.assertEqual((spans["s_e_full"], spans["s_e_none"], spans["s_p_partial"]), (0.5, 0.5, 0.5))
+
+def write_trees(base, file_ids, tree_text=TREE_TEXT):
+    for file_id in file_ids:
+        os.makedirs(os.path.join(base, file_id[2]), exist_ok=True)
+        with open(os.path.join(base, file_id[2], file_id), "w") as f:
+            f.write(tree_text)
+
+class TestReferenceCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.base = self.tmpdir.name
+        write_trees(self.base, ["sw9998.mrg", "sw9999.mrg"])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_tokens_are_lowercased_and_tagged(self):
+        cache = ReferenceCache(base_dir=self.base)
+        tokens, tags = cache.get("sw9999.mrg")
+        self.assertEqual(tokens, ("i", "mean", "but", "she", "was", "truly", "she", "was", "truly", "aware"))
+        self.assertEqual(tags, ("PRN", "PRN", "NONE", "EDITED", "EDITED", "EDITED", "NONE", "NONE", "NONE", "NONE"))
+
+    def test_hits_and_lru_eviction(self):
+        cache = ReferenceCache(max_tokens=15, base_dir=self.base)
+        cache.get("sw9999.mrg")
+        cache.get("sw9999.mrg")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        cache.get("sw9998.mrg")  # 20 tokens > 15, so sw9999 is evicted
+        self.assertNotIn("sw9999.mrg", cache)
+        self.assertIn("sw9998.mrg", cache)
+        self.assertEqual(cache.n_tokens, 10)
+
+    def test_reference_store_matches_cache(self):
+        store_path = os.path.join(self.base, "refs.zsr")
+        self.assertEqual(build_reference_store(self.base, store_path), 2)
+        store = ReferenceStore(store_path)
+        cache = ReferenceCache(base_dir=self.base)
+
+        self.assertEqual(store.get("sw9999.mrg"), cache.get("sw9999.mrg"))
+        self.assertEqual(store.get("sw9998.txt"), cache.get("sw9998.mrg"))
+        np.testing.assert_array_equal(store.get("sw9999.mrg", with_spans=True)[2],
+                                      cache.get("sw9999.mrg", with_spans=True)[2])
+        self.assertEqual(store.tree_token_ranges("sw9999.mrg"), [(0, 10)])
+        self.assertNotIn("sw0000.mrg", store)
+        with self.assertRaises(KeyError):
+            store.get("sw0000.mrg")
+
+    def test_reference_store_of_an_older_layout_is_rejected(self):
+        store_path = os.path.join(self.base, "refs.zsr")
+        build_reference_store(self.base, store_path)
+        with open(store_path, "r+b") as f:
+            f.write(b"ZSREF\x00\x01\x00")  # before span ids were stored
+        with self.assertRaisesRegex(ValueError, "rebuild"):
+            ReferenceStore(store_path)
+
+    def test_grouped_evaluation_keeps_row_order(self):
+        csv_path = os.path.join(self.base, "test.csv")
+        pd.DataFrame({
+            "filename": ["sw9999.mrg", "sw9998.mrg", "sw9999.mrg", "sw0000.mrg"],
+            "generated-text": ["but she was truly aware", "I mean but she was truly she was truly aware",
+                               "she was truly aware", "anything"],
+        }).to_csv(csv_path, index=False)
+
+        cache = ReferenceCache(max_tokens=10, base_dir=self.base)
+        evaluate_file(csv_path, cache=cache, group_by_file=True)
+        grouped = pd.read_csv(os.path.join(self.base, "eval__test.csv"))
+        self.assertEqual(cache.misses, 3)  # two references + the missing file
+
+        evaluate_file(csv_path, cache=ReferenceCache(base_dir=self.base))
+        ungrouped = pd.read_csv(os.path.join(self.base, "eval__test.csv"))
+
+        pd.testing.assert_frame_equal(grouped, ungrouped)
+        self.assertEqual(list(grouped["filename"]), ["sw9999.mrg", "sw9998.mrg", "sw9999.mrg", "sw0000.mrg"])
+        self.assertEqual(grouped["e_r"].tolist()[:2], [1.0, 0.0])
+        self.assertTrue(grouped.iloc[3][["e_p", "z_e"]].isna().all())
+
+class TestParallelEvaluation(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.base = self.tmpdir.name
+        write_trees(self.base, ["sw9999.mrg"])
+        write_trees(self.base, ["sw8888.mrg"], tree_text=TREE_TEXT + "\n" + TREE_TEXT)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_parallel_matches_serial(self):
+        csv_path = os.path.join(self.base, "test.csv")
+        texts = ["but she was truly aware", "I mean but she was truly she was truly aware", "uh", "she was truly aware"]
+        pd.DataFrame({
+            "filename": ["sw9999.mrg", "sw8888.mrg", "sw0000.mrg", "sw9999.mrg"] * 5,
+            "generated-text": texts * 5,
+        }).to_csv(csv_path, index=False)
+        eval_path = os.path.join(self.base, "eval__test.csv")
+
+        evaluate_file(csv_path, cache=ReferenceCache(base_dir=self.base))
+        serial = pd.read_csv(eval_path)
+        evaluate_file(csv_path, cache=ReferenceCache(base_dir=self.base), workers=2, chunk_size=3)
+        parallel = pd.read_csv(eval_path)
+
+        pd.testing.assert_frame_equal(parallel, serial)
+        self.assertTrue(parallel[parallel["filename"] == "sw0000.mrg"]["e_f"].isna().all())
+
+        store_path = os.path.join(self.base, "refs.zsr")
+        build_reference_store(self.base, store_path)
+        evaluate_file(csv_path, cache=ReferenceStore(store_path), workers=2, chunk_size=3)
+        pd.testing.assert_frame_equal(pd.read_csv(eval_path), serial)
+
+    def test_in_memory_apis_match_evaluate_file(self):
+        df = pd.DataFrame({
+            "filename": ["sw9999.mrg", "sw8888.mrg", "sw0000.mrg", "sw9999.mrg"],
+            "generated-text": ["but she was truly aware", "she was truly aware", "uh", "I mean"],
+        })
+        csv_path = os.path.join(self.base, "test.csv")
+        df.to_csv(csv_path, index=False)
+        evaluate_file(csv_path, cache=ReferenceCache(base_dir=self.base))
+        expected = pd.read_csv(os.path.join(self.base, "eval__test.csv"))
+
+        cache = ReferenceCache(base_dir=self.base)
+        records = evaluate_records(zip(df["filename"], df["generated-text"]), cache=cache, with_counts=True)
+        for column in ("e_p", "e_r", "e_f", "z_e", "z_i", "z_p"):
+            np.testing.assert_allclose(records[column], expected[column])
+        self.assertEqual(records["tp"][0], 5)
+
+        evaluated = evaluate_dataframe(df, cache=cache, inplace=False)
+        self.assertNotIn("e_f", df.columns)
+        pd.testing.assert_frame_equal(evaluated, expected)
+
+    def test_multiple_systems_match_single_system_runs(self):
+        texts = {
+            "generated-text-a": ["but she was truly aware", "she was truly aware", "uh", None],
+            "generated-text-b": ["I mean but she was truly", "", "uh", "she was truly aware"],
+        }
+        df = pd.DataFrame({"filename": ["sw9999.mrg", "sw8888.mrg", "sw0000.mrg", "sw9999.mrg"], **texts})
+        csv_path = os.path.join(self.base, "test.csv")
+        df.to_csv(csv_path, index=False)
+
+        aggregators = {"a": CorpusAggregator(), "b": CorpusAggregator()}
+        evaluate_file(csv_path, cache=ReferenceCache(base_dir=self.base), workers=2, chunk_size=1,
+                      stream_rows=3, with_counts=True, aggregator=aggregators, text_columns=list(texts))
+        combined = pd.read_csv(os.path.join(self.base, "eval__test.csv"))
+
+        for column, system in zip(texts, ("a", "b")):
+            single = evaluate_dataframe(df[["filename"]].assign(**{"generated-text": df[column]}),
+                                        cache=ReferenceCache(base_dir=self.base), with_counts=True)
+            for k in ("e_p", "e_r", "e_f", "z_e", "z_i", "z_p", "tp", "fn"):
+                np.testing.assert_allclose(combined[f"{k}__{system}"], single[k])
+            expected = CorpusAggregator()
+            expected.add_many(single[list(COUNT_COLUMNS)].to_numpy())
+            actual, expected = aggregators[system].result(), expected.result()
+            self.assertEqual((actual["rows"], actual["failed"], actual["counts"]),
+                             (expected["rows"], expected["failed"], expected["counts"]))
+            np.testing.assert_allclose(list(actual["macro"].values()), list(expected["macro"].values()))
+
+        summary = systems_summary(aggregators)
+        self.assertEqual(summary.index.tolist(), ["a", "b"])
+        self.assertEqual(summary["failed"].tolist(), [1, 1])
+        self.assertEqual(summary.loc["a", "e_f"], aggregators["a"].result()["micro"]["e_f"])
+
+    def test_streaming_matches_in_memory(self):
+        csv_path = os.path.join(self.base, "test.csv")
+        pd.DataFrame({
+            "filename": ["sw9999.mrg", "sw8888.mrg", "sw0000.mrg", "sw9999.mrg"] * 3,
+            "generated-text": ["but she was truly aware", "she was truly aware", "uh", None] * 3,
+        }).to_csv(csv_path, index=False)
+        eval_path = os.path.join(self.base, "eval__test.csv")
+
+        evaluate_file(csv_path, cache=ReferenceCache(base_dir=self.base))
+        expected = pd.read_csv(eval_path)
+        for use_arrow in (False, None):
+            evaluate_file(csv_path, cache=ReferenceCache(base_dir=self.base), stream_rows=5, use_arrow=use_arrow)
+            pd.testing.assert_frame_equal(pd.read_csv(eval_path), expected)
+
 if __name__ == "__main__":
     unittest.main()
 
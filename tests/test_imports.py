@@ -0,0 +1,35 @@
+# python -m unittest tests.test_imports
+
+import os
+import subprocess
+import sys
+import unittest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def modules_loaded_by(statement, names):
+    """Names among names that are in sys.modules after running statement in a fresh interpreter."""
+    code = f"import sys; {statement}; print(' '.join(m for m in {tuple(names)!r} if m in sys.modules))"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [SRC_DIR, os.environ.get("PYTHONPATH")])))
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout
+    return out.split()
+
+
+class TestLazyImports(unittest.TestCase):
+    """Heavy dependencies must stay off the import path (see benchmarks/bench_import.py)."""
+
+    def test_entry_points_do_not_import_heavy_dependencies(self):
+        for module in ("zscore.cli", "zscore.zscore", "zscore.utils_evaluate", "zscore.utils_references"):
+            with self.subTest(module=module):
+                self.assertEqual(modules_loaded_by(f"import {module}", ("pandas", "nltk", "icecream")), [])
+
+    def test_tokenizer_is_built_on_first_use(self):
+        statement = "from zscore.utils_evaluate import align; align(['uh', 'hi'], ['INTJ', 'NONE'], 'hi')"
+        self.assertEqual(modules_loaded_by(statement, ("nltk", "pandas")), [])  # plain words never need nltk
+        statement = "from zscore.utils_evaluate import align; align(['i', 'ca', \"n't\"], ['NONE'] * 3, \"I can't\")"
+        self.assertEqual(modules_loaded_by(statement, ("nltk", "pandas")), ["nltk"])
+
+
+if __name__ == "__main__":
+    unittest.main()
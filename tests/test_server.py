@@ -0,0 +1,90 @@
+# python -m unittest tests.test_server
+
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from tests.test_evaluate import write_trees
+from zscore.server import Client, EvaluationServer, main, preload
+from zscore.utils_references import ReferenceCache
+from zscore.zscore import evaluate_records
+
+ROWS = [
+    ("sw9999.mrg", "but she was truly aware"),
+    ("sw9999.mrg", "I mean but she was truly she was truly aware"),
+    ("sw0000.mrg", "uh"),
+    ("sw9999.mrg", "she was truly aware"),
+]
+
+
+class TestEvaluationServer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.base = self.tmpdir.name
+        write_trees(self.base, ["sw9999.mrg"])
+        self.expected = evaluate_records(ROWS, cache=ReferenceCache(base_dir=self.base))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def assert_metrics(self, metrics, k):
+        for column, value in metrics.items():
+            expected = self.expected[column][k]
+            if np.isnan(expected):
+                self.assertIsNone(value)
+            else:
+                self.assertAlmostEqual(value, expected)
+
+    def test_unix_socket(self):
+        address = os.path.join(self.base, "zscore.sock")
+        with EvaluationServer(ReferenceCache(base_dir=self.base), address).start() as server, Client(address) as client:
+            response = client.score(*ROWS[0], counts=True)
+            self.assert_metrics(response["metrics"], 0)
+            self.assertEqual(response["counts"]["tp"], 5)
+            self.assertGreater(response["latency_ms"], 0)
+
+            response = client.score_many(ROWS)
+            for k, metrics in enumerate(response["metrics"]):
+                self.assert_metrics(metrics, k)
+
+            with self.assertRaises(RuntimeError):
+                client.request({"op": "reload"})
+            self.assertEqual(client.request({"op": "ping"})["ok"], True)
+            self.assertIn("error", server.handle_line("[1, 2]"))
+
+            stats = client.stats()
+            self.assertEqual((stats["requests"], stats["rows"]), (4, 5))
+            self.assertEqual(stats["errors"], 3)  # the missing sw0000.mrg, the unknown op and the non-object request
+            self.assertIn("p95", stats["latency_ms"])
+        self.assertFalse(os.path.exists(address))
+
+    def test_concurrent_clients_are_batched_on_workers(self):
+        server = EvaluationServer(ReferenceCache(base_dir=self.base), ("127.0.0.1", 0), workers=2,
+                                  batch_wait=0.05).start()
+
+        def run_client(k):
+            with Client(server.address) as client:
+                return k % len(ROWS), client.score(*ROWS[k % len(ROWS)])["metrics"]
+
+        with server, ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(run_client, range(16)))
+            with Client(server.address) as client:
+                stats = client.stats()
+        for k, metrics in results:
+            self.assert_metrics(metrics, k)
+        self.assertEqual(stats["rows"], 16)
+        self.assertLess(stats["batches"], 16)
+
+    def test_preload_reads_from_the_treebank_dir(self):
+        cache = ReferenceCache(base_dir=self.base)
+        self.assertEqual(preload(cache, self.base), 1)
+        self.assertGreater(cache.n_tokens, 0)
+        with self.assertRaises(SystemExit):
+            main(["--port", "0", "--preload", "--jobs", "2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,340 @@
+import unittest
+import os
+import re
+import tempfile
+
+from zscore import tb
+
+# The original recursive reader, which tb.string_trees reproduces exactly;
+# also used by benchmarks/bench_tb.py.
+
+_openpar_re = re.compile(r"\s*\(\s*([^ \t\n\r\f\v()]*)\s*")
+_closepar_re = re.compile(r"\s*\)\s*")
+_terminal_re = re.compile(r"\s*([^ \t\n\r\f\v()]*)\s*")
+
+def _recursive_read(trees, s, pos=0):
+    
+    """Reads a sequence of trees in string s[pos:].
+    Appends the trees to the argument trees.
+    Returns the ending position of those trees in s."""
+    
+    while pos < len(s):
+        closepar_mo = _closepar_re.match(s, pos)
+        if closepar_mo:
+            return closepar_mo.end()
+        openpar_mo = _openpar_re.match(s, pos)
+        if openpar_mo:
+            tree = [openpar_mo.group(1)]
+            trees.append(tree)
+            pos = _recursive_read(tree, s, openpar_mo.end())
+        else:
+            terminal_mo = _terminal_re.match(s, pos)
+            trees.append(terminal_mo.group(1))
+            pos = terminal_mo.end()
+    return pos
+
+def recursive_string_trees(s, pos=0):
+    trees = []
+    _recursive_read(trees, s, pos)
+    return trees
+
+# Recursive versions of the tb traversals and transforms, which those
+# reproduce exactly; also used by benchmarks/bench_tb_transforms.py.
+
+def recursive_map_labels(tree, fn):
+    
+    """Returns a tree in which every node's label is mapped by fn"""
+
+    if isinstance(tree, list):
+        return [fn(tree[0])]+[recursive_map_labels(child,fn) for child in tree[1:]]
+    else:
+        return tree
+
+
+def recursive_map_subtrees(tree, fn):
+
+    """Returns a tree in which every subtree is mapped by fn.
+
+    fn() is called on each subtree of tree after all of its children
+    have been mapped.
+    """
+
+    if isinstance(tree, list):
+        return fn([recursive_map_subtrees(child, fn) if i > 0 else child 
+                   for i, child in enumerate(tree)])
+    else:
+        return fn(tree)
+
+
+def recursive_tree_copy(tree):
+
+    """Returns a deep copy of tree"""
+
+    if isinstance(tree, list):
+        return [recursive_tree_copy(child) for child in tree]
+    else:
+        return tree
+
+
+def recursive_prune(tree, remove_empty=False, 
+          remove_partial=False, 
+          remove_punctuation=False, 
+          collapse_unary=False, 
+          binarise=False, 
+          relabel=lambda x: x):
+
+    """Returns a copy of tree without empty nodes, unary nodes or node indices.
+
+    If binarise=='right' then right-binarise nodes, otherwise 
+    if binarise is not False then left-binarise nodes.
+    """
+
+    def left_binarise(cs, rightpos):
+        label = '.'.join(tb.tree_label(cs[i]) for i in range(rightpos))
+        if rightpos <= 2:
+            return tb.make_nonterminal(label, cs[:rightpos])
+        else:
+            return tb.make_nonterminal(label, [left_binarise(cs, rightpos-1),cs[rightpos-1]])
+
+    def right_binarise(cs, leftpos, len_cs):
+        label = '.'.join(tb.tree_label(c) for c in cs[leftpos:])
+        if leftpos + 2 >= len_cs:
+            return tb.make_nonterminal(label, cs[leftpos:])
+        else:
+            return tb.make_nonterminal(label, [cs[leftpos], right_binarise(cs, leftpos+1, len_cs)])
+
+    label = tb.tree_label(tree)
+    if tb.is_phrasal(tree):
+        cs = (recursive_prune(c, remove_empty, remove_partial, remove_punctuation, collapse_unary, binarise, relabel) 
+              for c in tb.tree_children(tree))
+        cs = [c for c in cs if c]
+        if cs or not remove_empty:
+            len_cs = len(cs)
+            if collapse_unary and len_cs == 1:
+                return tb.make_nonterminal(relabel(label), 
+                                        tb.tree_children(cs[0]))
+            elif binarise and len_cs > 2:
+                if binarise=='right':
+                    return tb.make_nonterminal(relabel(label),
+                                            [cs[0], right_binarise(cs, 1, len_cs)])
+                else:
+                    return tb.make_nonterminal(relabel(label),
+                                            [left_binarise(cs, len_cs-1), cs[-1]])
+            else:
+                return tb.make_nonterminal(relabel(label), 
+                                        cs)
+        else:
+            return None
+    elif tb.is_preterminal(tree):
+        if remove_empty and label in tb._empty_cats:
+            return None
+        if remove_partial and tb.is_partial_word(tree):
+            return None
+        if remove_punctuation and tb.is_punctuation(tree):
+            return None
+        return tb.make_nonterminal(relabel(label), tb.tree_children(tree))
+    else:
+        return tree
+
+
+def recursive_tree_nodes(tree):
+    
+    """Yields all the nodes in tree."""
+
+    def visit(node):
+        yield node
+        if isinstance(node, list):
+            for child in node[1:]:
+                yield from visit(child)
+
+    yield from visit(tree)
+
+
+def recursive_tree_terminals(tree):
+    
+    """Yields the terminal or leaf nodes of tree."""
+
+    def visit(node):
+        if isinstance(node, list):
+            for child in node[1:]:
+                yield from visit(child)
+        else:
+            yield node
+
+    yield from visit(tree)
+
+
+def recursive_tree_preterminalnodes(tree):
+
+    """Yields the preterminal nodes of tree."""
+
+    def visit(node):
+        if tb.is_preterminal(node):
+            yield node
+        else:
+            for child in node[1:]:
+                yield from visit(child)
+
+    yield from visit(tree)
+
+
+def recursive_tree_preterminallabels(tree):
+
+    """Yields the labels of the preterminal nodes in tree."""
+
+    def visit(node):
+        if tb.is_preterminal(node):
+            yield node[0]
+        else:
+            for child in node[1:]:
+                yield from visit(child)
+
+    yield from visit(tree)
+
+
+def recursive_tree_phrasalnodes(tree):
+
+    """Yields the phrasal (i.e., nonterminal and non-preterminal) nodes of tree"""
+
+    def visit(node):
+        if tb.is_phrasal(node):
+            yield node
+            for child in node[1:]:
+                yield from visit(child)
+
+    yield from visit(tree)
+
+
+def recursive_tree_constituents(tree, 
+                      include_root=False, 
+                      include_terminals=False, 
+                      include_preterminals=False, 
+                      ignore_punctuation=True,
+                      labelfn=tb.tree_label):
+
+    """Returns a list of Constituent tuples (label,left,right) for each
+    constituent in the tree, where left and right are integer string
+    positions, and label is obtained by applying labelfn to the tree
+    node.
+
+    If include_root==True, then the list of tuples includes a tuple
+    for the root node of the tree.
+
+    If include_terminals==True, then the list of tuples includes tuples
+    for the terminal nodes of the tree.
+
+    If include_preterminals==True, then the list of tuples includes tuples
+    for the preterminal nodes of the tree.
+
+    If ignore_punctuation==True, then the left and right positions ignore
+    punctuation.
+
+    """
+
+    def visitor(node, left, constituents):
+        if ignore_punctuation and tb.is_punctuation(node):
+            return left
+        if tb.is_terminal(node):
+            if include_terminals:
+                constituents.append(tb.Constituent(labelfn(node),left,left+1))
+            return left+1
+        else:
+            right = left
+            for child in tb.tree_children(node):
+                right = visitor(child, right, constituents)
+            if include_preterminals or tb.is_phrasal(node):
+                constituents.append(tb.Constituent(labelfn(node),left,right))
+            return right
+
+    constituents = []
+    if include_root:
+        visitor(tree, 0, constituents)
+    else:
+        right = 0
+        for child in tb.tree_children(tree):
+            right = visitor(child, right, constituents)
+    return constituents
+
+class TestStackParser(unittest.TestCase):
+    def test_matches_recursive_parser(self):
+        samples = [
+            "",
+            "   ",
+            "( (CODE (SYM SpeakerA1) (. .) ))\n( (S (NP-SBJ (PRP I)) (VP (VBP go)) (-DFL- E_S)))",
+            "(S (NP (NN Hello))) (S (NP (NN world)))",
+            "((S (EDITED (RM (-DFL- \\[)) (NP (PRP she)) (IP (-DFL- \\+))) (. .)))",
+            "(S (X a b) ) ) (S (Y c))",   # stray close paren ends the input
+            "(S (NP (NN unclosed)",
+            "( () (NP) x y)",
+        ]
+        for s in samples:
+            self.assertEqual(tb.string_trees(s), recursive_string_trees(s), repr(s))
+
+    def test_read_file_skips_header(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "sw9999.mrg")
+            with open(path, "w") as f:
+                f.write("*x*  header  *x*\n*x* more *x*\n\n( (S (NP (PRP I)) (VP (VBP go))))\n")
+            self.assertEqual(tb.read_file(path), [["", ["S", ["NP", ["PRP", "I"]], ["VP", ["VBP", "go"]]]]])
+
+    def test_read_string_skips_header(self):
+        s = "*x*  header  *x*\n\n( (S (NP (PRP I)) (. .)))\n"
+        self.assertEqual(tb.read_string(s), tb.string_trees(s[tb.header_end(s):]))
+        self.assertEqual(tb.string_tokens(s, tb.header_end(s))[:3],
+                         [("", "(", "", ""), ("", "(", "S", ""), ("", "(", "NP", "")])
+        self.assertTrue(tb.is_punctuation_label(".") and not tb.is_punctuation_label("NP-SBJ"))
+
+    def test_deep_tree_does_not_recurse(self):
+        depth = 5000
+        s = "(A " * depth + "x" + ")" * depth
+        tree = tb.string_trees(s)[0]
+        for _ in range(depth - 1):
+            tree = tree[1]
+        self.assertEqual(tree, ["A", "x"])
+
+SAMPLE_TREES = tb.string_trees("""
+( (CODE (SYM SpeakerA1) (. .) ))
+( (S (EDITED (RM (-DFL- \\[)) (NP-SBJ (PRP she)) (IP (-DFL- \\+))) (NP-SBJ-1 (PRP she))
+     (VP (VBD was) (ADVP (RB truly)) (NP (-NONE- *T*-1)) (ADJP (JJ aw-) (JJ aware))) (, ,) (. .) (-DFL- E_S) ))
+( (S (X a b) (NP) (INTJ (UH uh)) (PRN (-LRB- -LRB-) (NP (NN aside) (NN here) (NN now)) (-RRB- -RRB-)) (. .)))
+""")
+
+class TestIterativeTraversals(unittest.TestCase):
+    def test_matches_recursive_versions(self):
+        walkers = ("tree_nodes", "tree_terminals", "tree_preterminalnodes", "tree_preterminallabels",
+                   "tree_phrasalnodes")
+        for tree in SAMPLE_TREES:
+            for name in walkers:
+                self.assertEqual(list(getattr(tb, name)(tree)), list(globals()[f"recursive_{name}"](tree)), name)
+            self.assertEqual(tb.tree_copy(tree), recursive_tree_copy(tree))
+            self.assertEqual(tb.map_labels(tree, str.lower), recursive_map_labels(tree, str.lower))
+            self.assertEqual(tb.map_subtrees(tree, lambda x: x[::-1]), recursive_map_subtrees(tree, lambda x: x[::-1]))
+            for include_root, include_terminals in ((False, False), (True, True)):
+                self.assertEqual(tb.tree_constituents(tree, include_root, include_terminals),
+                                 recursive_tree_constituents(tree, include_root, include_terminals))
+
+    def test_prune_matches_recursive_version(self):
+        for binarise in (False, True, "right"):
+            options = dict(remove_empty=True, remove_partial=True, remove_punctuation=True, collapse_unary=True,
+                           binarise=binarise, relabel=tb.label_category)
+            expected = [recursive_prune(tree, **options) for tree in SAMPLE_TREES]
+            self.assertEqual([tb.prune(tree, **options) for tree in SAMPLE_TREES], expected)
+            self.assertEqual(tb.prune_trees(SAMPLE_TREES, **options), expected)
+        self.assertEqual([tb.prune(tree) for tree in SAMPLE_TREES], [recursive_prune(tree) for tree in SAMPLE_TREES])
+
+    def test_deep_tree_does_not_recurse(self):
+        depth = 5000
+        tree = ["NN", "x"]
+        for _ in range(depth):
+            tree = ["NP", tree, ["CC", "and"]]
+        self.assertEqual(len(list(tb.tree_nodes(tree))), 3 * depth + 2)
+        self.assertEqual(list(tb.tree_terminals(tree))[:2], ["x", "and"])
+        self.assertEqual(len(list(tb.tree_preterminalnodes(tree))), depth + 1)
+        self.assertEqual(len(list(tb.tree_phrasalnodes(tree))), depth)
+        self.assertEqual(len(tb.tree_constituents(tree)), depth - 1)
+        self.assertEqual(tb.map_labels(tb.tree_copy(tree), str.lower)[0], "np")
+        self.assertEqual(tb.map_subtrees(tree, lambda x: x)[2], ["CC", "and"])
+        self.assertEqual(len(list(tb.tree_nodes(tb.prune(tree, binarise=True)))), 3 * depth + 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# python -m unittest tests.test_tb_compact
+
+import itertools
+import os
+import tempfile
+import unittest
+
+from tests.test_evaluate import TREE_TEXT
+from zscore import tb, tb_compact
+from zscore.utils_process_trees import extract_file_tokens
+
+SAMPLE = TREE_TEXT + """
+( (CODE (SYM SpeakerA1) (. .) ))
+( (S (INTJ (UH Uh) (, ,)) (NP-SBJ-1 (PRP I)) (VP (VBD saw) (NP (XX MUMBLEx)) (-NONE- *T*-1)) (. .) (-DFL- E_S) ))
+( (S (X a b) (NP) (PRN (-LRB- -LRB-) (NP (NN aside)) (-RRB- -RRB-)) (. .)))
+"""
+
+
+class TestCompactForest(unittest.TestCase):
+    def setUp(self):
+        self.trees = tb.string_trees(SAMPLE)
+        self.forest = tb_compact.string_forest(SAMPLE)
+
+    def test_round_trip(self):
+        self.assertEqual(self.forest.to_trees(), self.trees)
+        self.assertEqual(tb_compact.from_trees(self.trees).to_trees(), self.trees)
+        for s in ["", "(S (X a b) ) ) (S (Y c))", "(S (NP (NN unclosed)", "( () (NP) x y)"]:
+            self.assertEqual(tb_compact.string_forest(s).to_trees(), tb.string_trees(s), repr(s))
+
+    def test_links(self):
+        forest = tb_compact.string_forest("(S (NP (NN a)) (VP b) c)")
+        self.assertEqual(forest.children(0), [1, 4, 6])
+        self.assertEqual(forest.parent.tolist(), [-1, 0, 1, 2, 0, 4, 0])
+        self.assertEqual(forest.end.tolist(), [7, 4, 4, 4, 6, 6, 7])
+        self.assertEqual(forest.subtree(4), ["VP", "b"])
+
+    def test_traversals_match_tb(self):
+        for k, tree in enumerate(self.trees):
+            root = self.forest.roots[k]
+            self.assertEqual(tb_compact.tree_terminals(self.forest, root), list(tb.tree_terminals(tree)))
+            self.assertEqual([self.forest.subtree(i) for i in tb_compact.tree_preterminalnodes(self.forest, root)],
+                             list(tb.tree_preterminalnodes(tree)))
+            for flags in itertools.product((False, True), repeat=4):
+                options = dict(zip(("include_root", "include_terminals", "include_preterminals",
+                                    "ignore_punctuation"), flags))
+                self.assertEqual(tb_compact.tree_constituents(self.forest, root, **options),
+                                 tb.tree_constituents(tree, **options), options)
+
+    def test_extract_tokens_matches_nested_lists(self):
+        for return_tags in (False, True):
+            compact = tb_compact.extract_tokens(self.forest, return_tags)
+            nested = extract_file_tokens(self.trees, return_tags)
+            for k in range(len(self.trees)):
+                self.assertEqual(compact.tree(k), nested.tree(k))
+        compact = tb_compact.extract_tokens(self.forest, return_spans=True)
+        self.assertEqual(compact.spans.tolist(), extract_file_tokens(self.trees, return_spans=True).spans.tolist())
+
+    def test_read_files_shares_strings(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = []
+            for name, text in (("sw1111.mrg", TREE_TEXT), ("sw2222.mrg", SAMPLE)):
+                paths.append(os.path.join(tmpdir, name))
+                with open(paths[-1], "w") as f:
+                    f.write("*x* header *x*\n\n" + text)
+            forest, offsets = tb_compact.read_files(paths)
+            self.assertEqual(offsets.tolist(), [0, 1, 1 + len(self.trees)])
+            self.assertEqual(forest.to_trees(), tb.read_file(paths[0]) + tb.read_file(paths[1]))
+            self.assertEqual(len(forest.strings), len(set(forest.strings)))
+
+
+if __name__ == "__main__":
+    unittest.main()
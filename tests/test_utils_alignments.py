@@ -0,0 +1,131 @@
+# python -m unittest tests.test_utils_alignments
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from tests.test_evaluate import write_trees
+from zscore.utils_alignments import AlignmentStore, AlignmentWriter, main
+from zscore.utils_evaluate import COUNT_COLUMNS, METRIC_COLUMNS, SPAN_METRIC_COLUMNS, align, e_prf
+from zscore.utils_references import ReferenceCache
+from zscore.utils_results import ResultCache
+from zscore.zscore import evaluate_file
+
+
+class TestAlignmentStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.base = self.tmpdir.name
+        write_trees(self.base, ["sw9999.mrg", "sw8888.mrg"])
+        write_trees(self.base, ["sw7777.mrg"], tree_text="( (CODE (SYM SpeakerA1) (. .) ))")  # no tokens
+        self.csv_path = os.path.join(self.base, "test.csv")
+        self.texts = {
+            "generated-text-a": ["but she was truly aware", "she was truly aware", "uh", None, "", "i mean but aware"],
+            "generated-text-b": ["I mean but she was truly", "", "uh", "she was truly aware", "um", "but she was"],
+        }
+        pd.DataFrame({
+            "filename": ["sw9999.mrg", "sw8888.mrg", "sw0000.mrg", "sw9999.mrg", "sw7777.mrg", "sw8888.mrg"],
+            **self.texts,
+        }).to_csv(self.csv_path, index=False)
+        self.eval_path = os.path.join(self.base, "eval__test.csv")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def evaluate(self, store_path, **options):
+        evaluate_file(self.csv_path, cache=ReferenceCache(base_dir=self.base), group_by_file=True, with_counts=True,
+                      span_metrics=True, text_columns=list(self.texts), alignments=store_path, **options)
+        return pd.read_csv(self.eval_path)
+
+    def test_rescoring_matches_evaluation(self):
+        for fmt, options in (("arrow", {}), ("parquet", {"workers": 2, "chunk_size": 1, "stream_rows": 4})):
+            store_path = os.path.join(self.base, f"alignments_{fmt}")
+            scored = self.evaluate(store_path, alignments_format=fmt, **options)
+            store = AlignmentStore(store_path)
+            self.assertEqual((store.systems, store.n_rows, store.complete), (["a", "b"], 6, True))
+            self.assertEqual(sorted(store.file_ids()), ["sw7777.mrg", "sw8888.mrg", "sw9999.mrg"])
+
+            for system in store.systems:
+                metrics = store.metrics(system, span_metrics=True, with_counts=True)
+                for column in METRIC_COLUMNS + SPAN_METRIC_COLUMNS + COUNT_COLUMNS:
+                    np.testing.assert_allclose(metrics[column], scored[f"{column}__{system}"], err_msg=column)
+            self.assertTrue(np.isnan(store.counts()[:, 2]).all())  # sw0000 has no reference
+            self.assertEqual(store.counts()[0, 4].tolist(), [0] * len(COUNT_COLUMNS))  # scored, but nothing to count
+
+    def test_alignments_round_trip(self):
+        store_path = os.path.join(self.base, "alignments")
+        self.evaluate(store_path)
+        store = AlignmentStore(store_path)
+        cache = ReferenceCache(base_dir=self.base)
+        tokens, tags, spans = cache.get("sw9999.mrg", with_spans=True)
+
+        alignments = {}
+        for batch in store.batches(["sw9999.mrg"]):
+            for k in range(len(batch)):
+                alignments[batch.systems[k], batch.rows[k]] = batch.alignment(k)
+        self.assertEqual(sorted(alignments), [(0, 0), (0, 3), (1, 0), (1, 3)])
+        expected = align(tokens, tags, "I mean but she was truly", disfluent_spans=spans)
+        pd.testing.assert_frame_equal(alignments[1, 0].to_dataframe(), expected.to_dataframe())
+        np.testing.assert_array_equal(alignments[1, 0].span_ids, expected.span_ids)
+
+        rescored = store.map_alignments(e_prf, system="b", width=3)
+        np.testing.assert_allclose(rescored[0], e_prf(expected))
+        removed = store.map_batches(lambda batch: np.add.reduceat(batch.pred_mask == 1, batch.offsets[:-1]))
+        self.assertEqual(removed[1, 0], int((expected.pred_mask == 1).sum()))
+        self.assertTrue(np.isnan(removed[:, 2]).all())
+
+    def test_corpus_scores_are_json(self):
+        store_path = os.path.join(self.base, "alignments")
+        with AlignmentWriter(store_path) as writer:  # no EDITED or PRN tokens, so their scores are NaN
+            writer.add(0, 0, "sw9999.mrg", align(["uh", "yes"], ["INTJ", "NONE"], "yes"))
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main([store_path, "--spans"])
+        result = json.loads(out.getvalue(), parse_constant=self.fail)["generated-text"]
+        self.assertIsNone(result["micro"]["z_e"])
+        self.assertEqual(result["micro"]["z_i"], 1.0)
+
+    def test_every_row_is_aligned_with_a_result_cache(self):
+        result_cache = ResultCache(os.path.join(self.base, "results.sqlite"))
+        evaluate_file(self.csv_path, cache=ReferenceCache(base_dir=self.base), result_cache=result_cache,
+                      text_columns=list(self.texts))
+        store_path = os.path.join(self.base, "alignments")
+        evaluate_file(self.csv_path, cache=ReferenceCache(base_dir=self.base), result_cache=result_cache,
+                      alignments=store_path, text_columns=list(self.texts))
+        self.assertEqual(np.isnan(AlignmentStore(store_path).counts()[:, :, 0]).sum(), 2)  # only sw0000's rows
+
+    def test_writer_replaces_only_alignment_stores(self):
+        store_path = os.path.join(self.base, "alignments")
+        with AlignmentWriter(store_path) as writer:
+            writer.add(0, 0, "sw9999.mrg", align(["uh", "yes"], ["INTJ", "NONE"], "yes"))
+        with AlignmentWriter(store_path, fmt="parquet"):
+            pass
+        self.assertEqual(AlignmentStore(store_path).file_ids(), [])
+        with self.assertRaises(FileExistsError):
+            AlignmentWriter(self.base)
+
+        # a store that also holds other files, or an unreadable marker, is left alone
+        notes = os.path.join(store_path, "notes.txt")
+        with open(notes, "w") as f:
+            f.write("keep me")
+        with self.assertRaises(FileExistsError):
+            AlignmentWriter(store_path)
+        self.assertTrue(os.path.exists(notes))
+        other = os.path.join(self.base, "other")
+        os.makedirs(other)
+        with open(os.path.join(other, "_alignments.json"), "w") as f:
+            f.write("not a store")
+        with self.assertRaises(FileExistsError):
+            AlignmentWriter(other)
+        with self.assertRaises(ValueError):
+            AlignmentWriter(os.path.join(self.base, "missing"), fmt="csv")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+# python -m unittest tests.test_utils_diff
+
+import unittest
+import random
+from difflib import SequenceMatcher
+from unittest import mock
+
+from zscore import tb, utils_diff
+from zscore.utils_diff import IntSequenceMatcher, SequenceIndex, sequence_matcher
+from zscore.utils_dirs import TREEBANK_SAMPLE_MRG_FILE
+from zscore.utils_evaluate import align
+from zscore.utils_process_trees import extract_tokens
+
+def difflib_opcodes(a, b):
+    return SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+
+class TestIntSequenceMatcher(unittest.TestCase):
+    def setUp(self):
+        # exercise the NumPy path even on inputs small enough for the difflib fallback
+        patcher = mock.patch.object(utils_diff, "MIN_AREA", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_same_as_difflib(self, a, b):
+        self.assertEqual(IntSequenceMatcher(a, b).get_opcodes(), difflib_opcodes(a, b), (a, b))
+
+    def test_random_small_vocabularies(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            vocab = rng.randint(1, 8)
+            a = [rng.randint(0, vocab) for _ in range(rng.randint(0, 40))]
+            b = [rng.randint(0, vocab) for _ in range(rng.randint(0, 40))]
+            self.assert_same_as_difflib(a, b)
+
+    def test_random_long_edits(self):
+        rng = random.Random(1)
+        for _ in range(200):
+            vocab = rng.choice([2, 5, 50, 500])
+            a = [rng.randint(0, vocab) for _ in range(rng.randint(200, 600))]
+            b = [x for x in a if rng.random() < 0.8] + [rng.randint(0, vocab) for _ in range(rng.randint(0, 20))]
+            self.assert_same_as_difflib(a, b)
+
+    def test_find_longest_match(self):
+        rng = random.Random(2)
+        for _ in range(500):
+            a = [rng.randint(0, 4) for _ in range(rng.randint(1, 30))]
+            b = [rng.randint(0, 4) for _ in range(rng.randint(1, 30))]
+            alo, blo = rng.randint(0, len(a)), rng.randint(0, len(b))
+            expected = SequenceMatcher(None, a, b, autojunk=False).find_longest_match(alo, len(a), blo, len(b))
+            self.assertEqual(IntSequenceMatcher(a, b).find_longest_match(alo, len(a), blo, len(b)), expected)
+
+    def test_shared_index(self):
+        rng = random.Random(3)
+        a = [rng.randint(0, 20) for _ in range(300)]
+        index = SequenceIndex(a)
+        for _ in range(50):
+            b = [x for x in a if rng.random() < 0.7] + [rng.randint(0, 30) for _ in range(rng.randint(0, 10))]
+            self.assertEqual(IntSequenceMatcher(a, b, index=index).get_opcodes(), difflib_opcodes(a, b))
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            sequence_matcher([], [], engine="myers")
+
+    @unittest.skipUnless(TREEBANK_SAMPLE_MRG_FILE.exists(), "Switchboard sample file not available")
+    def test_sample_conversation(self):
+        tokens, tags = [], []
+        for tree in tb.read_file(TREEBANK_SAMPLE_MRG_FILE):
+            for token, tag in extract_tokens(tree, return_tags=True)[2]:
+                tokens.append(token)
+                tags.append(tag)
+        rng = random.Random(3)
+        fluent = " ".join(w for w, t in zip(tokens, tags) if t == "NONE" or rng.random() < 0.3)
+        for generated in (fluent, " ".join(tokens), " ".join(reversed(tokens))):
+            int_alignment = align(tokens, tags, generated, engine="int")
+            difflib_alignment = align(tokens, tags, generated, engine="difflib")
+            self.assertEqual(int_alignment.w_g, difflib_alignment.w_g)
+            self.assertEqual(int_alignment.w_d, difflib_alignment.w_d)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# python -m unittest tests.test_utils_flatten
+
+import os
+import tempfile
+import unittest
+
+from tests.test_evaluate import TREE_TEXT, write_trees
+from zscore.utils_flatten import build_flat_corpus, flat_paths
+from zscore.utils_process_trees import get_text_dual_from_file
+
+
+class TestFlatCorpus(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.mrg_dir = os.path.join(self.tmpdir.name, "mrg")
+        self.out_dir = os.path.join(self.tmpdir.name, "flat")
+        write_trees(self.mrg_dir, ["sw9999.mrg", "sw8888.mrg"])
+        write_trees(self.mrg_dir, ["sw7777.mrg"], tree_text=TREE_TEXT + "\n" + TREE_TEXT)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def mrg_path(self, name):
+        return os.path.join(self.mrg_dir, name[2], name)
+
+    def read_texts(self, name):
+        texts = []
+        for path in flat_paths(self.out_dir, name):
+            with open(path, encoding="utf-8") as f:
+                texts.append(f.read().rstrip("\n"))
+        return tuple(texts)
+
+    def test_texts_match_get_text_dual(self):
+        self.assertEqual(build_flat_corpus(self.mrg_dir, self.out_dir, workers=2),
+                         {"built": 3, "unchanged": 0, "removed": 0})
+        for name in ("sw9999.mrg", "sw7777.mrg"):
+            self.assertEqual(self.read_texts(name), get_text_dual_from_file(self.mrg_path(name)))
+
+    def test_only_changed_files_are_rebuilt(self):
+        build_flat_corpus(self.mrg_dir, self.out_dir)
+        self.assertEqual(build_flat_corpus(self.mrg_dir, self.out_dir)["built"], 0)
+
+        os.utime(self.mrg_path("sw9999.mrg"), ns=(0, 0))  # new mtime, same content
+        self.assertEqual(build_flat_corpus(self.mrg_dir, self.out_dir)["built"], 0)
+
+        write_trees(self.mrg_dir, ["sw8888.mrg"], tree_text=TREE_TEXT.replace("she", "he"))
+        os.remove(self.mrg_path("sw7777.mrg"))
+        self.assertEqual(build_flat_corpus(self.mrg_dir, self.out_dir),
+                         {"built": 1, "unchanged": 1, "removed": 1})
+        self.assertIn(" he ", self.read_texts("sw8888.mrg")[1])
+        self.assertFalse(any(os.path.exists(path) for path in flat_paths(self.out_dir, "sw7777.mrg")))
+
+        os.remove(flat_paths(self.out_dir, "sw9999.mrg")[0])
+        self.assertEqual(build_flat_corpus(self.mrg_dir, self.out_dir)["built"], 1)
+        self.assertEqual(build_flat_corpus(self.mrg_dir, self.out_dir, force=True)["built"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
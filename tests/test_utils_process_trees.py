@@ -1,6 +1,7 @@
 import unittest
 import re
 
+from zscore import tb
 from zscore.utils_process_trees import *
 from zscore.utils_dirs import *
 
@@ -79,6 +80,35 @@ class TestProcessingPipeline(unittest.TestCase):
         result = get_leaves_from_preterminals(tree)
         self.assertEqual(result, [])
 
+    def test_tags_follow_top_most_disfluent_node(self):
+        tree = ['S', ['INTJ', ['UH', 'uh']], ['EDITED', ['PRN', ['PRP', 'I']], [',', ',']],
+                ['NP', ['PRP', 'we']], ['UH', 'MUMBLEx'], ['-NONE-', '*'], ['.', '.']]
+        fluent, disfluent, pairs = extract_tokens(tree, return_tags=True)
+        self.assertEqual(fluent, ['we', '.'])
+        self.assertEqual(disfluent, ['uh', 'I', ',', 'we', '.'])
+        self.assertEqual(pairs, [('uh', 'INTJ'), ('I', 'EDITED'), ('we', 'NONE')])
+
+    def test_file_tokens_match_per_tree_extraction(self):
+        trees = tb.string_trees("""
+            ( (CODE (SYM SpeakerA1) (. .) ))
+            ( (S (EDITED (RM (-DFL- \\[)) (NP (PRP she)) (IP (-DFL- \\+))) (NP (PRP she)) (VP (VBD was)) (. .)))
+            ( (INTJ (UH Yeah) (, ,) (-DFL- E_S) ))
+            """)
+        for return_tags in (False, True):
+            file_tokens = extract_file_tokens(trees, return_tags=return_tags)
+            self.assertEqual(len(file_tokens), 3)
+            for k, tree in enumerate(trees):
+                self.assertEqual(file_tokens.tree(k), extract_tokens(tree, return_tags=return_tags))
+        self.assertEqual(file_tokens.tag_offsets.tolist(), [0, 0, 3, 4])
+
+    def test_deep_tree_does_not_recurse(self):
+        depth = 5000
+        tree = ['NP', 'word']
+        for _ in range(depth):
+            tree = ['EDITED', tree]
+        self.assertEqual(extract_tokens(tree, return_tags=True), ([], ['word'], [('word', 'EDITED')]))
+        self.assertEqual(get_leaves_from_preterminals(tree), ['word'])
+
     def test_clean_sentence_spacing(self):
         tokens = ['I', 'saw', 'it', ',', 'okay', '.', 'Bye', '!']
         cleaned = clean_sentence(tokens)
@@ -0,0 +1,97 @@
+# python -m unittest tests.test_utils_profile
+
+import io
+import json
+import os
+import pstats
+import tempfile
+import unittest
+
+import pandas as pd
+
+from tests.test_evaluate import TREE_TEXT, write_trees
+from zscore.utils_profile import StageTimer, active_timer, recording, stage
+from zscore.utils_references import ReferenceCache
+from zscore.utils_results import ResultCache
+from zscore.zscore import evaluate_file
+
+
+class TestStageTimer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.base = self.tmpdir.name
+        write_trees(self.base, ["sw9999.mrg"])
+        write_trees(self.base, ["sw8888.mrg"], tree_text=TREE_TEXT + "\n" + TREE_TEXT)
+        self.csv_path = os.path.join(self.base, "test.csv")
+        pd.DataFrame({
+            "filename": ["sw9999.mrg", "sw8888.mrg", "sw0000.mrg", "sw9999.mrg"] * 3,
+            "generated-text": ["but she was truly aware", "I mean but she was truly aware", "uh", "she was"] * 3,
+        }).to_csv(self.csv_path, index=False)
+        self.eval_path = os.path.join(self.base, "eval__test.csv")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_stage_is_a_no_op_without_timer(self):
+        self.assertIsNone(active_timer())
+        with stage("anything") as timed:
+            timed.add(3)
+        timer = StageTimer()
+        with recording(timer):
+            with stage("anything") as timed:
+                timed.add(3)
+        self.assertIsNone(active_timer())
+        self.assertEqual(timer.stages["anything"][1:], [1, 3])
+
+    def test_evaluate_file_records_stages(self):
+        evaluate_file(self.csv_path, cache=ReferenceCache(base_dir=self.base))
+        plain = pd.read_csv(self.eval_path)
+
+        timer = StageTimer(report_every=0, stream=io.StringIO())
+        evaluate_file(self.csv_path, cache=ReferenceCache(base_dir=self.base), timer=timer)
+        pd.testing.assert_frame_equal(pd.read_csv(self.eval_path), plain)
+
+        summary = timer.summary()
+        self.assertEqual((summary["rows"], timer.total_rows), (12, 12))
+        for name in ("read_csv", "score", "align", "tokenize", "diff", "masks", "counts", "tb.read_file"):
+            self.assertIn(name, summary["stages"])
+        self.assertEqual(summary["stages"]["align"]["calls"], 9)  # sw0000 has no reference
+        self.assertEqual(summary["stages"]["tb.read_file"]["calls"], 2 + 3)  # two parsed, three failed reads
+        self.assertIn("ETA", timer.stream.getvalue())
+
+        json_path = os.path.join(self.base, "timings.json")
+        timer.write_json(json_path)
+        with open(json_path) as f:
+            self.assertEqual(json.load(f)["rows"], 12)
+
+    def test_parallel_stages_are_merged(self):
+        timer = StageTimer()
+        evaluate_file(self.csv_path, cache=ReferenceCache(base_dir=self.base), workers=2, chunk_size=3, timer=timer)
+        self.assertEqual(timer.rows, 12)
+        self.assertEqual(timer.stages["align"][1], 9)
+
+    def test_rows_served_from_the_result_cache_are_counted(self):
+        result_cache = ResultCache(os.path.join(self.base, "results.sqlite"))
+        for workers in (1, 1, 2):  # cold, then warm
+            timer = StageTimer()
+            evaluate_file(self.csv_path, cache=ReferenceCache(base_dir=self.base), workers=workers,
+                          result_cache=result_cache, timer=timer)
+            self.assertEqual(timer.rows, 12)
+            self.assertEqual("align" in timer.stages, workers == 1 and not result_cache.hits)  # warm runs align nothing
+
+    def test_profile_modes_write_files(self):
+        stats_path = os.path.join(self.base, "run.prof")
+        evaluate_file(self.csv_path, cache=ReferenceCache(base_dir=self.base), profile=stats_path)
+        self.assertGreater(pstats.Stats(stats_path).total_calls, 0)
+
+        stacks_path = os.path.join(self.base, "run.stacks")
+        evaluate_file(self.csv_path, cache=ReferenceCache(base_dir=self.base), profile=stacks_path,
+                      profile_mode="stacks")
+        self.assertTrue(os.path.exists(stacks_path))
+        with self.assertRaises(ValueError):
+            evaluate_file(self.csv_path, cache=ReferenceCache(base_dir=self.base), profile=stacks_path,
+                          profile_mode="perf")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+# python -m unittest tests.test_utils_results
+
+import os
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from tests.test_evaluate import write_trees
+from zscore.utils_evaluate import COUNT_COLUMNS
+from zscore.utils_references import ReferenceCache, ReferenceStore, build_reference_store
+from zscore.utils_results import ResultCache, result_key
+from zscore.zscore import evaluate_file
+
+N_COUNTS = len(COUNT_COLUMNS)
+
+
+def write_entries(path, worker):
+    cache = ResultCache(path)
+    for batch in range(20):
+        cache.put_many((f"{worker}-{batch}-{k}".encode(), np.full(N_COUNTS, k)) for k in range(10))
+    return len(cache)
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.base = self.tmpdir.name
+        self.path = os.path.join(self.base, "results.sqlite")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_keys_ignore_what_align_ignores(self):
+        self.assertEqual(result_key("abc", "Uh, I mean it."), result_key("abc", "uh I mean it"))
+        self.assertNotEqual(result_key("abc", "uh I mean it"), result_key("abd", "uh I mean it"))
+        self.assertNotEqual(result_key("abc", "uh I mean it"), result_key("abc", "uh I mean it", version="0"))
+
+    def test_round_trip_skips_failed_rows(self):
+        cache = ResultCache(self.path)
+        cache.put_many([(b"a", np.arange(N_COUNTS)), (b"b", np.full(N_COUNTS, np.nan))])
+        found = cache.get_many([b"a", b"b"])
+        self.assertEqual(list(found), [b"a"])
+        np.testing.assert_array_equal(found[b"a"], np.arange(N_COUNTS))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_rows_of_another_width_are_misses(self):
+        cache = ResultCache(self.path)
+        old_width = np.zeros(10, dtype=np.int64).tobytes()  # before the span counts were added
+        cache._connect().execute("INSERT INTO results (key, counts, used) VALUES (?, ?, 0)", (b"a", old_width))
+        self.assertEqual(cache.get_many([b"a"]), {})
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    def test_evicts_least_recently_used(self):
+        cache = ResultCache(self.path, max_entries=3)
+        for key in (b"a", b"b", b"c"):
+            cache.put_many([(key, np.zeros(N_COUNTS))])
+        cache.get_many([b"a"])
+        cache.put_many([(b"d", np.zeros(N_COUNTS))])
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(sorted(cache.get_many([b"a", b"b", b"c", b"d"])), [b"a", b"c", b"d"])
+
+    def test_concurrent_writers(self):
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            list(executor.map(write_entries, [self.path] * 4, range(4)))
+        self.assertEqual(len(ResultCache(self.path)), 4 * 20 * 10)
+
+    def test_evaluate_file_reuses_unchanged_rows(self):
+        write_trees(self.base, ["sw9999.mrg"])
+        csv_path = os.path.join(self.base, "test.csv")
+        eval_path = os.path.join(self.base, "eval__test.csv")
+        rows = {
+            "filename": ["sw9999.mrg", "sw9999.mrg", "sw0000.mrg"],
+            "generated-text": ["but she was truly aware", "I mean but she was truly", "uh"],
+        }
+        pd.DataFrame(rows).to_csv(csv_path, index=False)
+        evaluate_file(csv_path, cache=ReferenceCache(base_dir=self.base), result_cache=ResultCache(self.path))
+
+        rows["generated-text"][1] = "she was truly aware"
+        pd.DataFrame(rows).to_csv(csv_path, index=False)
+        evaluate_file(csv_path, cache=ReferenceCache(base_dir=self.base))
+        expected = pd.read_csv(eval_path)
+
+        result_cache = ResultCache(self.path)
+        evaluate_file(csv_path, cache=ReferenceCache(base_dir=self.base), workers=2, result_cache=result_cache)
+        pd.testing.assert_frame_equal(pd.read_csv(eval_path), expected)
+        self.assertEqual((result_cache.hits, result_cache.misses, len(result_cache)), (1, 1, 3))
+
+        # rows cached before COUNT_COLUMNS grew are re-scored, not served at their old width
+        with result_cache._connect() as conn:
+            conn.execute("UPDATE results SET counts = substr(counts, 1, 80)")
+        result_cache = ResultCache(self.path)
+        evaluate_file(csv_path, cache=ReferenceCache(base_dir=self.base), result_cache=result_cache)
+        pd.testing.assert_frame_equal(pd.read_csv(eval_path), expected)
+        self.assertEqual((result_cache.hits, result_cache.misses), (0, 2))
+
+        # a reference store compiled from the same files hits the same entries
+        store_path = os.path.join(self.base, "refs.zsr")
+        build_reference_store(self.base, store_path)
+        result_cache = ResultCache(self.path)
+        evaluate_file(csv_path, cache=ReferenceStore(store_path), result_cache=result_cache)
+        pd.testing.assert_frame_equal(pd.read_csv(eval_path), expected)
+        self.assertEqual(result_cache.hits, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
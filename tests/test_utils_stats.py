@@ -0,0 +1,69 @@
+# python -m unittest tests.test_utils_stats
+
+import unittest
+import numpy as np
+
+from zscore.utils_evaluate import CorpusAggregator
+from zscore.utils_stats import bootstrap_ci, paired_bootstrap, permutation_test
+
+def synthetic_counts(n_rows, removal_rate, seed):
+    rng = np.random.default_rng(seed)
+    totals = rng.integers(0, 10, size=(n_rows, 3))
+    removed = rng.binomial(totals, removal_rate)
+    tp = removed.sum(axis=1)
+    fn = totals.sum(axis=1) - tp
+    fp = rng.integers(0, 3, size=n_rows)
+    tn = rng.integers(20, 60, size=n_rows)
+    class_counts = [col for pair in zip(totals.T, removed.T) for col in pair]
+    spans = (totals + 1) // 2
+    full = rng.binomial(spans, removal_rate)
+    partial = rng.binomial(spans - full, 0.5)
+    span_counts = [col for triple in zip(spans.T, full.T, partial.T) for col in triple]
+    return np.column_stack([tp, fp, fn, tn] + class_counts + span_counts)
+
+class TestBootstrap(unittest.TestCase):
+    def test_ci_brackets_corpus_scores(self):
+        counts = synthetic_counts(500, 0.7, seed=0)
+        aggregator = CorpusAggregator()
+        aggregator.add_many(counts)
+        result = aggregator.result()
+
+        for average in ("micro", "macro"):
+            intervals = bootstrap_ci(counts, n_resamples=500, average=average, seed=1)
+            self.assertEqual(set(intervals), {"e_p", "e_r", "e_f", "z_e", "z_i", "z_p"})
+            for metric, (score, low, high) in intervals.items():
+                self.assertAlmostEqual(score, result[average][metric])
+                self.assertLessEqual(low, score)
+                self.assertLessEqual(score, high)
+
+    def test_seed_is_reproducible(self):
+        counts = synthetic_counts(100, 0.5, seed=0)
+        self.assertEqual(bootstrap_ci(counts, n_resamples=50, seed=3), bootstrap_ci(counts, n_resamples=50, seed=3))
+
+class TestPairedTests(unittest.TestCase):
+    def test_identical_systems(self):
+        counts = synthetic_counts(300, 0.6, seed=0)
+        for metric, (difference, p_value) in permutation_test(counts, counts, n_resamples=200, seed=0).items():
+            self.assertEqual(difference, 0.0)
+            self.assertEqual(p_value, 1.0)
+
+    def test_better_system_is_significant(self):
+        a = synthetic_counts(400, 0.5, seed=0)
+        b = a.copy()
+        b[:, 0] += a[:, 2] // 2  # b removes half of what a missed
+        b[:, 2] -= a[:, 2] // 2
+
+        difference, p_value = permutation_test(a, b, n_resamples=500, seed=0)["e_r"]
+        self.assertGreater(difference, 0)
+        self.assertLess(p_value, 0.01)
+
+        difference, low, high, p_value = paired_bootstrap(a, b, n_resamples=500, seed=0)["e_r"]
+        self.assertGreater(low, 0)
+        self.assertLess(p_value, 0.01)
+
+    def test_row_count_mismatch(self):
+        with self.assertRaises(ValueError):
+            permutation_test(synthetic_counts(10, 0.5, 0), synthetic_counts(11, 0.5, 0), n_resamples=10)
+
+if __name__ == "__main__":
+    unittest.main()